@@ -0,0 +1,8 @@
+"""
+Performance benchmarks for the backend.
+
+    python -m benchmarks.run run --out bench.json              # measure
+    python -m benchmarks.run compare baseline.json bench.json  # fail on regressions
+
+Run from backend/ with the model artifacts in place.
+"""
@@ -0,0 +1,188 @@
+"""
+Time the scoring, feature engineering, catalog matching and CSV upload paths
+at several input sizes, and compare runs against a stored baseline.
+
+Every case reports the best-of-N wall-clock time, rows (or calls) per
+second, and the peak Python heap allocation (tracemalloc, which also sees
+NumPy buffers) of one extra run. Inputs are regenerated with a new seed for
+every run so the prediction cache never serves a timed request.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import MODEL_COLUMNS, koi_frame, nasa_records
+
+SIZES = {
+    'predict_one': [1, 100],
+    'predict_batch': [1, 100, 1000, 10000],
+    'add_physics_features': [1000, 10000, 100000],
+    'preprocess_features': [1000, 10000, 100000],
+    'detect_single_exoplanet': [1, 100, 1000],
+    'csv_endpoint': [100, 1000, 10000],
+}
+QUICK_SIZES = {name: sizes[:2] for name, sizes in SIZES.items()}
+
+CATALOG_SIZE = 10000
+
+
+def measure(run, make_input, repeats):
+    """Best time over repeats (after one untimed warm-up run) and the peak heap of one more run."""
+    run(make_input(0))
+    times = []
+    for i in range(1, repeats + 1):
+        data = make_input(i)
+        gc.collect()
+        started = time.perf_counter()
+        run(data)
+        times.append(time.perf_counter() - started)
+
+    data = make_input(repeats + 1)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def build_cases(catalog_size):
+    """{name: (run(input), make_input(size, seed))}. Imports main with a synthetic catalog."""
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    catalog_path = os.path.join(workdir, 'NASA.json')
+    with open(catalog_path, 'w') as file:
+        json.dump(nasa_records(catalog_size), file)
+    os.environ['NASA_CATALOG_PATH'] = catalog_path
+    os.environ['NASA_CATALOG_STORE'] = os.path.join(workdir, 'catalog_store')
+    os.environ.setdefault('MODEL_WARMUP', '0')
+
+    from fastapi.testclient import TestClient
+
+    import main
+    from model_training.feature_engineering import add_physics_features, preprocess_features
+    from model_training.inference import predict_batch, predict_one
+
+    client = TestClient(main.app)
+
+    def csv_upload(text):
+        response = client.post('/api/exoplanet-detection-csv', files={'file': ('bench.csv', text, 'text/csv')})
+        response.raise_for_status()
+
+    return {
+        'predict_one': (
+            lambda rows: [predict_one(row) for row in rows],
+            lambda size, seed: koi_frame(size, seed).to_dict('records'),
+        ),
+        'predict_batch': (predict_batch, koi_frame),
+        'add_physics_features': (add_physics_features, koi_frame),
+        # preprocess_features modifies its input, so every run gets a fresh frame
+        'preprocess_features': (preprocess_features, koi_frame),
+        'detect_single_exoplanet': (
+            lambda queries: [main.detect_single_exoplanet(*query) for query in queries],
+            lambda size, seed: list(koi_frame(size, seed, missing=False)[['koi_period', 'koi_impact', 'koi_depth']]
+                                    .itertuples(index=False, name=None)),
+        ),
+        'csv_endpoint': (
+            csv_upload,
+            lambda size, seed: koi_frame(size, seed)[MODEL_COLUMNS].to_csv(index=False),
+        ),
+    }
+
+
+def run_benchmarks(sizes, repeats, catalog_size=CATALOG_SIZE, only=None):
+    cases = build_cases(catalog_size)
+    results = {}
+    for name, (run, make_input) in cases.items():
+        if only and name not in only:
+            continue
+        for size in sizes[name]:
+            seconds, peak = measure(run, lambda i: make_input(size, 1000 * size + i), repeats)
+            key = f"{name}[{size}]"
+            results[key] = {
+                'size': size,
+                'seconds': round(seconds, 6),
+                'rows_per_second': round(size / seconds, 2),
+                'peak_memory_mb': round(peak / 2 ** 20, 3),
+            }
+            print(f"{key:32s} {seconds * 1000:10.2f} ms {size / seconds:14.1f} rows/s "
+                  f"{peak / 2 ** 20:10.2f} MB", flush=True)
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeats': repeats,
+            'catalog_size': catalog_size,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, throughput_threshold, memory_threshold):
+    """
+    Regressions of current against baseline: throughput down by more than
+    throughput_threshold, or peak memory up by more than memory_threshold
+    (fractions). Cases missing from either run are skipped.
+    """
+    regressions = []
+    for key, base in baseline['results'].items():
+        new = current['results'].get(key)
+        if new is None:
+            continue
+        speed = new['rows_per_second'] / base['rows_per_second']
+        memory = new['peak_memory_mb'] / base['peak_memory_mb'] if base['peak_memory_mb'] else 1.0
+        flags = []
+        if speed < 1 - throughput_threshold:
+            flags.append(f"throughput {speed - 1:+.1%}")
+        if memory > 1 + memory_threshold:
+            flags.append(f"memory {memory - 1:+.1%}")
+        print(f"{key:32s} throughput {speed - 1:+8.1%}  memory {memory - 1:+8.1%}  {'REGRESSION: ' + ', '.join(flags) if flags else 'ok'}")
+        if flags:
+            regressions.append((key, flags))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend performance benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help="run the benchmarks and write JSON results")
+    run.add_argument('--out', default='bench.json')
+    run.add_argument('--repeats', type=int, default=5)
+    run.add_argument('--quick', action='store_true', help="only the two smallest sizes per case")
+    run.add_argument('--only', nargs='+', choices=list(SIZES), help="run only these cases")
+    run.add_argument('--catalog-size', type=int, default=CATALOG_SIZE, help="synthetic NASA.json records")
+    cmp = subparsers.add_parser('compare', help="compare results with a baseline; exit 1 on regressions")
+    cmp.add_argument('baseline')
+    cmp.add_argument('current')
+    cmp.add_argument('--throughput-threshold', type=float, default=0.2, help="allowed throughput drop (fraction)")
+    cmp.add_argument('--memory-threshold', type=float, default=0.2, help="allowed peak memory growth (fraction)")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_benchmarks(QUICK_SIZES if args.quick else SIZES, args.repeats, args.catalog_size, args.only)
+        with open(args.out, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Wrote {args.out}")
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+        regressions = compare(baseline, current, args.throughput_threshold, args.memory_threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s)")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
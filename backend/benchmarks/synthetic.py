@@ -0,0 +1,63 @@
+"""
+Synthetic KOI data with roughly the distributions of the Kepler cumulative
+table, for benchmarks that must not depend on the network.
+"""
+import numpy as np
+import pandas as pd
+
+MODEL_COLUMNS = [
+    'koi_period', 'koi_time0bk', 'koi_duration', 'koi_depth', 'koi_prad',
+    'koi_impact', 'koi_model_snr', 'koi_score', 'koi_pdisposition_bin',
+    'koi_steff', 'koi_srad', 'koi_slogg'
+]
+
+DISPOSITIONS = np.array(['CONFIRMED', 'CANDIDATE', 'FALSE POSITIVE'])
+
+# Columns that are sometimes missing in the archive, and how often
+MISSING_RATES = {'koi_depth': 0.04, 'koi_prad': 0.04, 'koi_impact': 0.04, 'koi_model_snr': 0.04,
+                 'koi_score': 0.15, 'koi_steff': 0.04, 'koi_srad': 0.04, 'koi_slogg': 0.04}
+
+
+def koi_frame(n, seed=0, missing=True):
+    """n KOI rows with the 12 model columns (NaNs at archive-like rates when missing is set)."""
+    rng = np.random.default_rng(seed)
+    period = np.exp(rng.normal(np.log(12.0), 1.4, n)).clip(0.25, 1500)
+    df = pd.DataFrame({
+        'koi_period': period,
+        'koi_time0bk': rng.uniform(120, 600, n),
+        'koi_duration': np.exp(rng.normal(np.log(3.5), 0.6, n)).clip(0.3, 30),
+        'koi_depth': np.exp(rng.normal(np.log(450), 1.8, n)).clip(5, 1e6),
+        'koi_prad': np.exp(rng.normal(np.log(2.5), 1.1, n)).clip(0.2, 1e4),
+        'koi_impact': np.abs(rng.normal(0.45, 0.35, n)).clip(0, 1.5),
+        'koi_model_snr': np.exp(rng.normal(np.log(25), 1.3, n)).clip(1, 1e4),
+        'koi_score': rng.beta(0.5, 0.5, n),
+        'koi_pdisposition_bin': rng.integers(0, 2, n).astype(float),
+        'koi_steff': rng.normal(5650, 800, n).clip(2600, 12000),
+        'koi_srad': np.exp(rng.normal(0.0, 0.45, n)).clip(0.1, 150),
+        'koi_slogg': rng.normal(4.4, 0.3, n).clip(2.0, 5.3),
+    })
+    if missing:
+        for column, rate in MISSING_RATES.items():
+            df.loc[rng.random(n) < rate, column] = np.nan
+    return df
+
+
+def nasa_records(n, seed=0):
+    """n NASA.json-style catalog records (the fields CatalogStore is built from)."""
+    rng = np.random.default_rng(seed)
+    df = koi_frame(n, seed=seed, missing=False)
+    dispositions = DISPOSITIONS[rng.choice(3, n, p=[0.3, 0.2, 0.5])]
+    return [
+        {
+            'kepler_name': f"Kepler-{i + 1} b" if disposition == 'CONFIRMED' else None,
+            'koi_disposition': str(disposition),
+            'koi_score': round(float(score), 3),
+            'koi_period': float(period),
+            'koi_impact': round(float(impact), 3),
+            'koi_depth': round(float(depth), 1),
+            'koi_prad': round(float(prad), 2),
+        }
+        for i, (disposition, score, period, impact, depth, prad) in enumerate(zip(
+            dispositions, df['koi_score'], df['koi_period'], df['koi_impact'], df['koi_depth'], df['koi_prad']
+        ))
+    ]
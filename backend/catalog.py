@@ -0,0 +1,343 @@
+"""
+Columnar NASA KOI catalog store and the range index used for tolerance matching.
+
+NASA.json is converted once into a directory of .npy columns (strings are
+interned into a shared table and stored as int32 codes). Workers open the
+columns with mmap_mode='r', so every uvicorn worker shares the same pages.
+Each conversion lives in its own content-addressed version directory and
+CURRENT points at the active one, so a new catalog is swapped in atomically.
+Superseded versions are deleted after a swap: a store maps all of its files
+when it is opened, and mapped pages outlive the unlinked files, so workers
+still serving an older version are unaffected.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+MATCH_FIELDS = ('koi_period', 'koi_impact', 'koi_depth')
+# Versions (and abandoned temporary directories) younger than this are never
+# pruned, so a worker that has just converted one has time to open it
+PRUNE_GRACE_SECONDS = 60
+INDEX_ARRAYS = ('ids', 'period', 'impact', 'depth')
+
+
+class CatalogIndex:
+    """
+    Catalog rows sorted by koi_period. A ±tolerance query binary-searches
+    the period window and only checks impact/depth for the rows inside it,
+    so lookups cost O(log n + k) instead of a scan over the whole catalog.
+    """
+
+    def __init__(self, ids, period, impact, depth, tolerance=0.1):
+        self.tolerance = tolerance
+        self._ids = ids
+        self._period = period
+        self._impact = impact
+        self._depth = depth
+
+    @classmethod
+    def from_columns(cls, period, impact, depth, tolerance=0.1):
+        period = np.asarray(period, dtype=np.float64)
+        impact = np.asarray(impact, dtype=np.float64)
+        depth = np.asarray(depth, dtype=np.float64)
+
+        # Rows missing any of the matched fields can never match
+        rows = np.flatnonzero(~(np.isnan(period) | np.isnan(impact) | np.isnan(depth)))
+        order = rows[np.argsort(period[rows], kind='stable')]
+        return cls(order.astype(np.int64), period[order], impact[order], depth[order], tolerance)
+
+    def arrays(self):
+        return dict(zip(INDEX_ARRAYS, (self._ids, self._period, self._impact, self._depth)))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def match(self, period, impact, depth):
+        """Row numbers of every match, in catalog order."""
+        return self.match_many([period], [impact], [depth])[0]
+
+    def match_many(self, periods, impacts, depths):
+        """
+        Match many (period, impact, depth) triples at once. Uses the same
+        relative-tolerance rule as the original linear scan; non-positive
+        periods match nothing.
+        """
+        tolerance = self.tolerance
+        periods = np.asarray(periods, dtype=np.float64)
+        # Widen the search window slightly; the exact test below decides
+        spread = np.abs(periods) * tolerance * (1 + 1e-9)
+        starts = np.searchsorted(self._period, periods - spread, side='left')
+        stops = np.searchsorted(self._period, periods + spread, side='right')
+
+        matches = []
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for period, impact, depth, start, stop in zip(periods, impacts, depths, starts, stops):
+                if period <= 0 or start == stop:
+                    matches.append([])
+                    continue
+                window = slice(start, stop)
+                hit = (
+                    (np.abs(self._period[window] - period) / period <= tolerance)
+                    & (np.abs(self._impact[window] - impact) / max(impact, 0.001) <= tolerance)
+                    & (np.abs(self._depth[window] - depth) / depth <= tolerance)
+                )
+                matches.append(np.sort(self._ids[window][hit]).tolist())
+        return matches
+
+
+class CatalogStore:
+    """
+    Read-only, memory-mapped view of one converted catalog version.
+    """
+
+    def __init__(self, path, tolerance=0.1):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as file:
+            meta = json.load(file)
+        with open(os.path.join(path, 'strings.json'), 'r') as file:
+            self.strings = json.load(file)
+
+        self.version = meta['version']
+        self.fields = meta['fields']
+        self.numeric_fields = set(meta['numeric_fields'])
+        self.columns = {
+            field: np.load(os.path.join(path, f'{field}.npy'), mmap_mode='r')
+            for field in self.fields
+        }
+        self.index = CatalogIndex(
+            *(np.load(os.path.join(path, f'index_{name}.npy'), mmap_mode='r') for name in INDEX_ARRAYS),
+            tolerance=tolerance,
+        )
+        self._length = meta['rows']
+
+    def __len__(self):
+        return self._length
+
+    def value(self, field, row):
+        value = self.columns[field][row]
+        if field in self.numeric_fields:
+            return None if np.isnan(value) else float(value)
+        return None if value < 0 else self.strings[value]
+
+    def record(self, row):
+        """One catalog row as the dict NASA.json holds for it."""
+        return {field: self.value(field, row) for field in self.fields}
+
+
+def convert_catalog(source, store_root):
+    """
+    Convert a NASA.json-style list of records into a columnar version
+    directory under store_root and point CURRENT at it. Returns the
+    version directory; converting an unchanged file is a no-op. Raises
+    ValueError if the file is not a list of records with the match fields.
+    """
+    with open(source, 'rb') as file:
+        raw = file.read()
+    version = hashlib.sha256(raw).hexdigest()[:16]
+    target = os.path.join(store_root, version)
+
+    if not os.path.isdir(target):
+        records = json.loads(raw)
+        _validate_records(records)
+        os.makedirs(store_root, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=store_root)
+        try:
+            _write_columns(records, version, tmp)
+            os.rename(tmp, target)
+        except OSError:
+            # Another worker finished the same conversion first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(target):
+                raise
+
+    _set_current(store_root, version)
+    return target
+
+
+def _validate_records(records):
+    """Raise ValueError unless records is a list of objects whose match fields are numbers or null."""
+    if not isinstance(records, list):
+        raise ValueError(f"Catalog must be a list of records, not {type(records).__name__}")
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            raise ValueError(f"Catalog record {i} is {type(record).__name__}, not an object")
+        for field in MATCH_FIELDS:
+            if field not in record:
+                raise ValueError(f"Catalog record {i} has no {field}")
+            value = record[field]
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise ValueError(f"Catalog record {i} has a non-numeric {field}: {value!r}")
+
+
+def _write_columns(records, version, path):
+    fields = []
+    for record in records:
+        for field in record:
+            if field not in fields:
+                fields.append(field)
+
+    numeric_fields = [
+        field for field in fields
+        if all(isinstance(r.get(field), (int, float, type(None))) and not isinstance(r.get(field), bool) for r in records)
+    ]
+
+    strings = []
+    interned = {}
+    match_columns = {field: np.full(len(records), np.nan) for field in MATCH_FIELDS}
+    for field in fields:
+        values = [record.get(field) for record in records]
+        if field in numeric_fields:
+            column = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            if field in match_columns:
+                match_columns[field] = column
+        else:
+            codes = []
+            for v in values:
+                if v is None:
+                    codes.append(-1)
+                    continue
+                v = str(v)
+                if v not in interned:
+                    interned[v] = len(strings)
+                    strings.append(v)
+                codes.append(interned[v])
+            column = np.array(codes, dtype=np.int32)
+        np.save(os.path.join(path, f'{field}.npy'), column)
+
+    index = CatalogIndex.from_columns(*(match_columns[field] for field in MATCH_FIELDS))
+    for name, array in index.arrays().items():
+        np.save(os.path.join(path, f'index_{name}.npy'), array)
+
+    with open(os.path.join(path, 'strings.json'), 'w') as file:
+        json.dump(strings, file)
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump({
+            'version': version,
+            'rows': len(records),
+            'fields': fields,
+            'numeric_fields': numeric_fields,
+        }, file)
+
+
+def _set_current(store_root, version):
+    fd, tmp = tempfile.mkstemp(prefix='.CURRENT-', dir=store_root)
+    with os.fdopen(fd, 'w') as file:
+        file.write(version)
+    os.replace(tmp, os.path.join(store_root, 'CURRENT'))
+
+
+def prune_versions(store_root, keep, grace=PRUNE_GRACE_SECONDS):
+    """Delete every version directory except keep (and ones younger than grace seconds)."""
+    removed = []
+    for entry in os.scandir(store_root):
+        if entry.name == keep or not entry.is_dir():
+            continue
+        try:
+            if time.time() - entry.stat().st_mtime < grace:
+                continue
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed.append(entry.name)
+    return removed
+
+
+def open_current(store_root, tolerance=0.1):
+    """Open the version CURRENT points at, or None if there is none."""
+    try:
+        with open(os.path.join(store_root, 'CURRENT'), 'r') as file:
+            version = file.read().strip()
+        return CatalogStore(os.path.join(store_root, version), tolerance)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class CatalogHandle:
+    """
+    Hands out the active CatalogStore and hot-reloads it when the source
+    file changes. The source is checked at most every check_interval
+    seconds; a changed file is converted on a background thread while the
+    previous store keeps being served, then the reference is swapped (so
+    in-flight requests keep the store they started with) and superseded
+    versions are pruned.
+    """
+
+    def __init__(self, source, store_root, tolerance=0.1, check_interval=5.0):
+        self.source = source
+        self.store_root = store_root
+        self.tolerance = tolerance
+        self.check_interval = check_interval
+        self._store = None
+        self._source_stat = None
+        # The last source that failed to convert, so it is not retried every check
+        self._rejected_stat = None
+        self._checked_at = 0.0
+        self._converting = False
+        self._lock = threading.Lock()
+        self.reload()
+
+    def current(self):
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._check()
+        return self._store
+
+    def _source_changed(self):
+        """The source's (mtime, size) if it differs from the converted one, else None."""
+        try:
+            stat = os.stat(self.source)
+        except FileNotFoundError:
+            return None
+        source_stat = (stat.st_mtime_ns, stat.st_size)
+        return source_stat if source_stat not in (self._source_stat, self._rejected_stat) else None
+
+    def _check(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self._converting:
+                return
+            source_stat = self._source_changed()
+            if source_stat is None:
+                return
+            self._converting = True
+        threading.Thread(target=self._convert, args=(source_stat,), daemon=True, name="catalog-convert").start()
+
+    def _convert(self, source_stat):
+        try:
+            self._swap(source_stat)
+        finally:
+            with self._lock:
+                self._converting = False
+
+    def _swap(self, source_stat):
+        try:
+            path = convert_catalog(self.source, self.store_root)
+            store = CatalogStore(path, self.tolerance) if self._store is None or self._store.path != path else self._store
+        except (TypeError, KeyError, ValueError, OSError) as e:
+            # Keep serving the previous catalog (at startup, the last converted one) until a valid file lands
+            print(f"catalog: keeping the previous catalog, {self.source} is invalid: {e}", flush=True)
+            self._rejected_stat = source_stat
+            if self._store is None:
+                self._store = open_current(self.store_root, self.tolerance)
+            return self._store
+        self._store = store
+        self._source_stat = source_stat
+        prune_versions(self.store_root, os.path.basename(path))
+        return store
+
+    def reload(self):
+        """Convert a changed source now, on the calling thread (used at startup)."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            source_stat = self._source_changed()
+            if source_stat is None:
+                # Serve whatever was converted last, e.g. a store shipped without NASA.json
+                if self._store is None:
+                    self._store = open_current(self.store_root, self.tolerance)
+                return self._store
+            return self._swap(source_stat)
@@ -0,0 +1,175 @@
+"""
+Precomputed RA/Dec (ICRS, degrees) -> IAU constellation lookup.
+
+constellation_grid.npz holds the constellation astropy reports at the centre
+of every GRID_RESOLUTION x GRID_RESOLUTION degree cell, so a lookup is an
+array index and needs no astropy at runtime. Results agree with
+SkyCoord.get_constellation except for points within one cell of a
+constellation boundary (at most GRID_RESOLUTION * sqrt(2) / 2 degrees).
+
+Unpacked, the grid is a 3600 x 7200 uint8 array (26 MB). The first load
+writes it uncompressed next to the npz (constellation_grid-<hash>.npy) and
+every later load maps that file read-only, so all worker processes share
+one copy in the page cache. If the directory is read-only each process
+unpacks its own copy instead.
+
+    python constellations.py build   # regenerate the grid (needs astropy)
+    python constellations.py check   # compare against astropy; exits 1 on a mismatch away from a boundary
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+CONSTELLATION_GRID_PATH = os.environ.get(
+    "CONSTELLATION_GRID_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "constellation_grid.npz")
+)
+GRID_RESOLUTION = 0.05  # degrees
+
+
+class ConstellationGrid:
+    def __init__(self, grid, names, resolution):
+        self.grid = grid
+        self.names = names
+        self.resolution = resolution
+
+    @classmethod
+    def load(cls, path=CONSTELLATION_GRID_PATH, mmap=True):
+        """The grid in path; with mmap, mapped from its unpacked copy (written on first use)."""
+        with np.load(path) as data:
+            names = data['names'].astype(object)
+            resolution = float(data['resolution'])
+            if not mmap:
+                return cls(data['grid'], names, resolution)
+            with open(path, 'rb') as file:
+                digest = hashlib.file_digest(file, 'sha256').hexdigest()[:16]
+            unpacked = f"{os.path.splitext(path)[0]}-{digest}.npy"
+            if not os.path.exists(unpacked):
+                grid = data['grid']
+                try:
+                    np.save(f"{unpacked}.{os.getpid()}.tmp.npy", grid)
+                    os.replace(f"{unpacked}.{os.getpid()}.tmp.npy", unpacked)
+                except OSError:
+                    return cls(grid, names, resolution)
+        return cls(np.load(unpacked, mmap_mode='r'), names, resolution)
+
+    @property
+    def tolerance(self):
+        """Largest distance (degrees) from a boundary at which a lookup can disagree with astropy."""
+        return float(self.resolution * np.sqrt(2) / 2)
+
+    def lookup(self, ra, dec):
+        """
+        Constellation names for arrays of RA/Dec in degrees. Scalars give a
+        single name; NaN coordinates give None.
+        """
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.asarray(dec, dtype=np.float64)
+        rows, cols = self.grid.shape
+
+        valid = ~(np.isnan(ra) | np.isnan(dec))
+        i = np.clip(((np.where(valid, dec, 0.0) + 90.0) / self.resolution).astype(np.int64), 0, rows - 1)
+        j = np.clip((np.mod(np.where(valid, ra, 0.0), 360.0) / self.resolution).astype(np.int64), 0, cols - 1)
+
+        names = np.where(valid, self.names[self.grid[i, j]], None)
+        return names.item() if names.ndim == 0 else names
+
+
+_grid = None
+
+def lookup_constellation(ra, dec):
+    """
+    Vectorized constellation lookup backed by the shipped grid. Falls back
+    to astropy if the grid file is missing.
+    """
+    global _grid
+    if _grid is None:
+        if not os.path.exists(CONSTELLATION_GRID_PATH):
+            return _astropy_constellation(ra, dec)
+        _grid = ConstellationGrid.load(CONSTELLATION_GRID_PATH)
+    return _grid.lookup(ra, dec)
+
+
+def _astropy_constellation(ra, dec):
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
+
+    coord = SkyCoord(ra=np.asarray(ra, dtype=np.float64) * u.deg, dec=np.asarray(dec, dtype=np.float64) * u.deg, frame="icrs")
+    return coord.get_constellation()
+
+
+def build_grid(resolution=GRID_RESOLUTION, rows_per_pass=180):
+    """Evaluate astropy at every cell centre, a band of declination rows at a time."""
+    ra = (np.arange(int(round(360 / resolution))) + 0.5) * resolution
+    dec = (np.arange(int(round(180 / resolution))) + 0.5) * resolution - 90.0
+
+    names = []
+    codes = {}
+    grid = np.empty((len(dec), len(ra)), dtype=np.uint8)
+    for start in range(0, len(dec), rows_per_pass):
+        band_dec, band_ra = np.meshgrid(dec[start:start + rows_per_pass], ra, indexing='ij')
+        band = _astropy_constellation(band_ra.ravel(), band_dec.ravel())
+        for name in np.unique(band):
+            if name not in codes:
+                codes[name] = len(names)
+                names.append(name)
+        lookup = np.vectorize(codes.__getitem__, otypes=[np.uint8])
+        grid[start:start + rows_per_pass] = lookup(band).reshape(band_dec.shape)
+    return ConstellationGrid(grid, np.array(names, dtype=object), resolution)
+
+
+def check_grid(grid, samples=100000, seed=0):
+    """
+    Compare the grid with astropy on uniformly random sky positions. Every
+    disagreement must sit in a cell that straddles a boundary.
+    """
+    rng = np.random.default_rng(seed)
+    ra = rng.uniform(0, 360, samples)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, samples)))
+
+    expected = _astropy_constellation(ra, dec)
+    actual = grid.lookup(ra, dec)
+    mismatched = np.flatnonzero(expected != actual)
+
+    # Cell corners of each mismatch: a boundary cell has more than one constellation among them
+    res = grid.resolution
+    ra0 = np.floor(ra[mismatched] / res) * res
+    dec0 = np.floor((dec[mismatched] + 90) / res) * res - 90
+    corners = [
+        _astropy_constellation(ra0 + dr, np.clip(dec0 + dd, -90, 90))
+        for dr in (0, res) for dd in (0, res)
+    ]
+    interior = sum(1 for k in range(len(mismatched)) if len({c[k] for c in corners}) == 1)
+    return {
+        'samples': samples,
+        'mismatches': len(mismatched),
+        'mismatch_rate': len(mismatched) / samples,
+        'mismatches_away_from_boundaries': interior,
+        'tolerance_deg': grid.tolerance,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or check the constellation lookup grid")
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--path', default=CONSTELLATION_GRID_PATH)
+    parser.add_argument('--resolution', type=float, default=GRID_RESOLUTION)
+    parser.add_argument('--samples', type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        grid = build_grid(args.resolution)
+        np.savez_compressed(args.path, grid=grid.grid, names=grid.names.astype(str), resolution=grid.resolution)
+        print(f"Wrote {grid.grid.shape} grid with {len(grid.names)} constellations to {args.path}")
+    else:
+        report = check_grid(ConstellationGrid.load(args.path, mmap=False), args.samples)
+        print(report)
+        if report['mismatches_away_from_boundaries']:
+            sys.exit(f"{report['mismatches_away_from_boundaries']} mismatches are farther than "
+                     f"{report['tolerance_deg']:.3f} deg from a constellation boundary")
+
+
+if __name__ == "__main__":
+    main()
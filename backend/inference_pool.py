@@ -0,0 +1,212 @@
+"""
+Executor for model scoring, so CPU-heavy predictions never run on the event loop.
+
+With INFERENCE_WORKERS > 0 scoring runs in that many worker processes, each
+loading the model once when it starts. With 0 it runs on a single background
+thread in this process. Either way at most INFERENCE_QUEUE_SIZE tasks may be
+queued or running: further requests are rejected with InferencePoolBusy
+(HTTP 429) instead of piling up. Every task has a timeout (HTTP 504). If a
+worker process dies (e.g. killed for memory) the pending tasks fail with
+InferencePoolUnavailable (HTTP 503) and the next task starts a fresh pool.
+"""
+import asyncio
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from model_training import metrics
+
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0"))
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", "64"))
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", "30"))
+# Large frames are split across workers, but never into pieces smaller than this
+INFERENCE_MIN_CHUNK_ROWS = int(os.environ.get("INFERENCE_MIN_CHUNK_ROWS", "2000"))
+
+
+class InferencePoolBusy(Exception):
+    """Raised when the queue is full; the caller should retry later."""
+
+
+class InferencePoolUnavailable(Exception):
+    """Raised when the executor broke (a worker died); it is replaced for the next task."""
+
+
+def _init_worker():
+    from model_training.registry import model_registry
+    model_registry.get()
+
+
+def _in_worker_process(fn, *args):
+    """Run fn in a worker process and ship its stage timings back with the result."""
+    return fn(*args), metrics.take_delta()
+
+
+def _warm_up(sample_input):
+    from model_training import inference
+    inference.warm_up(sample_input)
+    return inference.model_registry.get().load_seconds
+
+
+def _predict_one(json_input):
+    from model_training.inference import predict_one
+    return predict_one(json_input)
+
+
+def _predict_many(inputs):
+    import pandas as pd
+    from model_training.inference import predict_rows
+    return predict_rows(pd.DataFrame(inputs))
+
+
+def _predict_rows(df):
+    from model_training.inference import predict_rows
+    return predict_rows(df)
+
+
+class InferencePool:
+    def __init__(self, workers=INFERENCE_WORKERS, queue_size=INFERENCE_QUEUE_SIZE,
+                 timeout=INFERENCE_TIMEOUT, min_chunk_rows=INFERENCE_MIN_CHUNK_ROWS):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.min_chunk_rows = min_chunk_rows
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.workers > 0:
+                        # spawn: forking a process that runs an event loop and holds sockets is unsafe
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=multiprocessing.get_context('spawn'),
+                            initializer=_init_worker,
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+        return self._executor
+
+    def _submit(self, count, block, fn, args_list):
+        """
+        Reserve count queue slots (all or nothing) and submit one task per
+        args. Returns (executor, futures).
+        """
+        acquired = 0
+        deadline = time.monotonic() + self.timeout
+        try:
+            while acquired < count:
+                remaining = deadline - time.monotonic()
+                if not self._slots.acquire(blocking=block, timeout=max(remaining, 0) if block else None):
+                    raise InferencePoolBusy("Inference queue is full")
+                acquired += 1
+        except BaseException:
+            for _ in range(acquired):
+                self._slots.release()
+            raise
+
+        executor = self.executor
+        futures = []
+        try:
+            for args in args_list:
+                future = self._submit_task(fn, *args, executor=executor)
+                future.add_done_callback(lambda _: self._slots.release())
+                futures.append(future)
+        except BrokenExecutor as e:
+            # Submitted futures release their slots when they fail; the rest never will
+            for _ in range(count - len(futures)):
+                self._slots.release()
+            for future in futures:
+                future.cancel()
+            raise self._broken(executor, e)
+        return executor, futures
+
+    def _broken(self, executor, error):
+        """Drop a broken executor so the next task starts a new one; returns the error to raise."""
+        with self._lock:
+            # Another task may have replaced it already
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        return InferencePoolUnavailable(f"Inference worker failed ({error}); restarting the pool")
+
+    def _submit_task(self, fn, *args, executor=None):
+        executor = executor or self.executor
+        if self.workers > 0:
+            return executor.submit(_in_worker_process, fn, *args)
+        return executor.submit(fn, *args)
+
+    def _result(self, value):
+        if self.workers > 0:
+            value, delta = value
+            metrics.merge_delta(delta)
+        return value
+
+    def _split(self, df):
+        parts = max(1, min(max(self.workers, 1), math.ceil(len(df) / self.min_chunk_rows)))
+        size = math.ceil(len(df) / parts) if len(df) else 1
+        return [df.iloc[i:i + size] for i in range(0, len(df), size)] or [df]
+
+    async def _wait(self, executor, futures):
+        try:
+            values = await asyncio.wait_for(
+                asyncio.gather(*(asyncio.wrap_future(future) for future in futures)), self.timeout
+            )
+        except asyncio.TimeoutError:
+            for future in futures:
+                future.cancel()
+            raise TimeoutError(f"Inference did not finish within {self.timeout}s")
+        except BrokenExecutor as e:
+            raise self._broken(executor, e)
+        return [self._result(value) for value in values]
+
+    async def predict_one(self, json_input):
+        executor, futures = self._submit(1, False, _predict_one, [(json_input,)])
+        return (await self._wait(executor, futures))[0]
+
+    async def predict_many(self, inputs):
+        """Score a list of input dicts as one batch (one queue slot)."""
+        executor, futures = self._submit(1, False, _predict_many, [(inputs,)])
+        return (await self._wait(executor, futures))[0]
+
+    async def predict_rows(self, df):
+        """Score df off the event loop, split across the workers when it is large."""
+        chunks = self._split(df)
+        executor, futures = self._submit(len(chunks), False, _predict_rows, [(chunk,) for chunk in chunks])
+        parts = await self._wait(executor, futures)
+        return [result for part in parts for result in part]
+
+    def predict_rows_blocking(self, df):
+        """
+        Synchronous variant for code already running off the event loop.
+        Waits for queue space instead of raising, which throttles the caller.
+        """
+        chunks = self._split(df)
+        executor, futures = self._submit(len(chunks), True, _predict_rows, [(chunk,) for chunk in chunks])
+        try:
+            return [result for future in futures for result in self._result(future.result(self.timeout))]
+        except TimeoutError:
+            for future in futures:
+                future.cancel()
+            raise TimeoutError(f"Inference did not finish within {self.timeout}s")
+        except BrokenExecutor as e:
+            raise self._broken(executor, e)
+
+    def warm_up(self, sample_input):
+        """
+        Start every worker and run a synthetic prediction in it. Returns the
+        slowest model load time in seconds.
+        """
+        futures = [self._submit_task(_warm_up, sample_input) for _ in range(max(self.workers, 1))]
+        return max(self._result(future.result()) for future in futures)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
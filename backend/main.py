@@ -1,20 +1,139 @@
-from fastapi import FastAPI, Query, UploadFile, File, HTTPException
-from pydantic import BaseModel
-import requests
-import csv
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Query, Request, UploadFile, File, HTTPException
+from pydantic import BaseModel, Field
 from io import StringIO
 from fastapi.middleware.cors import CORSMiddleware
-from astropy.coordinates import SkyCoord
-import astropy.units as u
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, Response
 from urllib.parse import urlencode
 import json
 import os
-import pandas as pd
+import asyncio
 import numpy as np
-from typing import List, Dict, Any
-from model_training.inference import predict_one
+from typing import List, Dict, Any, TYPE_CHECKING
+from contextlib import asynccontextmanager
+from model_training.registry import model_registry
+from model_training import metrics
+from model_training.metrics import CASCADE_ROWS, STAGE_SECONDS
+from catalog import CatalogHandle, CatalogStore
+from tap_client import TapClient, NASA_TAP_URL
+from constellations import lookup_constellation
+from star_mirror import open_mirror, StarMirror, STAR_MIRROR_PATH
+from inference_pool import InferencePool, InferencePoolBusy, InferencePoolUnavailable
+from micro_batcher import MicroBatcher
+from prediction_cache import PredictionCache
+from scoring_jobs import ScoringJobs, JobNotFound, summarize
+import skyview_cache
+from skyview_cache import CutoutCache, CutoutUnavailable, cutout_key
+from score_index import ScoreIndexHandle, SCORE_INDEX_PATH
+
+# pandas and the model stack (sklearn/xgboost/catboost) are imported on first
+# use, so the server can bind its port without paying for them
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Shared async client for the Exoplanet Archive TAP service (created on first use)
+tap_client = None
+
+def get_tap_client() -> TapClient:
+    global tap_client
+    if tap_client is None:
+        tap_client = TapClient(
+            NASA_TAP_URL,
+            max_connections=int(os.environ.get("NASA_TAP_MAX_CONNECTIONS", "20")),
+            max_concurrency=int(os.environ.get("NASA_TAP_CONCURRENCY", "8")),
+            timeout=float(os.environ.get("NASA_TAP_TIMEOUT", "10")),
+        )
+    return tap_client
+
+# Local pscomppars mirror, opened once `python star_mirror.py sync` has created it
+star_mirror = None
+
+def get_star_mirror() -> StarMirror | None:
+    global star_mirror
+    if star_mirror is None:
+        star_mirror = open_mirror(STAR_MIRROR_PATH)
+    return star_mirror
+
+# Sky images for /api/star-info are served through /api/skyview, which fetches
+# each SkyView cutout once into a size-bounded disk cache; SKYVIEW_PROXY=0
+# hands out direct SkyView URLs instead
+SKYVIEW_PROXY = os.environ.get("SKYVIEW_PROXY", "1") == "1"
+skyview_cutouts = CutoutCache(
+    max_concurrency=int(os.environ.get("SKYVIEW_CONCURRENCY", "4")),
+    timeout=float(os.environ.get("SKYVIEW_TIMEOUT", "60")),
+    max_prefetch=int(os.environ.get("SKYVIEW_PREFETCH_MAX", "100")),
+)
+
+# Model scoring runs here, off the event loop (INFERENCE_WORKERS processes, or a thread)
+inference_pool = InferencePool()
 
-app = FastAPI()
+# Concurrent /api/predict-single calls are scored together: a batch is sent
+# after PREDICT_BATCH_WINDOW_MS or once PREDICT_BATCH_MAX_SIZE requests wait.
+# A window of 0 scores every request on its own.
+PREDICT_BATCH_WINDOW_MS = float(os.environ.get("PREDICT_BATCH_WINDOW_MS", "2"))
+PREDICT_BATCH_MAX_SIZE = int(os.environ.get("PREDICT_BATCH_MAX_SIZE", "64"))
+predict_batcher = MicroBatcher(
+    inference_pool.predict_many, window=PREDICT_BATCH_WINDOW_MS / 1000, max_size=PREDICT_BATCH_MAX_SIZE
+)
+
+# Run a synthetic prediction in the background at startup; /api/ready reports
+# ready once it has finished
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "1") == "1"
+
+# Seconds spent in each startup phase
+startup_timings = {}
+model_ready = False
+warm_up_error = None
+
+def record_startup_phase(name: str, started: float):
+    startup_timings[name] = round(time.perf_counter() - started, 3)
+    print(f"startup: {name} took {startup_timings[name]:.3f}s", flush=True)
+
+def warm_up_model():
+    global model_ready, warm_up_error
+    try:
+        started = time.perf_counter()
+        from model_training import inference
+        record_startup_phase("model_imports", started)
+
+        started = time.perf_counter()
+        if inference_pool.workers > 0:
+            # Each worker process loads its own copy of the model
+            startup_timings["model_load"] = round(inference_pool.warm_up(CSV_DEFAULT_VALUES), 3)
+            record_startup_phase("warm_up", started)
+        else:
+            model_registry.get()
+            record_startup_phase("model_load", started)
+
+            started = time.perf_counter()
+            inference.warm_up(CSV_DEFAULT_VALUES)
+            record_startup_phase("warm_up", started)
+        model_ready = True
+    except Exception as e:
+        warm_up_error = str(e)
+        print(f"startup: model warm-up failed: {e}", flush=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global model_ready
+    if MODEL_WARMUP:
+        app.state.warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up_model))
+    else:
+        # The model is loaded by the first prediction request instead
+        model_ready = True
+    scoring_jobs.start()
+    yield
+    scoring_jobs.shutdown()
+    inference_pool.shutdown()
+    global tap_client
+    if tap_client is not None:
+        await tap_client.aclose()
+        tap_client = None
+    await skyview_cutouts.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -32,118 +151,262 @@ app.add_middleware(
 class StarRequest(BaseModel):
     star_name: str
 
-# Load NASA exoplanet data
-def load_nasa_data():
+# NASA exoplanet data: NASA.json is converted into a memory-mapped columnar
+# store (shared by all workers) and reloaded when a new file is dropped in
+NASA_CATALOG_PATH = os.environ.get("NASA_CATALOG_PATH", "NASA.json")
+NASA_CATALOG_STORE = os.environ.get("NASA_CATALOG_STORE", "catalog_store")
+
+# 10% relative tolerance on period, impact and depth
+_catalog_started = time.perf_counter()
+nasa_catalog = CatalogHandle(NASA_CATALOG_PATH, NASA_CATALOG_STORE, tolerance=0.1)
+record_startup_phase("catalog", _catalog_started)
+
+@app.get("/api/ready")
+async def readiness():
+    """
+    Readiness probe: 503 until the startup model warm-up has finished
+    """
+    # With worker processes the model lives in the workers, which warm-up has loaded
+    model_loaded = model_registry.loaded or (inference_pool.workers > 0 and model_ready and MODEL_WARMUP)
+    body = {"ready": model_ready, "model_loaded": model_loaded, "startup_timings": startup_timings}
+    if warm_up_error:
+        body["error"] = warm_up_error
+    if not model_ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+# Model scores of every KOI in the cumulative catalog, precomputed per model
+# version by `python score_index.py build`
+koi_scores = ScoreIndexHandle(SCORE_INDEX_PATH)
+
+class ScoreRange(BaseModel):
+    min: float | None = None
+    max: float | None = None
+
+class KoiScoreQuery(BaseModel):
+    ranges: Dict[str, ScoreRange] = Field(default_factory=dict, description="Inclusive bounds per column, e.g. {\"koi_prad\": {\"max\": 2}}")
+    koi_disposition: str | None = None
+    koi_pdisposition: str | None = None
+    sort_by: str = Field(default="CONFIRMED", description="A class name or an indexed column")
+    ascending: bool = False
+    limit: int = Field(default=100, ge=1, le=10000)
+
+@app.post("/api/koi-scores/query")
+async def query_koi_scores(query: KoiScoreQuery):
+    """
+    Top KOIs of the cumulative catalog by a class probability (or any
+    indexed column), filtered by ranges on the physical columns, answered
+    from the precomputed score index instead of rescoring rows
+    """
+    index = koi_scores.current()
+    if index is None:
+        raise HTTPException(status_code=503, detail="KOI score index not built; run `python score_index.py build`")
+    model_version = await model_registry.ensure_version()
+    equals = {field: value for field, value in
+              (("koi_disposition", query.koi_disposition), ("koi_pdisposition", query.koi_pdisposition)) if value is not None}
+    try:
+        rows, stats = index.query(
+            {field: (bounds.min, bounds.max) for field, bounds in query.ranges.items()},
+            equals, query.sort_by, query.limit, query.ascending,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {
+        "index_version": index.version,
+        "model_version": index.model_version,
+        # Scored by a different model than the one now being served
+        "stale": index.model_version != model_version,
+        "strategy": stats["strategy"],
+        "rows_examined": stats["rows_examined"],
+        "count": len(rows),
+        "results": [index.record(row) for row in rows],
+    }
+
+# Where star-info lookups were answered from
+star_lookups = {"mirror": 0, "tap": 0}
+
+def star_cutout_key(data_row: Dict[str, Any]):
+    """
+    Key of the default DSS2 cutout around a host, or None without a usable position
+    """
     try:
-        with open('NASA.json', 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return []
-    except json.JSONDecodeError:
-        return []
+        return cutout_key(data_row.get("ra"), data_row.get("dec"))
+    except (TypeError, ValueError):
+        return None
 
-# Store the loaded data globally
-nasa_data = load_nasa_data()
+def format_star_info(data_row: Dict[str, Any], constellation: str | None, image_base: str) -> Dict[str, Any]:
+    """
+    The /api/star-info response for a pscomppars host row; image_base is
+    the absolute URL of the /api/skyview endpoint
+    """
+    key = star_cutout_key(data_row)
+    image_url = None
+    if key is not None:
+        if SKYVIEW_PROXY:
+            image_url = image_base + "?" + urlencode(skyview_cache.query_params(key))
+        else:
+            image_url = skyview_cache.SKYVIEW_URL + "?" + urlencode(skyview_cache.skyview_params(key))
+
+    return {
+        "name": data_row.get("hostname"),
+        "imageUrl": image_url,
+        "spectralType": data_row.get("st_spectype"),
+        "numberOfStars": data_row.get("sy_snum"),
+        "numberOfPlanets": data_row.get("sy_pnum"),
+        "distance": f"{float(data_row.get('sy_dist')):,.2f} parsecs" if data_row.get("sy_dist") else None,
+        "constellation": constellation
+    }
+
+STAR_NOT_FOUND = {"error": "Star not found in NASA's archive."}
 
 @app.post("/api/star-info")
-async def get_star_info(request: StarRequest):
+async def get_star_info(request: StarRequest, http_request: Request):
 
     star_name = request.star_name.strip()
     
-    NASA_API_URL = "https://exoplanetarchive.ipac.caltech.edu/TAP/sync"
-    
-    query_string = f"""
-        select hostname, ra, dec, st_spectype, sy_snum, sy_pnum, sy_dist
-        from pscomppars
-        where hostname='{star_name}'
-    """
-    
-    params = {
-        'query': query_string,
-        'format': 'csv'
-    }
-    
     try:
-        response = requests.get(NASA_API_URL, params=params)
-        response.raise_for_status()
-
-        csv_data = StringIO(response.text)
-        reader = csv.DictReader(csv_data)
-        data_row = next(reader, None)
+        # Serve from the local pscomppars mirror when synced; the archive only on a miss
+        mirror = get_star_mirror()
+        data_row = mirror.lookup(star_name) if mirror else None
+        star_lookups["mirror" if data_row is not None else "tap"] += 1
+        if data_row is None:
+            data_row = await get_tap_client().fetch_host(star_name)
 
         if not data_row:
-            return {"error": "Star not found in NASA's archive."}
+            return dict(STAR_NOT_FOUND)
         
         ra = data_row.get("ra")
         dec = data_row.get("dec")
 
         constellation = None
         if ra and dec:
-            coord = SkyCoord(ra=float(ra)*u.deg, dec=float(dec)*u.deg, frame="icrs")
-            constellation = coord.get_constellation()
-
-        skyview_params = {
-            "Survey": "DSS2 Red",
-            "Position": f"{ra},{dec}",
-            "Size": "0.25",
-            "Pixels": "300",
-            "Return": "JPEG"
-        }
-        image_url = "https://skyview.gsfc.nasa.gov/current/cgi/runquery.pl?" + urlencode(skyview_params)
-
-        result = {
-            "name": data_row.get("hostname"),
-            "imageUrl": image_url,
-            "spectralType": data_row.get("st_spectype"),
-            "numberOfStars": data_row.get("sy_snum"),
-            "numberOfPlanets": data_row.get("sy_pnum"),
-            "distance": f"{float(data_row.get('sy_dist')):,.2f} parsecs" if data_row.get("sy_dist") else None,
-            "constellation": constellation
-        }
-        return result
+            constellation = lookup_constellation(float(ra), float(dec))
+
+        star_info = format_star_info(data_row, constellation, str(http_request.url_for("skyview_cutout")))
+        # Start fetching the sky image the page is about to request
+        if SKYVIEW_PROXY and star_info["imageUrl"]:
+            skyview_cutouts.prefetch([star_cutout_key(data_row)])
+        return star_info
 
     except Exception as e:
         return {"error": f"An error occurred: {e}"}
 
+@app.get("/api/skyview", name="skyview_cutout")
+async def get_skyview_cutout(
+    request: Request,
+    ra: float = Query(..., description="Right ascension (deg)"),
+    dec: float = Query(..., description="Declination (deg)"),
+    survey: str = Query(skyview_cache.DEFAULT_SURVEY),
+    size: float = Query(skyview_cache.DEFAULT_SIZE, description="Field of view (deg)"),
+    pixels: int = Query(skyview_cache.DEFAULT_PIXELS),
+):
+    """
+    A SkyView cutout as JPEG, fetched from SkyView once and then served from
+    the disk cache. Cutouts never change, so they carry a strong ETag and a
+    long-lived Cache-Control header.
+    """
+    try:
+        key = cutout_key(ra, dec, survey, size, pixels)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    headers = {
+        "ETag": skyview_cache.etag(key),
+        "Cache-Control": f"public, max-age={skyview_cache.SKYVIEW_MAX_AGE}, immutable",
+    }
+    if headers["ETag"] in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    try:
+        image = await skyview_cutouts.get(key)
+    except CutoutUnavailable as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return Response(content=image, media_type="image/jpeg", headers=headers)
+
+class StarsRequest(BaseModel):
+    star_names: List[str] = Field(..., max_length=1000)
+
+@app.post("/api/star-info/bulk")
+async def get_star_info_bulk(request: StarsRequest, http_request: Request):
+    """
+    /api/star-info for many stars in one call. Duplicate names are looked up
+    once; mirror misses go to the archive in a few `hostname in (...)`
+    queries. results maps every requested name to exactly what
+    /api/star-info would return for it, including not-found and error
+    entries.
+    """
+    names = list(dict.fromkeys(name.strip() for name in request.star_names))
+
+    mirror = get_star_mirror()
+    rows = mirror.lookup_many(names) if mirror else {}
+    star_lookups["mirror"] += len(rows)
+    missing = [name for name in names if name not in rows]
+    star_lookups["tap"] += len(missing)
+    if missing:
+        try:
+            rows.update(await get_tap_client().fetch_hosts(missing))
+        except Exception as e:
+            rows.update({name: e for name in missing})
+
+    found = [name for name in names if isinstance(rows.get(name), dict)]
+    # One vectorized pass over every star with coordinates
+    ra = np.array([float(rows[name]["ra"]) if rows[name].get("ra") else np.nan for name in found])
+    dec = np.array([float(rows[name]["dec"]) if rows[name].get("dec") else np.nan for name in found])
+    constellations = lookup_constellation(ra, dec) if found else []
+
+    image_base = str(http_request.url_for("skyview_cutout"))
+    results = {}
+    for name in names:
+        row = rows.get(name)
+        if isinstance(row, Exception):
+            results[name] = {"error": f"An error occurred: {row}"}
+        elif not row:
+            results[name] = dict(STAR_NOT_FOUND)
+    for name, constellation in zip(found, constellations):
+        try:
+            results[name] = format_star_info(rows[name], constellation, image_base)
+        except Exception as e:
+            results[name] = {"error": f"An error occurred: {e}"}
+    if SKYVIEW_PROXY:
+        skyview_cutouts.prefetch(key for key in map(star_cutout_key, (rows[name] for name in found)) if key)
+    return {"results": {name: results[name] for name in names}}
+
 def detect_single_exoplanet(period: float, impact: float, depth: float) -> Dict[str, Any]:
     """
     Helper function to detect if a single planet is an exoplanet
     """
-    if not nasa_data:
+    catalog = nasa_catalog.current()
+    if not catalog:
         return {"error": "NASA data not available"}
-    
-    # Define tolerance for matching (adjust as needed)
-    period_tolerance = 0.1  # 10% tolerance for period
-    impact_tolerance = 0.1  # 10% tolerance for impact
-    depth_tolerance = 0.1   # 10% tolerance for depth
-    
+
+    return format_catalog_matches(catalog, period, impact, depth, catalog.index.match(period, impact, depth))
+
+def detect_many_exoplanets(periods: List[float], impacts: List[float], depths: List[float]) -> List[Dict[str, Any]]:
+    """
+    Batch form of detect_single_exoplanet, answered from the catalog index
+    """
+    catalog = nasa_catalog.current()
+    if not catalog:
+        return [{"error": "NASA data not available"} for _ in periods]
+
+    matched_ids = catalog.index.match_many(periods, impacts, depths)
+    return [
+        format_catalog_matches(catalog, period, impact, depth, ids)
+        for period, impact, depth, ids in zip(periods, impacts, depths, matched_ids)
+    ]
+
+def format_catalog_matches(catalog: CatalogStore, period: float, impact: float, depth: float, ids: List[int]) -> Dict[str, Any]:
     matches = []
-    
-    for planet in nasa_data:
-        koi_period = planet.get("koi_period")
-        koi_impact = planet.get("koi_impact")
-        koi_depth = planet.get("koi_depth")
+
+    for i in ids:
+        planet = catalog.record(i)
         koi_disposition = planet.get("koi_disposition")
-        kepler_name = planet.get("kepler_name")
-        
-        # Check if all required fields are present
-        if koi_period is None or koi_impact is None or koi_depth is None:
-            continue
-        
-        # Check if values match within tolerance
-        period_match = abs(koi_period - period) / period <= period_tolerance
-        impact_match = abs(koi_impact - impact) / max(impact, 0.001) <= impact_tolerance
-        depth_match = abs(koi_depth - depth) / depth <= depth_tolerance
-        
-        if period_match and impact_match and depth_match:
-            matches.append({
-                "kepler_name": kepler_name,
-                "koi_period": koi_period,
-                "koi_impact": koi_impact,
-                "koi_depth": koi_depth,
-                "koi_disposition": koi_disposition,
-                "is_exoplanet": koi_disposition == "CONFIRMED"
-            })
+        matches.append({
+            "kepler_name": planet.get("kepler_name"),
+            "koi_period": planet.get("koi_period"),
+            "koi_impact": planet.get("koi_impact"),
+            "koi_depth": planet.get("koi_depth"),
+            "koi_disposition": koi_disposition,
+            "is_exoplanet": koi_disposition == "CONFIRMED"
+        })
     
     if matches:
         # Return the first match (or all matches if you prefer)
@@ -201,6 +464,103 @@ MODEL_COLUMNS = [
     'koi_steff', 'koi_srad', 'koi_slogg'
 ]
 
+# Values used for KOI columns that an uploaded CSV does not provide
+CSV_DEFAULT_VALUES = {
+    'koi_period': 75.0,
+    'koi_time0bk': 0.0,
+    'koi_duration': 4.0,
+    'koi_depth': 23791.0,
+    'koi_prad': 1.0,
+    'koi_impact': 0.7,
+    'koi_model_snr': 10.0,
+    'koi_score': 0.5,
+    'koi_pdisposition_bin': 1,
+    'koi_steff': 5778.0,
+    'koi_srad': 1.0,
+    'koi_slogg': 4.4,
+}
+
+# Rows parsed and scored at a time by the streaming CSV endpoint
+CSV_CHUNK_ROWS = int(os.environ.get("CSV_CHUNK_ROWS", "5000"))
+
+def prepare_koi_frame(df: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    Fill in missing KOI columns with defaults and drop everything else
+    """
+    for col in MODEL_COLUMNS:
+        if col not in df.columns:
+            df[col] = CSV_DEFAULT_VALUES.get(col, np.nan)
+
+    return df[MODEL_COLUMNS]
+
+def tag_row_numbers(df: "pd.DataFrame", results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Tag each result with the 1-based row number of its row in the upload
+    """
+    for index, result in zip(df.index, results):
+        result['row_number'] = index + 1
+    return results
+
+# Predictions keyed by model input and model version; PREDICTION_CACHE_PATH
+# adds an on-disk tier shared across restarts and workers
+prediction_cache = PredictionCache(
+    MODEL_COLUMNS,
+    lambda: model_registry.version,
+    max_entries=int(os.environ.get("PREDICTION_CACHE_SIZE", "100000")),
+    path=os.environ.get("PREDICTION_CACHE_PATH") or None,
+)
+
+async def cache_call(fn, *args):
+    """
+    A single-row prediction cache call: inline for the memory tier, in a
+    thread when it may wait on the SQLite file
+    """
+    if prediction_cache.path:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+async def score_koi_frame(df: "pd.DataFrame") -> List[Dict[str, Any]]:
+    """
+    Score a prepared KOI frame in the inference pool (split across workers
+    when it is large). Cached rows and repeats of a row are not rescored.
+    Hashing every row and the SQLite tier run in a thread, off the event loop.
+    """
+    await model_registry.ensure_version()
+    results, misses = await asyncio.to_thread(prediction_cache.lookup_frame, df)
+    if misses:
+        scored = await inference_pool.predict_rows(df.iloc[prediction_cache.first_positions(misses)])
+        await asyncio.to_thread(prediction_cache.fill, results, misses, scored)
+    return tag_row_numbers(df, results)
+
+def score_koi_frame_blocking(df: "pd.DataFrame") -> List[Dict[str, Any]]:
+    """
+    score_koi_frame for code running off the event loop
+    """
+    results, misses = prediction_cache.lookup_frame(df)
+    if misses:
+        scored = inference_pool.predict_rows_blocking(df.iloc[prediction_cache.first_positions(misses)])
+        prediction_cache.fill(results, misses, scored)
+    return tag_row_numbers(df, results)
+
+# Background scoring of large CSV uploads (/api/jobs), checkpointed after every
+# CSV_CHUNK_ROWS rows under SCORING_JOBS_DIR
+scoring_jobs = ScoringJobs(
+    os.environ.get("SCORING_JOBS_DIR", "scoring_jobs"),
+    lambda chunk: score_koi_frame_blocking(prepare_koi_frame(chunk)),
+    chunk_rows=CSV_CHUNK_ROWS,
+    workers=int(os.environ.get("SCORING_JOB_WORKERS", "1")),
+)
+
+def inference_http_error(e: Exception) -> HTTPException:
+    """
+    Map a busy, broken or timed-out inference pool to 429 / 503 / 504
+    """
+    if isinstance(e, InferencePoolBusy):
+        return HTTPException(status_code=429, detail="Server is busy, retry later", headers={"Retry-After": "1"})
+    if isinstance(e, InferencePoolUnavailable):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return HTTPException(status_code=504, detail=str(e))
+
 # In backend/main.py
 
 # ... (all your other code and imports)
@@ -210,16 +570,97 @@ async def predict_manual_query(data: ExoplanetInput):
     try:
         # Pass the data to your prediction function
         json_input = data.model_dump()
-        prediction = predict_one(json_input)
+        await model_registry.ensure_version()
+        cached = await cache_call(prediction_cache.get, json_input)
+        if cached is not None:
+            return cached
+
+        if PREDICT_BATCH_WINDOW_MS > 0:
+            prediction = await predict_batcher.submit(json_input)
+            if 'error' in prediction:
+                raise RuntimeError(prediction['error'])
+        else:
+            prediction = await inference_pool.predict_one(json_input)
+        await cache_call(prediction_cache.put, json_input, prediction)
         
         # Simply return the result from predict_one directly.
         # It already contains the correct string prediction.
         return prediction
     
+    except (InferencePoolBusy, InferencePoolUnavailable, TimeoutError) as e:
+        raise inference_http_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
 
+@app.get("/api/predict-single/stats")
+async def predict_single_stats():
+    """
+    Micro-batching metrics for /api/predict-single: batch sizes and how long
+    requests waited for their batch
+    """
+    return predict_batcher.stats()
+
+
+@app.get("/api/cascade/stats")
+async def cascade_stats():
+    """
+    Rows answered by each stage of the screening cascade (CASCADE=1) since
+    startup, and the share the screening model answered on its own
+    """
+    rows = CASCADE_ROWS.values()
+    total = sum(rows.values())
+    return {
+        "enabled": model_registry.screen_model_path is not None,
+        "rows": rows,
+        "screen_hit_rate": rows.get("screen", 0) / total if total else None,
+    }
+
+
+def collect_service_metrics() -> List[str]:
+    """
+    Counters kept by the cache, batcher, inference pool, star lookups and
+    sky image cache, in Prometheus text format
+    """
+    cache = prediction_cache.stats()
+    lines = [
+        "# TYPE exoplanet_prediction_cache_hits_total counter",
+        f"exoplanet_prediction_cache_hits_total {cache['hits']}",
+        "# TYPE exoplanet_prediction_cache_misses_total counter",
+        f"exoplanet_prediction_cache_misses_total {cache['misses']}",
+        "# TYPE exoplanet_prediction_cache_entries gauge",
+        f"exoplanet_prediction_cache_entries {cache['entries']}",
+        "# TYPE exoplanet_predict_batches_total counter",
+        f"exoplanet_predict_batches_total {predict_batcher.batches}",
+        "# TYPE exoplanet_predict_batched_requests_total counter",
+        f"exoplanet_predict_batched_requests_total {predict_batcher.requests}",
+        "# TYPE exoplanet_star_lookups_total counter",
+    ]
+    lines.extend(f'exoplanet_star_lookups_total{{source="{source}"}} {count}' for source, count in star_lookups.items())
+    cutouts = skyview_cutouts.stats()
+    lines.append("# TYPE exoplanet_skyview_cutouts_total counter")
+    lines.extend(f'exoplanet_skyview_cutouts_total{{outcome="{outcome}"}} {cutouts[outcome]}'
+                 for outcome in ("hits", "misses", "fetch_errors", "evictions"))
+    return lines
+
+metrics.register_collector(collect_service_metrics)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Per-stage, per-sub-model and TAP latency histograms plus service
+    counters, in Prometheus text format
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/prediction-cache/stats")
+async def prediction_cache_stats():
+    """
+    Prediction cache size and hit/miss counters
+    """
+    return prediction_cache.stats()
+
 
 @app.post("/api/exoplanet-detection-csv")
 async def detect_exoplanets_from_csv(file: UploadFile = File(..., description="CSV file with columns: period, impact, depth")):
@@ -239,12 +680,17 @@ async def detect_exoplanets_from_csv(file: UploadFile = File(..., description="C
         if not file.filename.endswith('.csv'):
             raise HTTPException(status_code=400, detail="File must be a CSV file")
         
+        import pandas as pd
+
         # Read CSV content
-        content = await file.read()
-        csv_content = content.decode('utf-8')
+        with STAGE_SECONDS.time("upload_read"):
+            content = await file.read()
+        with STAGE_SECONDS.time("upload_decode"):
+            csv_content = content.decode('utf-8')
         
         # Parse CSV using pandas
-        df = pd.read_csv(StringIO(csv_content))
+        with STAGE_SECONDS.time("csv_parse"):
+            df = pd.read_csv(StringIO(csv_content))
         
         # Define column mappings for flexibility
         # column_mappings = {
@@ -253,48 +699,8 @@ async def detect_exoplanets_from_csv(file: UploadFile = File(..., description="C
         #     'depth': ['depth', 'Depth', 'DEPTH', 'transit_depth', 'transit depth', 'ppm', 'PPM', 'koi_depth']
         # }
         
-        # Check if CSV already has all KOI columns (full dataset)
-        koi_columns = ['koi_period', 'koi_time0bk', 'koi_duration', 'koi_depth', 'koi_prad', 
-                      'koi_impact', 'koi_model_snr', 'koi_score', 'koi_pdisposition_bin', 
-                      'koi_steff', 'koi_srad', 'koi_slogg']
-
-        default_values = {
-        'koi_period': 75.0,
-        'koi_time0bk': 0.0,
-        'koi_duration': 4.0,
-        'koi_depth': 23791.0,
-        'koi_prad': 1.0,
-        'koi_impact': 0.7,
-        'koi_model_snr': 10.0,
-        'koi_score': 0.5,
-        'koi_pdisposition_bin': 1,
-        'koi_steff': 5778.0,
-        'koi_srad': 1.0,
-        'koi_slogg': 4.4,
-        }
-
-        for col in koi_columns:
-            if col not in df.columns:
-                df[col] = default_values.get(col, np.nan) 
-        
-        extra_cols = [col for col in df.columns if col not in koi_columns]
-        if extra_cols:
-            df = df.drop(columns=extra_cols)
-        
-        df = df[koi_columns]
-
-        results = []
-
-        for index, row in df.iterrows():
-            json_input = row.to_dict()
-            try:
-                result = predict_one(json_input)
-                result['row_number'] = index + 1
-            except Exception as e:
-                # Handle potential errors during prediction for a single row
-                result = {'row_number': index, 'error': f"Prediction failed: {str(e)}"}
-        
-            results.append(result)
+        df = prepare_koi_frame(df)
+        results = await score_koi_frame(df)
 
         total_rows = len(results)
         exoplanets_found = sum(1 for r in results if r.get('prediction') == 'CONFIRMED')
@@ -397,9 +803,203 @@ async def detect_exoplanets_from_csv(file: UploadFile = File(..., description="C
         
     except HTTPException:
         raise
+    except (InferencePoolBusy, InferencePoolUnavailable, TimeoutError) as e:
+        raise inference_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing CSV file: {str(e)}")
+
+
+@app.post("/api/exoplanet-detection-csv/stream")
+def stream_exoplanets_from_csv(file: UploadFile = File(..., description="CSV file with KOI columns")):
+    """
+    Streaming variant of /api/exoplanet-detection-csv.
+
+    The upload is parsed and scored CSV_CHUNK_ROWS rows at a time, so memory
+    stays bounded however large the file is. The response is NDJSON: one
+    line per row result, followed by a final {"summary": {...}} line.
+    """
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="File must be a CSV file")
+
+    import pandas as pd
+
+    try:
+        # Parses the header now, so a malformed upload still gets a proper status code
+        reader = pd.read_csv(file.file, chunksize=CSV_CHUNK_ROWS, encoding='utf-8')
+    except pd.errors.EmptyDataError:
+        raise HTTPException(status_code=400, detail="CSV file is empty")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing CSV file: {str(e)}")
 
+    def generate():
+        total_rows = 0
+        exoplanets_found = 0
+        errors = 0
+        try:
+            with reader:
+                while True:
+                    # Reads, decodes and parses the next chunk of the upload
+                    with STAGE_SECONDS.time("csv_parse"):
+                        chunk = next(reader, None)
+                    if chunk is None:
+                        break
+                    # Blocks for queue space rather than failing mid-stream
+                    for result in score_koi_frame_blocking(prepare_koi_frame(chunk)):
+                        total_rows += 1
+                        if result.get('prediction') == 'CONFIRMED':
+                            exoplanets_found += 1
+                        if 'error' in result:
+                            errors += 1
+                        yield json.dumps(result) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield json.dumps({"error": f"Error processing CSV file: {str(e)}"}) + "\n"
+
+        yield json.dumps({
+            "summary": {
+                "total_rows_processed": total_rows,
+                "exoplanets_found": exoplanets_found,
+                "non_exoplanets": total_rows - exoplanets_found - errors,
+                "errors": errors,
+            }
+        }) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+def job_status(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The public view of a scoring job's state
+    """
+    estimated = state['estimated_rows']
+    return {
+        "job_id": state['id'],
+        "filename": state['filename'],
+        "status": state['status'],
+        "progress": {
+            "rows_done": state['rows_done'],
+            "estimated_rows": estimated,
+            "fraction": 1.0 if state['status'] == 'completed' else (min(state['rows_done'] / estimated, 1.0) if estimated else 0.0),
+        },
+        "summary": summarize(state),
+        "error": state['error'],
+        "created": state['created'],
+        "updated": state['updated'],
+    }
+
+
+@app.post("/api/jobs", status_code=202)
+def submit_scoring_job(file: UploadFile = File(..., description="CSV file with KOI columns")):
+    """
+    Queue a CSV file for background scoring and return its job ID at once.
+
+    Poll GET /api/jobs/{job_id} for progress and page through the results
+    with GET /api/jobs/{job_id}/results. Jobs survive server restarts.
+    """
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="File must be a CSV file")
+    return job_status(scoring_jobs.submit(file.file, file.filename))
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_scoring_job(job_id: str):
+    """
+    Status, progress and summary counts so far of a scoring job
+    """
+    try:
+        return job_status(scoring_jobs.state(job_id))
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+
+@app.get("/api/jobs/{job_id}/results")
+def get_scoring_job_results(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=10000)):
+    """
+    One page of a scoring job's row results (those scored so far), in upload
+    order. next_offset is null once the job is finished and every row has
+    been returned.
+    """
+    try:
+        state, results = scoring_jobs.results(job_id, offset, limit)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail="Job not found")
+    next_offset = offset + len(results)
+    if state['status'] not in ('queued', 'running') and next_offset >= state['rows_done']:
+        next_offset = None
+    return {
+        "job_id": state['id'],
+        "status": state['status'],
+        "summary": summarize(state),
+        "offset": offset,
+        "next_offset": next_offset,
+        "results": results,
+    }
+
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_scoring_job(job_id: str):
+    """
+    Stop a scoring job and delete its upload and results
+    """
+    try:
+        scoring_jobs.cancel(job_id)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "status": "cancelled"}
+
+
+@app.post("/api/exoplanet-detection-match-csv")
+async def match_exoplanets_from_csv(file: UploadFile = File(..., description="CSV file with columns: period, impact, depth")):
+    """
+    Match every (period, impact, depth) row of a CSV file against the NASA
+    catalog in one call, e.g. sample_planets.csv.
+
+    Returns:
+        Per-row detect_single_exoplanet results plus summary counts
+    """
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="File must be a CSV file")
+
+    import pandas as pd
+
+    try:
+        content = await file.read()
+        df = pd.read_csv(StringIO(content.decode('utf-8')))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error reading CSV file: {str(e)}")
+
+    missing = [col for col in ('period', 'impact', 'depth') if col not in df.columns]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing required columns: {missing}. Found columns: {list(df.columns)}")
+
+    df = df[['period', 'impact', 'depth']].apply(pd.to_numeric, errors='coerce')
+    valid = df.notna().all(axis=1)
+    valid_rows = df[valid]
+
+    results = [{"row_number": index + 1, "error": "period, impact and depth must be numbers"} for index in df.index[~valid]]
+    matched = detect_many_exoplanets(
+        valid_rows['period'].tolist(), valid_rows['impact'].tolist(), valid_rows['depth'].tolist()
+    )
+    for index, result in zip(valid_rows.index, matched):
+        result['row_number'] = index + 1
+        results.append(result)
+    results.sort(key=lambda r: r['row_number'])
+
+    errors = sum(1 for r in results if 'error' in r)
+    exoplanets_found = sum(1 for r in results if r.get('is_exoplanet'))
+    return {
+        "summary": {
+            "total_rows_processed": len(results),
+            "exoplanets_found": exoplanets_found,
+            "non_exoplanets": len(results) - exoplanets_found - errors,
+            "errors": errors,
+        },
+        "results": results
+    }
+
+
+record_startup_phase("app_import", _import_started)
+
 
 if __name__ == "__main__":
     # Allow starting the app with: python main.py
@@ -0,0 +1,91 @@
+"""
+Micro-batching for single-object predictions.
+
+Concurrent requests are collected for up to `window` seconds, or until
+`max_size` are waiting, and scored together in one model call; each caller
+gets its own result back. A lone request waits at most one window.
+"""
+import asyncio
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+
+class MicroBatcher:
+    def __init__(self, score, window=0.002, max_size=64, history=10000):
+        """
+        score: async callable taking a list of inputs and returning one
+        result per input, in order.
+        """
+        self._score = score
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+        self.batches = 0
+        self.requests = 0
+        self.batch_sizes = Counter()
+        # Seconds each request waited between arriving and its batch being dispatched
+        self._queue_delays = deque(maxlen=history)
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        dispatched = time.perf_counter()
+        self.batches += 1
+        self.requests += len(batch)
+        self.batch_sizes[len(batch)] += 1
+        self._queue_delays.extend(dispatched - enqueued for _, _, enqueued in batch)
+
+        task = asyncio.ensure_future(self._run(batch))
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self._score([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            # A caller that gave up (client disconnect) has a cancelled future
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        delays_ms = np.array(self._queue_delays) * 1000
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_size,
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": round(self.requests / self.batches, 3) if self.batches else None,
+            "batch_size_counts": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "queue_delay_ms": {
+                "p50": round(float(np.percentile(delays_ms, 50)), 3),
+                "p99": round(float(np.percentile(delays_ms, 99)), 3),
+                "max": round(float(delays_ms.max()), 3),
+            } if len(delays_ms) else None,
+        }
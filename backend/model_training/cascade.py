@@ -0,0 +1,137 @@
+"""
+Confidence-gated inference cascade.
+
+A cheap screening model (model.build_screen) scores every row first. A row
+whose calibrated top-class probability reaches that class's threshold is
+answered by the screen; only the rest go to the full VotingClassifier.
+Thresholds are chosen offline on the training pipeline's validation split,
+as the per-class thresholds that answer the most rows from the screen while
+costing at most a given fraction of accuracy against the full ensemble.
+
+    python cascade.py tune --max-accuracy-loss 0.005   # (re)write cascade_thresholds.json
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+SCREEN_MODEL_PATH = os.environ.get("SCREEN_MODEL_PATH", "screen_model.sav")
+CASCADE_THRESHOLDS_PATH = os.environ.get("CASCADE_THRESHOLDS_PATH", "cascade_thresholds.json")
+CASCADE_MAX_ACCURACY_LOSS = float(os.environ.get("CASCADE_MAX_ACCURACY_LOSS", "0.005"))
+
+# Candidate thresholds; inf means the class is never answered by the screen
+THRESHOLD_GRID = np.concatenate([np.arange(0.5, 1.0, 0.005), [1.0, np.inf]])
+
+
+class Cascade:
+    def __init__(self, screen, thresholds):
+        """thresholds: one per class, in screen.classes_ order."""
+        self.screen = screen
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+
+    @classmethod
+    def load(cls, screen_path=SCREEN_MODEL_PATH, thresholds_path=CASCADE_THRESHOLDS_PATH):
+        import joblib
+
+        screen = joblib.load(screen_path)
+        with open(thresholds_path) as file:
+            saved = json.load(file)
+        if list(saved['classes']) != [int(c) for c in screen.classes_]:
+            raise ValueError(f"{thresholds_path} was tuned for classes {saved['classes']}, "
+                             f"the screen predicts {list(screen.classes_)}")
+        return cls(screen, saved['thresholds'])
+
+    def accept(self, proba):
+        """Rows of the screen's proba that it may answer on its own."""
+        return proba.max(axis=1) >= self.thresholds[proba.argmax(axis=1)]
+
+
+def choose_thresholds(screen_proba, full_proba, y, classes, max_accuracy_loss=CASCADE_MAX_ACCURACY_LOSS):
+    """
+    Per-class thresholds (from THRESHOLD_GRID) maximizing the rows the screen
+    answers, subject to cascade accuracy >= full accuracy - max_accuracy_loss.
+    Rows are split between classes by the screen's top class, so each
+    class's coverage and accuracy cost add up and every combination of grid
+    thresholds can be evaluated exactly.
+    """
+    classes = np.asarray(classes)
+    y = np.asarray(y)
+    screen_top = screen_proba.argmax(axis=1)
+    confidence = screen_proba.max(axis=1)
+    screen_correct = classes[screen_top] == y
+    full_correct = classes[full_proba.argmax(axis=1)] == y
+
+    # coverage[k, g] / lost[k, g]: rows of class k accepted at grid threshold g,
+    # and how many more of them the full ensemble gets right than the screen
+    coverage = np.zeros((len(classes), len(THRESHOLD_GRID)), dtype=np.int64)
+    lost = np.zeros_like(coverage)
+    for k in range(len(classes)):
+        accepted = (screen_top == k)[:, None] & (confidence[:, None] >= THRESHOLD_GRID[None, :])
+        coverage[k] = accepted.sum(axis=0)
+        lost[k] = (accepted & full_correct[:, None]).sum(axis=0) - (accepted & screen_correct[:, None]).sum(axis=0)
+
+    total_coverage = np.zeros(())
+    total_lost = np.zeros(())
+    for k in range(len(classes)):
+        total_coverage = np.add.outer(total_coverage, coverage[k])
+        total_lost = np.add.outer(total_lost, lost[k])
+    # Most coverage within the budget; among those, the least accuracy lost
+    feasible = total_lost <= max_accuracy_loss * len(y)
+    score = np.where(feasible, total_coverage * (len(y) + 1) - total_lost, -np.inf)
+    best = np.unravel_index(np.argmax(score), score.shape)
+
+    thresholds = THRESHOLD_GRID[list(best)]
+    accept = confidence >= thresholds[screen_top]
+    cascade_correct = np.where(accept, screen_correct, full_correct)
+    return {
+        'classes': [int(c) for c in classes],
+        'thresholds': [float(t) for t in thresholds],
+        'max_accuracy_loss': max_accuracy_loss,
+        'rows': int(len(y)),
+        'screen_hit_rate': float(accept.mean()),
+        'class_hit_rates': {
+            str(int(c)): float(accept[screen_top == k].mean()) if (screen_top == k).any() else 0.0
+            for k, c in enumerate(classes)
+        },
+        'full_accuracy': float(full_correct.mean()),
+        'screen_accuracy': float(screen_correct.mean()),
+        'cascade_accuracy': float(cascade_correct.mean()),
+    }
+
+
+def save_thresholds(result, path=CASCADE_THRESHOLDS_PATH):
+    with open(path + ".tmp", 'w') as file:
+        json.dump(result, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick cascade thresholds under an accuracy-loss budget")
+    parser.add_argument('command', choices=['tune'])
+    parser.add_argument('--max-accuracy-loss', type=float, default=CASCADE_MAX_ACCURACY_LOSS,
+                        help="allowed accuracy drop against the full ensemble (fraction)")
+    parser.add_argument('--model', default='ensemble_model.sav')
+    parser.add_argument('--scaler', default='scaler.sav')
+    parser.add_argument('--screen', default=SCREEN_MODEL_PATH)
+    parser.add_argument('--out', default=CASCADE_THRESHOLDS_PATH)
+    args = parser.parse_args()
+
+    import joblib
+    from sklearn.model_selection import train_test_split
+    from train import load_training_matrix
+
+    # The same validation split train.py evaluates on
+    X, y, _ = load_training_matrix()
+    _, X_val, _, y_val = train_test_split(X, y, test_size=0.2, stratify=y, random_state=42)
+    X_val_scaled = joblib.load(args.scaler).transform(X_val)
+    model = joblib.load(args.model)
+    screen = joblib.load(args.screen)
+    result = choose_thresholds(screen.predict_proba(X_val_scaled), model.predict_proba(X_val_scaled),
+                               y_val, model.classes_, args.max_accuracy_loss)
+    save_thresholds(result, args.out)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
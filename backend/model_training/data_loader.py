@@ -1,15 +1,99 @@
+"""
+Training data from the NASA Exoplanet Archive, with local snapshots.
+
+Every download is saved under TRAINING_SNAPSHOT_DIR as the raw TAP CSV,
+named by the table and the CSV's content hash, plus the parsed DataFrame as
+Parquet when pyarrow or fastparquet is installed (otherwise the CSV is
+parsed again on load). Snapshots are never unpickled, so a file dropped
+into the directory cannot run code. A
+snapshot younger than TRAINING_SNAPSHOT_MAX_AGE_HOURS is reused without
+touching the network; with TRAINING_OFFLINE=1 the newest snapshot is always
+used. The content hash of the data a frame came from is in
+df.attrs['snapshot'].
+"""
+import hashlib
+import importlib.util
+import os
+import time
+
 import pandas as pd
 import requests
 from io import StringIO
 
-def load_koi_data():
-    url = "https://exoplanetarchive.ipac.caltech.edu/TAP/sync?query=select+*+from+cumulative&format=csv"
-    r = requests.get(url, timeout=30)
-    df = pd.read_csv(StringIO(r.text))
+TAP_URL = "https://exoplanetarchive.ipac.caltech.edu/TAP/sync?query=select+*+from+{table}&format=csv"
+
+SNAPSHOT_DIR = os.environ.get("TRAINING_SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_MAX_AGE_HOURS = float(os.environ.get("TRAINING_SNAPSHOT_MAX_AGE_HOURS", "24"))
+OFFLINE = os.environ.get("TRAINING_OFFLINE", "0") == "1"
+PARQUET = any(importlib.util.find_spec(engine) for engine in ("pyarrow", "fastparquet"))
+
+def _latest_path(table, snapshot_dir):
+    return os.path.join(snapshot_dir, f"{table}.latest")
+
+def _snapshot_paths(table, content_hash, snapshot_dir):
+    base = os.path.join(snapshot_dir, f"{table}-{content_hash}")
+    return base + ".csv", base + ".parquet"
+
+def _load_snapshot(table, snapshot_dir, max_age_hours):
+    """The newest snapshot of table if it is recent enough, otherwise None."""
+    latest = _latest_path(table, snapshot_dir)
+    if not os.path.exists(latest):
+        return None
+    if max_age_hours is not None and time.time() - os.path.getmtime(latest) > max_age_hours * 3600:
+        return None
+    with open(latest) as file:
+        content_hash = file.read().strip()
+    csv_path, frame_path = _snapshot_paths(table, content_hash, snapshot_dir)
+    if PARQUET and os.path.exists(frame_path):
+        df = pd.read_parquet(frame_path)
+    elif os.path.exists(csv_path):
+        df = pd.read_csv(csv_path)
+    else:
+        return None
+    df.attrs['snapshot'] = content_hash
     return df
 
-def load_toi_data():
-    url = "https://exoplanetarchive.ipac.caltech.edu/TAP/sync?query=select+*+from+toi&format=csv"
-    r = requests.get(url, timeout=30)
-    df = pd.read_csv(StringIO(r.text))
-    return df
\ No newline at end of file
+def _save_snapshot(table, text, snapshot_dir):
+    content_hash = hashlib.sha256(text.encode()).hexdigest()[:16]
+    os.makedirs(snapshot_dir, exist_ok=True)
+    csv_path, frame_path = _snapshot_paths(table, content_hash, snapshot_dir)
+    df = pd.read_csv(StringIO(text))
+    if not os.path.exists(csv_path):
+        with open(csv_path + ".tmp", 'w') as file:
+            file.write(text)
+        os.replace(csv_path + ".tmp", csv_path)
+    if PARQUET and not os.path.exists(frame_path):
+        df.to_parquet(frame_path + ".tmp")
+        os.replace(frame_path + ".tmp", frame_path)
+    latest = _latest_path(table, snapshot_dir)
+    with open(latest + ".tmp", 'w') as file:
+        file.write(content_hash)
+    # Also refreshes the pointer's mtime, which is what the max age is measured from
+    os.replace(latest + ".tmp", latest)
+    df.attrs['snapshot'] = content_hash
+    return df
+
+def load_table(table, offline=None, max_age_hours=None, snapshot_dir=None):
+    """
+    Load a whole archive table, from a snapshot when allowed. max_age_hours=0
+    forces a download; offline raises if no snapshot exists.
+    """
+    offline = OFFLINE if offline is None else offline
+    max_age_hours = SNAPSHOT_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+
+    df = _load_snapshot(table, snapshot_dir, None if offline else max_age_hours)
+    if df is not None:
+        return df
+    if offline:
+        raise RuntimeError(f"No snapshot of '{table}' in {snapshot_dir}; run once without TRAINING_OFFLINE=1")
+
+    r = requests.get(TAP_URL.format(table=table), timeout=30)
+    r.raise_for_status()
+    return _save_snapshot(table, r.text, snapshot_dir)
+
+def load_koi_data(**kwargs):
+    return load_table("cumulative", **kwargs)
+
+def load_toi_data(**kwargs):
+    return load_table("toi", **kwargs)
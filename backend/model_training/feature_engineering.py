@@ -1,11 +1,13 @@
 import numpy as np
 import pandas as pd
 
-def add_physics_features(df: pd.DataFrame) -> pd.DataFrame:
+def add_physics_features(df: pd.DataFrame, fill_missing: bool = True) -> pd.DataFrame:
     df = df.copy()
-    df['koi_depth'] = df['koi_depth'].fillna(df['koi_depth'].median())
+    if fill_missing:
+        df['koi_depth'] = df['koi_depth'].fillna(df['koi_depth'].median())
     df['koi_depth_log'] = np.log1p(df['koi_depth'])         
-    df['koi_model_snr'] = df['koi_model_snr'].fillna(df['koi_model_snr'].median())
+    if fill_missing:
+        df['koi_model_snr'] = df['koi_model_snr'].fillna(df['koi_model_snr'].median())
     df['koi_model_snr_log'] = np.log1p(df['koi_model_snr'])
     df['transit_strength'] = df['koi_depth'] * df['koi_model_snr'] / (df['koi_period'] + 1)
     df['planet_star_ratio'] = df['koi_prad'] / (df['koi_steff'] / 5778)  # normalize to solar T_eff
@@ -27,3 +29,24 @@ def preprocess_features(df: pd.DataFrame, fill_with="median") -> pd.DataFrame:
         
         
     return df
+
+def fit_preprocess_stats(df: pd.DataFrame) -> dict:
+    """
+    Record the (median, lower_bound, upper_bound) that preprocess_features
+    would use for each numeric column, so inference can replay them.
+    """
+    stats = {}
+    for col in df.select_dtypes(include=[np.number]).columns:
+        median = df[col].median()
+        Q1, Q3 = df[col].fillna(median).quantile([0.25, 0.75])
+        IQR = Q3 - Q1
+        stats[col] = (float(median), float(Q1 - 2.0 * IQR), float(Q3 + 2.0 * IQR))
+    return stats
+
+def apply_preprocess_stats(df: pd.DataFrame, stats: dict) -> pd.DataFrame:
+    """Fill and clip with frozen statistics; each row is treated independently."""
+    df = df.copy()
+    for col, (median, lower_bound, upper_bound) in stats.items():
+        if col in df.columns:
+            df[col] = df[col].fillna(median).clip(lower_bound, upper_bound)
+    return df
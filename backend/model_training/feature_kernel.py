@@ -0,0 +1,244 @@
+"""
+Array-native replacement for the pandas feature path used at inference.
+
+FeatureKernel turns raw (n, 12) MODEL_COLUMNS values into the scaler's
+(n, 18) input - frozen median fill and clip (apply_preprocess_stats),
+add_physics_features and, optionally, the StandardScaler - with in-place
+NumPy operations on a per-thread buffer that is reused between calls (up to
+FEATURE_BUFFER_MAX_ROWS rows; larger batches get buffers of their own that
+are freed with the result). Every
+operation is evaluated in the same order as the pandas/sklearn code, so the
+output is bit-identical.
+
+    python -m model_training.feature_kernel check   # equivalence + speed report
+"""
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+RAW_COLUMNS = [
+    'koi_period', 'koi_time0bk', 'koi_duration', 'koi_depth', 'koi_prad',
+    'koi_impact', 'koi_model_snr', 'koi_score', 'koi_pdisposition_bin',
+    'koi_steff', 'koi_srad', 'koi_slogg'
+]
+DERIVED_COLUMNS = [
+    'koi_depth_log', 'koi_model_snr_log', 'transit_strength',
+    'planet_star_ratio', 'impact_depth_product', 'period_duration_ratio'
+]
+FEATURE_COLUMNS = RAW_COLUMNS + DERIVED_COLUMNS
+
+# Largest per-thread buffer kept between calls (about 10 MB at the default)
+FEATURE_BUFFER_MAX_ROWS = int(os.environ.get("FEATURE_BUFFER_MAX_ROWS", "65536"))
+
+_col = {name: i for i, name in enumerate(FEATURE_COLUMNS)}
+PERIOD, DURATION, DEPTH, PRAD = _col['koi_period'], _col['koi_duration'], _col['koi_depth'], _col['koi_prad']
+IMPACT, SNR, STEFF = _col['koi_impact'], _col['koi_model_snr'], _col['koi_steff']
+DEPTH_LOG, SNR_LOG, TRANSIT, RATIO = _col['koi_depth_log'], _col['koi_model_snr_log'], _col['transit_strength'], _col['planet_star_ratio']
+IMPACT_DEPTH, PERIOD_DURATION = _col['impact_depth_product'], _col['period_duration_ratio']
+
+
+class FeatureKernel:
+    def __init__(self, preprocess_stats=None, scaler=None):
+        """
+        preprocess_stats: {column: (median, lower, upper)} from
+        fit_preprocess_stats, or None to skip fill/clip.
+        scaler: a fitted StandardScaler over FEATURE_COLUMNS, or None.
+        """
+        n = len(RAW_COLUMNS)
+        self.preprocess_stats = preprocess_stats
+        # Columns without frozen stats are left as they are
+        self.has_stats = np.zeros(n, dtype=bool)
+        self.median = np.full(n, np.nan)
+        self.lower = np.full(n, -np.inf)
+        self.upper = np.full(n, np.inf)
+        for i, column in enumerate(RAW_COLUMNS):
+            if preprocess_stats and column in preprocess_stats:
+                self.has_stats[i] = True
+                self.median[i], self.lower[i], self.upper[i] = preprocess_stats[column]
+        # pandas' clip ignores a NaN bound
+        self.lower[np.isnan(self.lower)] = -np.inf
+        self.upper[np.isnan(self.upper)] = np.inf
+
+        self.scaler = scaler
+        if scaler is not None:
+            names = getattr(scaler, 'feature_names_in_', None)
+            if names is not None and list(names) != FEATURE_COLUMNS:
+                raise ValueError(f"Scaler columns {list(names)} do not match {FEATURE_COLUMNS}")
+            self.mean = scaler.mean_ if scaler.with_mean else None
+            self.scale = scaler.scale_ if scaler.with_std else None
+        self._local = threading.local()
+
+    def _buffers(self, n):
+        """(out, nan, column) scratch arrays for n rows."""
+        if n > FEATURE_BUFFER_MAX_ROWS:
+            # One-off sizes are not kept, so a single huge batch does not pin its memory
+            return np.empty((n, len(FEATURE_COLUMNS))), np.empty((n, len(RAW_COLUMNS)), dtype=bool), np.empty(n)
+        local = self._local
+        if getattr(local, 'capacity', 0) < n:
+            local.capacity = min(max(n, 2 * getattr(local, 'capacity', 0), 16), FEATURE_BUFFER_MAX_ROWS)
+            local.out = np.empty((local.capacity, len(FEATURE_COLUMNS)))
+            local.nan = np.empty((local.capacity, len(RAW_COLUMNS)), dtype=bool)
+            local.column = np.empty(local.capacity)
+        return local.out[:n], local.nan[:n], local.column[:n]
+
+    def _log1p(self, out, source, target):
+        # NumPy's vectorized log1p (used for contiguous input, as pandas'
+        # Series are) can differ from the strided loop in the last bit
+        _, _, column = self._buffers(len(out))
+        np.copyto(column, out[:, source])
+        np.log1p(column, out=column)
+        out[:, target] = column
+
+    def load(self, values):
+        """
+        Copy raw (n, 12) values into this thread's buffer and return the
+        (n, 18) view; it is overwritten by the next call on the same thread.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        out, _, _ = self._buffers(len(values))
+        out[:, :len(RAW_COLUMNS)] = values
+        return out
+
+    def preprocess(self, out):
+        """apply_preprocess_stats: fill NaN with the median, then clip."""
+        if self.preprocess_stats is None:
+            return out
+        raw = out[:, :len(RAW_COLUMNS)]
+        _, nan, _ = self._buffers(len(out))
+        np.isnan(raw, out=nan)
+        nan &= self.has_stats
+        np.copyto(raw, self.median, where=nan)
+        np.clip(raw, self.lower, self.upper, out=raw)
+        return out
+
+    def physics(self, out):
+        """add_physics_features(fill_missing=False), same operation order."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._physics(out)
+
+    def _physics(self, out):
+        self._log1p(out, DEPTH, DEPTH_LOG)
+        self._log1p(out, SNR, SNR_LOG)
+        # (depth * snr) / (period + 1), using the ratio column as scratch
+        np.multiply(out[:, DEPTH], out[:, SNR], out=out[:, TRANSIT])
+        np.add(out[:, PERIOD], 1, out=out[:, RATIO])
+        np.divide(out[:, TRANSIT], out[:, RATIO], out=out[:, TRANSIT])
+        # prad / (steff / 5778)
+        np.divide(out[:, STEFF], 5778, out=out[:, RATIO])
+        np.divide(out[:, PRAD], out[:, RATIO], out=out[:, RATIO])
+        np.multiply(out[:, IMPACT], out[:, DEPTH_LOG], out=out[:, IMPACT_DEPTH])
+        # period / (duration / 24)
+        np.divide(out[:, DURATION], 24, out=out[:, PERIOD_DURATION])
+        np.divide(out[:, PERIOD], out[:, PERIOD_DURATION], out=out[:, PERIOD_DURATION])
+        return out
+
+    def scale_(self, out):
+        """StandardScaler.transform, in place; rejects infinities like it does."""
+        if self.scaler is not None:
+            flat = out.ravel()
+            if len(flat) and (np.fmax.reduce(flat) == np.inf or np.fmin.reduce(flat) == -np.inf):
+                raise ValueError("Input X contains infinity or a value too large for dtype('float64').")
+            if self.mean is not None:
+                out -= self.mean
+            if self.scale is not None:
+                out /= self.scale
+        return out
+
+    def transform(self, values):
+        """Raw (n, 12) values -> (n, 18) features, scaled if there is a scaler."""
+        return self.scale_(self.physics(self.preprocess(self.load(values))))
+
+
+def pandas_features(values, preprocess_stats=None, scaler=None):
+    """The pandas reference path: apply_preprocess_stats + add_physics_features (+ scaler)."""
+    import pandas as pd
+    from .feature_engineering import add_physics_features, apply_preprocess_stats
+
+    df = pd.DataFrame(np.asarray(values, dtype=np.float64), columns=RAW_COLUMNS)
+    if preprocess_stats is not None:
+        df = apply_preprocess_stats(df, preprocess_stats)
+    df = add_physics_features(df, fill_missing=False)
+    return scaler.transform(df) if scaler is not None else df[FEATURE_COLUMNS].to_numpy()
+
+
+def check_equivalence(rows=10000, seed=0, preprocess_stats=None, scaler=None):
+    """
+    Compare the kernel with the pandas path on random KOI-like rows
+    (including NaNs, zeros and out-of-range values) and time both.
+    """
+    rng = np.random.default_rng(seed)
+    values = np.exp(rng.normal(1.0, 2.0, (rows, len(RAW_COLUMNS))))
+    values[rng.random(values.shape) < 0.05] = np.nan
+    values[rng.random(values.shape) < 0.01] = 0.0
+    if preprocess_stats is None:
+        medians = np.nanmedian(values, axis=0)
+        preprocess_stats = {
+            column: (float(medians[i]), float(medians[i] / 10), float(medians[i] * 10))
+            for i, column in enumerate(RAW_COLUMNS)
+        }
+
+    report = {'rows': rows}
+    for label, stats in (('with_stats', preprocess_stats), ('without_stats', None)):
+        kernel = FeatureKernel(stats, scaler)
+        expected = _outcome(lambda: pandas_features(values, stats, scaler))
+        actual = _outcome(lambda: kernel.transform(values))
+        if isinstance(expected, Exception) or isinstance(actual, Exception):
+            # Both paths must reject the same input (infinite features reaching the scaler)
+            report[label] = {'identical': type(expected) is type(actual), 'error': str(expected)}
+            continue
+        same = np.array_equal(expected, actual, equal_nan=True)
+        with np.errstate(invalid='ignore'):
+            diff = np.abs(expected - actual)
+        report[label] = {
+            'identical': bool(same),
+            'max_abs_diff': 0.0 if same else float(np.nanmax(diff)),
+        }
+
+    kernel = FeatureKernel(preprocess_stats, scaler)
+    for n in (1, 100, rows):
+        pandas_seconds = _best_time(lambda: pandas_features(values[:n], preprocess_stats, scaler))
+        kernel_seconds = _best_time(lambda: kernel.transform(values[:n]))
+        report[f'speedup_{n}_rows'] = round(pandas_seconds / kernel_seconds, 1)
+        report[f'kernel_us_{n}_rows'] = round(kernel_seconds * 1e6, 1)
+    return report
+
+
+def _outcome(run):
+    try:
+        return run()
+    except ValueError as e:
+        return e
+
+
+def _best_time(run, repeats=20):
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the NumPy feature kernel against the pandas path")
+    parser.add_argument('command', choices=['check'])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--with-model', action='store_true', help="use the served preprocess stats and scaler")
+    args = parser.parse_args()
+
+    stats, scaler = None, None
+    if args.with_model:
+        from .registry import model_registry
+        artifacts = model_registry.get()
+        stats, scaler = artifacts.preprocess_stats, artifacts.scaler
+    report = check_equivalence(args.rows, preprocess_stats=stats, scaler=scaler)
+    print(report)
+    if not (report['with_stats']['identical'] and report['without_stats']['identical']):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""
+Incremental retraining when the archive adds or revises KOI dispositions.
+
+train.py records which snapshot it trained on, a fingerprint of every row's
+model inputs and labels, and which KOIs it held out for validation
+(training_state.sav). `incremental.py run` loads the newest snapshot, finds
+the rows that are new or whose fingerprint changed, and extends the saved
+ensemble with them instead of refitting it:
+
+- RandomForest: warm start, adding trees fit on the update set
+- XGBoost / CatBoost: more boosting rounds starting from the saved model
+
+The update set is the new and changed training rows plus an equal-sized
+random replay of unchanged ones, so the added trees do not only see the
+newest KOIs; SMOTE balances just that set. A class the update set lacks (or
+has too few rows of for SMOTE) is topped up with replayed rows of that
+class, since the members can only be extended with every class present; if
+no training row of it is left, the run stops before publishing anything. Rows go through the model's frozen
+preprocess stats and scaler, so old and new trees share one feature space.
+If the training rows' features have drifted from the scaler by more than
+INCREMENTAL_DRIFT_THRESHOLD (shift of a feature's mean or log spread, in
+scaler standard deviations), the scaler is refit - which the existing trees
+cannot follow - and the run falls back to a full retrain.
+
+Publishing replaces ensemble_model.sav, scaler.sav and preprocess_stats.sav
+and re-exports compiled_model.npz and model_artifact/ if they exist, so the
+server never keeps serving the previous ensemble from them. A full retrain
+also refits screen_model.sav, since the cascade's screen reads the refit
+scaler's features.
+
+New KOIs are split 80/20 into training and validation rows like the
+original split, and KOIs held out before stay held out, so the accuracy
+reported before and after the update (and for a full retrain with
+--compare) is always measured on rows none of the models trained on.
+
+    python incremental.py run              # update and publish the model files
+    python incremental.py run --compare    # also time a full retrain on the same rows
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+TRAINING_STATE_PATH = os.environ.get("TRAINING_STATE_PATH", "training_state.sav")
+INCREMENTAL_DRIFT_THRESHOLD = float(os.environ.get("INCREMENTAL_DRIFT_THRESHOLD", "0.1"))
+
+# Identifies a KOI across archive releases
+ROW_KEY = 'kepoi_name'
+# Raw columns whose change makes a row "changed": the model inputs and labels
+FINGERPRINT_COLUMNS = [
+    'koi_period', 'koi_time0bk', 'koi_duration', 'koi_depth', 'koi_prad', 'koi_impact',
+    'koi_model_snr', 'koi_score', 'koi_steff', 'koi_srad', 'koi_slogg',
+    'koi_pdisposition', 'koi_disposition',
+]
+# Fewest trees / rounds added per member, however few rows changed
+MIN_ADDED = 10
+# Unchanged training rows replayed per new or changed row
+REPLAY_RATIO = 1.0
+# Fewest update rows of each class (SMOTE's 5 neighbours plus one)
+MIN_CLASS_ROWS = 6
+
+
+def row_fingerprints(df):
+    """uint64 hash per row of the FINGERPRINT_COLUMNS it has."""
+    columns = [col for col in FINGERPRINT_COLUMNS if col in df.columns]
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+def save_training_state(df, validation_index, path=TRAINING_STATE_PATH, history=None):
+    """
+    Record the rows a model was trained and validated on. validation_index
+    holds the positions in df of the validation rows.
+    """
+    if ROW_KEY not in df.columns:
+        print(f"⚠️  No {ROW_KEY} column; incremental training needs a full retrain first")
+        return None
+    validation = np.zeros(len(df), dtype=bool)
+    validation[np.asarray(validation_index)] = True
+    state = {
+        'snapshot': df.attrs.get('snapshot'),
+        'keys': df[ROW_KEY].to_numpy(dtype=object),
+        'fingerprints': row_fingerprints(df),
+        'validation': df.loc[validation, ROW_KEY].to_numpy(dtype=object),
+        'history': list(history or []),
+    }
+    joblib.dump(state, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return state
+
+
+def feature_drift(X, scaler):
+    """
+    {feature: drift} for the rows X against the scaler's fit: the larger of
+    the mean's shift in scaler standard deviations and |log| of the ratio of
+    standard deviations.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    mean = np.nanmean(X, axis=0)
+    std = np.nanstd(X, axis=0)
+    # StandardScaler uses a scale of 1 for constant features
+    std = np.where((std == 0) & (scaler.var_ == 0), 1.0, std)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.abs(mean - scaler.mean_) / scaler.scale_
+        spread = np.abs(np.log(std / scaler.scale_))
+    drift = np.nan_to_num(np.fmax(shift, spread), nan=0.0)
+    return {str(col): float(value) for col, value in zip(scaler.feature_names_in_, drift)}
+
+
+def split_rows(df, state):
+    """
+    (validation, changed) boolean masks over df: validation holds the KOIs
+    held out last time plus a stratified fifth of new KOIs; changed marks
+    rows that are new or differ from the trained version.
+    """
+    from sklearn.model_selection import train_test_split
+
+    keys = df[ROW_KEY].to_numpy(dtype=object)
+    validation = np.isin(keys, state['validation'])
+    changed = ~np.isin(row_fingerprints(df), state['fingerprints'])
+    new = np.flatnonzero(~np.isin(keys, state['keys']))
+    if len(new) >= 5:
+        labels = df['koi_disposition'].to_numpy()[new]
+        counts = pd.Series(labels).value_counts()
+        stratify = labels if counts.min() >= 2 else None
+        _, held_out = train_test_split(new, test_size=0.2, stratify=stratify, random_state=42)
+        validation[held_out] = True
+    return validation, changed
+
+
+def balance(X, y):
+    """SMOTE, with fewer neighbours when a class has only a handful of rows."""
+    from imblearn.over_sampling import SMOTE
+
+    smallest = int(pd.Series(y).value_counts().min())
+    if smallest < 2:
+        return X, y
+    return SMOTE(random_state=42, k_neighbors=min(5, smallest - 1)).fit_resample(X, y)
+
+
+def cover_classes(rows, unchanged, y, classes, rng):
+    """
+    rows plus unchanged rows replayed for each of classes that rows has
+    fewer than MIN_CLASS_ROWS of. Returns (rows, classes still absent).
+    """
+    labels = y.to_numpy()
+    extra = []
+    absent = []
+    for cls in classes:
+        have = int((labels[rows] == cls).sum())
+        if have >= MIN_CLASS_ROWS:
+            continue
+        pool = np.setdiff1d(unchanged[labels[unchanged] == cls], rows)
+        take = min(len(pool), MIN_CLASS_ROWS - have)
+        if take:
+            extra.append(rng.choice(pool, size=take, replace=False))
+        if have + take == 0:
+            absent.append(cls)
+    return np.concatenate([rows, *extra]), absent
+
+
+def extend_ensemble(ensemble, X, y, fraction, cores):
+    """
+    Add trees / boosting rounds fit on (X, y) to each member of a fitted
+    VotingClassifier, in place. Each member grows by `fraction` of its size
+    (at least MIN_ADDED), so the update weighs in about as much as the share
+    of training rows it stands for. Returns {member: (old size, new size)}.
+    """
+    import xgboost as xgb
+    from catboost import CatBoostClassifier
+    from model import set_threads
+
+    # Warm-started forests and continued boosting cannot change the class count
+    missing = set(ensemble.classes_) - set(np.unique(y))
+    if missing:
+        raise ValueError(f"The update set has no rows of class {', '.join(map(str, sorted(missing)))}; "
+                         "the ensemble needs every class")
+    y = ensemble.le_.transform(y)
+    grown = {}
+
+    rf = ensemble.named_estimators_['rf']
+    size = len(rf.estimators_)
+    previous = set_threads('rf', rf, cores)
+    rf.set_params(warm_start=True, n_estimators=size + max(MIN_ADDED, math.ceil(size * fraction)))
+    rf.fit(X, y)
+    rf.set_params(warm_start=False)
+    set_threads('rf', rf, previous)
+    grown['rf'] = (size, len(rf.estimators_))
+
+    old = ensemble.named_estimators_['xgb']
+    size = old.get_booster().num_boosted_rounds()
+    model = xgb.XGBClassifier(**dict(old.get_params(), n_estimators=max(MIN_ADDED, math.ceil(size * fraction))))
+    previous = set_threads('xgb', model, cores)
+    model.fit(X, y, xgb_model=old.get_booster())
+    set_threads('xgb', model, previous)
+    grown['xgb'] = (size, model.get_booster().num_boosted_rounds())
+    ensemble.named_estimators_['xgb'] = model
+
+    old = ensemble.named_estimators_['cat']
+    size = old.tree_count_
+    params = dict(old.get_params(), iterations=max(MIN_ADDED, math.ceil(size * fraction)))
+    model = CatBoostClassifier(**params)
+    model.fit(X, y, init_model=old)
+    grown['cat'] = (size, model.tree_count_)
+    ensemble.named_estimators_['cat'] = model
+
+    names = [name for name, _ in ensemble.estimators]
+    ensemble.estimators_ = [ensemble.named_estimators_[name] for name in names]
+    return grown
+
+
+def score(model, X, y):
+    from sklearn.metrics import accuracy_score, roc_auc_score
+
+    proba = model.predict_proba(X)
+    return {
+        'accuracy': float(accuracy_score(y, model.classes_[proba.argmax(axis=1)])),
+        'auc_roc': float(roc_auc_score(y, proba, multi_class='ovr', average='weighted')),
+    }
+
+
+def file_version(paths):
+    """The registry's model version for these files (hash of their contents)."""
+    import hashlib
+
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+
+def refresh_exports(ensemble, scaler, preprocess_stats, model_path='ensemble_model.sav'):
+    """
+    Re-export compiled_model.npz and model_artifact/ if they exist, stamped
+    with model_path's hash. Returns the paths written. A failed export is
+    reported and left stale; the server ignores it in favour of the pickles.
+    """
+    import sys
+
+    # The exporters live in the model_training package this script runs inside
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from model_training.model_artifact import MODEL_ARTIFACT_PATH, export_artifact
+    from model_training.registry import file_digest
+    from model_training.tree_engine import COMPILED_MODEL_PATH, compile_ensemble
+
+    source = file_digest(model_path)
+    written = []
+    compiled = None
+    try:
+        if os.path.exists(COMPILED_MODEL_PATH):
+            compiled = compile_ensemble(ensemble)
+            compiled.save(COMPILED_MODEL_PATH + '.tmp.npz', source=source)
+            os.replace(COMPILED_MODEL_PATH + '.tmp.npz', COMPILED_MODEL_PATH)
+            written.append(COMPILED_MODEL_PATH)
+        if os.path.exists(os.path.join(MODEL_ARTIFACT_PATH, 'manifest.json')):
+            export_artifact(compiled or ensemble, scaler, preprocess_stats, MODEL_ARTIFACT_PATH, source=source)
+            written.append(MODEL_ARTIFACT_PATH)
+    except Exception as e:
+        print(f"⚠️  Re-exporting the compiled model failed ({e}); the server will serve the pickles until it is re-run")
+    return written
+
+
+def full_retrain(X_train, y_train, cores):
+    """
+    The model part of run_complete_pipeline: scaler, SMOTE over every row,
+    ensemble. Returns (ensemble, scaler, (X_bal, y_bal)).
+    """
+    from sklearn.preprocessing import StandardScaler
+    from imblearn.over_sampling import SMOTE
+    from train import fit_ensemble
+
+    scaler = StandardScaler().fit(X_train)
+    X_bal, y_bal = SMOTE(random_state=42).fit_resample(scaler.transform(X_train), y_train)
+    return fit_ensemble(X_bal, y_bal, cores), scaler, (X_bal, y_bal)
+
+
+def run(compare=False, drift_threshold=INCREMENTAL_DRIFT_THRESHOLD, state_path=TRAINING_STATE_PATH):
+    """Update the saved model with the newest snapshot; returns the report (None if nothing changed)."""
+    from data_loader import load_koi_data
+    from train import build_training_matrix, TRAINING_CORES
+
+    if not os.path.exists(state_path):
+        raise RuntimeError(f"No {state_path}; run train.py once before training incrementally")
+    state = joblib.load(state_path)
+    df = load_koi_data()
+    if ROW_KEY not in df.columns:
+        raise RuntimeError(f"The snapshot has no {ROW_KEY} column to match rows across releases")
+    if df.attrs['snapshot'] == state['snapshot']:
+        print(f"Snapshot {state['snapshot']} is what the model was trained on; nothing to do")
+        return None
+
+    started = time.perf_counter()
+    ensemble = joblib.load('ensemble_model.sav')
+    scaler = joblib.load('scaler.sav')
+    preprocess_stats = joblib.load('preprocess_stats.sav')
+    parent = file_version(['ensemble_model.sav', 'scaler.sav', 'preprocess_stats.sav'])
+
+    validation, changed = split_rows(df, state)
+    training = ~validation
+    update = changed & training
+    X, y, _ = build_training_matrix(df.copy(), preprocess_stats)
+    X_val_scaled = scaler.transform(X[validation])
+    y_val = y[validation]
+    before = score(ensemble, X_val_scaled, y_val)
+
+    drift = feature_drift(X[training], scaler)
+    worst = max(drift, key=drift.get)
+    report = {
+        'snapshot': df.attrs['snapshot'],
+        'parent_version': parent,
+        'rows': int(len(df)),
+        'training_rows': int(training.sum()),
+        'validation_rows': int(validation.sum()),
+        'changed_rows': int(changed.sum()),
+        'update_rows': int(update.sum()),
+        'max_drift': {'feature': worst, 'value': drift[worst], 'threshold': drift_threshold},
+        'before': before,
+    }
+
+    if drift[worst] > drift_threshold:
+        # Refitting the scaler moves every feature under the existing trees
+        print(f"🔁 {worst} drifted by {drift[worst]:.3f} (> {drift_threshold}); refitting the scaler and retraining fully")
+        report['mode'] = 'full'
+        X, y, preprocess_stats = build_training_matrix(df.copy())
+        ensemble, scaler, balanced = full_retrain(X[training], y[training], TRAINING_CORES)
+        X_val_scaled = scaler.transform(X[validation])
+    elif update.any():
+        report['mode'] = 'incremental'
+        # Equal-sized random replay of unchanged training rows, topped up to cover every class
+        rng = np.random.default_rng(42)
+        unchanged = np.flatnonzero(training & ~changed)
+        replay_size = min(len(unchanged), int(update.sum() * REPLAY_RATIO))
+        replay = rng.choice(unchanged, size=replay_size, replace=False)
+        rows, absent = cover_classes(np.concatenate([np.flatnonzero(update), replay]), unchanged, y,
+                                     ensemble.classes_, rng)
+        if absent:
+            # A full retrain could not bring the class back either
+            raise RuntimeError(f"No training rows of class {', '.join(map(str, absent))} are left; nothing was published")
+        report['replayed_rows'] = int(len(rows) - update.sum())
+        X_bal, y_bal = balance(scaler.transform(X.iloc[rows]), y.iloc[rows])
+        report['grown'] = extend_ensemble(ensemble, X_bal, y_bal, update.sum() / training.sum(), TRAINING_CORES)
+    else:
+        print("Only validation rows changed; the model is unchanged")
+        return None
+    report['after'] = score(ensemble, X_val_scaled, y_val)
+    report['seconds'] = round(time.perf_counter() - started, 2)
+
+    # Publish: the cascade thresholds are re-picked for the new ensemble. The
+    # screen reads the scaled features too, so a refit scaler means a refit screen
+    published = [('ensemble_model.sav', ensemble), ('scaler.sav', scaler), ('preprocess_stats.sav', preprocess_stats)]
+    thresholds = None
+    if os.path.exists('screen_model.sav'):
+        from cascade import choose_thresholds
+
+        if report['mode'] == 'full':
+            from model import build_screen
+
+            screen = build_screen().fit(*balanced)
+            published.append(('screen_model.sav', screen))
+        else:
+            screen = joblib.load('screen_model.sav')
+        thresholds = choose_thresholds(screen.predict_proba(X_val_scaled), ensemble.predict_proba(X_val_scaled),
+                                       y_val, ensemble.classes_)
+    for name, value in published:
+        joblib.dump(value, name + '.tmp')
+        os.replace(name + '.tmp', name)
+    if thresholds is not None:
+        from cascade import save_thresholds
+
+        save_thresholds(thresholds, 'cascade_thresholds.json')
+    report['exports'] = refresh_exports(ensemble, scaler, preprocess_stats)
+    report['version'] = file_version(['ensemble_model.sav', 'scaler.sav', 'preprocess_stats.sav'])
+    history = state.get('history', []) + [{key: report[key] for key in ('version', 'parent_version', 'snapshot', 'mode')}]
+    save_training_state(df, np.flatnonzero(validation), state_path, history)
+
+    if compare:
+        started = time.perf_counter()
+        X_full, y_full, _ = build_training_matrix(df.copy())
+        full, full_scaler, _ = full_retrain(X_full[training], y_full[training], TRAINING_CORES)
+        full_seconds = time.perf_counter() - started
+        report['full_retrain'] = dict(score(full, full_scaler.transform(X_full[validation]), y_val), seconds=round(full_seconds, 2))
+        report['time_saved_seconds'] = round(full_seconds - report['seconds'], 2)
+        report['accuracy_difference'] = report['after']['accuracy'] - report['full_retrain']['accuracy']
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the saved ensemble with new and changed KOI rows")
+    parser.add_argument('command', choices=['run'])
+    parser.add_argument('--compare', action='store_true', help="also run a full retrain on the same rows and report the difference")
+    parser.add_argument('--drift-threshold', type=float, default=INCREMENTAL_DRIFT_THRESHOLD,
+                        help="feature drift (scaler standard deviations) that forces a full retrain")
+    args = parser.parse_args()
+
+    report = run(args.compare, args.drift_threshold)
+    if report is not None:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
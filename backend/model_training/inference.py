@@ -1,6 +1,9 @@
-import joblib
+import os
+import numpy as np
 import pandas as pd
-from .feature_engineering import add_physics_features, preprocess_features
+from .feature_engineering import add_physics_features, apply_preprocess_stats
+from .registry import model_registry
+from .metrics import CASCADE_ROWS, STAGE_SECONDS, SUBMODEL_SECONDS
 
 MODEL_COLUMNS = [
     'koi_period', 'koi_time0bk', 'koi_duration', 'koi_depth', 'koi_prad',
@@ -8,23 +11,126 @@ MODEL_COLUMNS = [
     'koi_steff', 'koi_srad', 'koi_slogg'
 ]
 
-# Load the model and scaler
-model = joblib.load('ensemble_model.sav')
-scaler = joblib.load('scaler.sav')
+# Batches up to this size go through the compiled tree engine when one has been
+# exported; it avoids the per-call overhead of the three libraries, which win
+# again on large batches
+COMPILED_MAX_ROWS = int(os.environ.get("COMPILED_MAX_ROWS", "64"))
+
 encode_map = { "FALSE POSITIVE": 0, "CANDIDATE": 1, "CONFIRMED": 2 }
 decode_map = {v: k for k, v in encode_map.items()}
 
+def build_features(df, preprocess_stats=None):
+    """
+    Build the scaler's input columns. Only frozen statistics are used, so a
+    row gets the same features whether it is scored alone or in a batch.
+    Serving uses the equivalent FeatureKernel; this is the pandas reference.
+    """
+    df = df[MODEL_COLUMNS].astype(float)
+    if preprocess_stats is not None:
+        with STAGE_SECONDS.time("preprocess"):
+            df = apply_preprocess_stats(df, preprocess_stats)
+    with STAGE_SECONDS.time("add_physics_features"):
+        return add_physics_features(df, fill_missing=False)
+
+def voting_predict_proba(model, X):
+    """
+    VotingClassifier(voting='soft').predict_proba, timing each member. Same
+    arithmetic as sklearn: the mean of the members' probabilities, weighted
+    by model.weights when set. Members set to 'drop' are skipped;
+    estimators_ holds the fitted members of the others, in order.
+    """
+    kept = [i for i, (_, estimator) in enumerate(model.estimators) if estimator != 'drop']
+    weights = None if model.weights is None else [model.weights[i] for i in kept]
+    probas = []
+    for i, estimator in zip(kept, model.estimators_):
+        with SUBMODEL_SECONDS.time(model.estimators[i][0]):
+            probas.append(estimator.predict_proba(X))
+    return np.average(np.asarray(probas), axis=0, weights=weights)
+
+def predict_proba_values(values, artifacts=None):
+    """
+    Class probabilities for a raw (n, 12) array in MODEL_COLUMNS order (NaN
+    for missing values). Features are built by the NumPy kernel in a reused
+    per-thread buffer, which is only valid until the next call.
+    """
+    artifacts = artifacts or model_registry.get()
+    kernel = artifacts.features
+    X = kernel.load(values)
+    with STAGE_SECONDS.time("preprocess"):
+        kernel.preprocess(X)
+    with STAGE_SECONDS.time("add_physics_features"):
+        kernel.physics(X)
+    with STAGE_SECONDS.time("scaler_transform"):
+        kernel.scale_(X)
+    if artifacts.cascade is not None:
+        return cascade_predict_proba(X, artifacts)
+    return full_predict_proba(X, artifacts)
+
+def cascade_predict_proba(X, artifacts):
+    """
+    Screen every row; rows the screen is confident about keep its
+    probabilities, the rest are scored by the full ensemble.
+    """
+    with STAGE_SECONDS.time("screen_model"):
+        proba = artifacts.cascade.screen.predict_proba(X)
+    uncertain = np.flatnonzero(~artifacts.cascade.accept(proba))
+    CASCADE_ROWS.inc("screen", len(X) - len(uncertain))
+    CASCADE_ROWS.inc("ensemble", len(uncertain))
+    if len(uncertain):
+        proba[uncertain] = full_predict_proba(X[uncertain], artifacts)
+    return proba
+
+def full_predict_proba(X, artifacts):
+    if artifacts.compiled is not None and len(X) <= COMPILED_MAX_ROWS:
+        with STAGE_SECONDS.time("compiled_model"):
+            return artifacts.compiled.predict_proba(X)
+    model = artifacts.batch_model()
+    with STAGE_SECONDS.time("model"):
+        if hasattr(model, 'named_estimators_') and getattr(model, 'voting', None) == 'soft':
+            return voting_predict_proba(model, X)
+        return model.predict_proba(X)
+
+def predict_proba_batch(df, artifacts=None):
+    return predict_proba_values(df[MODEL_COLUMNS].to_numpy(dtype=np.float64), artifacts)
+
+def _decode(proba, artifacts):
+    labels = artifacts.model.classes_[proba.argmax(axis=1)]
+    return [
+        {'prediction': decode_map[int(label)], 'proba': row}
+        for label, row in zip(labels, proba.tolist())
+    ]
+
+def predict_batch(df):
+    """Score every row of df with a single predict_proba call."""
+    artifacts = model_registry.get()
+    return _decode(predict_proba_batch(df, artifacts), artifacts)
+
 def predict_one(json_input):
-    df = pd.DataFrame([json_input])
-    df = df[MODEL_COLUMNS]
-    df = add_physics_features(df)
-    df = preprocess_features(df)
-    X = scaler.transform(df)
-    preds = model.predict(X)
-    proba = model.predict_proba(X)
-    return {
-        'prediction': decode_map[int(preds[0])],
-        'proba': proba.tolist()[0]
-    }
+    """Score one dict without building a DataFrame; missing or None values are NaN."""
+    values = np.array([[
+        np.nan if json_input.get(column) is None else json_input[column]
+        for column in MODEL_COLUMNS
+    ]], dtype=np.float64)
+    artifacts = model_registry.get()
+    return _decode(predict_proba_values(values, artifacts), artifacts)[0]
 
+def warm_up(sample_input):
+    """Load the model and run one synthetic prediction through every code path."""
+    model_registry.get()
+    predict_one(sample_input)
 
+def predict_rows(df):
+    """
+    predict_batch, falling back to row-by-row scoring if the batch fails so
+    that a bad row only fails itself.
+    """
+    try:
+        return predict_batch(df)
+    except Exception:
+        results = []
+        for _, row in df.iterrows():
+            try:
+                results.append(predict_one(row.to_dict()))
+            except Exception as e:
+                results.append({'error': f"Prediction failed: {str(e)}"})
+        return results
@@ -0,0 +1,161 @@
+"""
+Lightweight latency histograms rendered in the Prometheus text format.
+
+An observation is one perf_counter() pair, a bisect and a locked increment,
+so the instrumentation can stay on in production. Histograms observed in
+inference worker processes are shipped back to the server process as
+deltas (take_delta / merge_delta) so /metrics covers them too; the same
+goes for the few counters kept here.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from sub-millisecond model calls to slow uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, name, description, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(buckets)
+        # label value -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    @contextmanager
+    def time(self, label_value):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label_value, time.perf_counter() - started)
+
+    def take(self):
+        """Return the series and reset them."""
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    def merge(self, series):
+        with self._lock:
+            for label_value, (counts, total) in series.items():
+                mine = self._series.get(label_value)
+                if mine is None:
+                    self._series[label_value] = [list(counts), total]
+                else:
+                    mine[0] = [a + b for a, b in zip(mine[0], counts)]
+                    mine[1] += total
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {label_value: (list(counts), total) for label_value, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description, label):
+        self.name = name
+        self.description = description
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def take(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values):
+        for label_value, amount in values.items():
+            self.inc(label_value, amount)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for label_value, amount in sorted(self.values().items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {amount}')
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "exoplanet_stage_seconds",
+    "Time spent in each stage of the prediction path",
+    "stage",
+)
+SUBMODEL_SECONDS = Histogram(
+    "exoplanet_submodel_seconds",
+    "predict_proba time of each VotingClassifier member",
+    "model",
+)
+TAP_SECONDS = Histogram(
+    "exoplanet_tap_request_seconds",
+    "Latency of NASA Exoplanet Archive TAP queries",
+    "outcome",
+)
+
+CASCADE_ROWS = Counter(
+    "exoplanet_cascade_rows_total",
+    "Rows answered by each stage of the screening cascade",
+    "stage",
+)
+
+# Everything that is shipped back from worker processes and rendered
+SERIES = (STAGE_SECONDS, SUBMODEL_SECONDS, TAP_SECONDS, CASCADE_ROWS)
+
+# Callables returning extra exposition lines (counters kept elsewhere)
+_collectors = []
+
+
+def register_collector(collect):
+    _collectors.append(collect)
+
+
+def take_delta():
+    """Everything observed in this process since the last call, for merge_delta."""
+    return {metric.name: metric.take() for metric in SERIES}
+
+
+def merge_delta(delta):
+    for metric in SERIES:
+        values = delta.get(metric.name)
+        if values:
+            metric.merge(values)
+
+
+def render():
+    lines = []
+    for metric in SERIES:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
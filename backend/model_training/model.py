@@ -1,11 +1,25 @@
+import json
+import os
+from sklearn.calibration import CalibratedClassifierCV
 from sklearn.ensemble import RandomForestClassifier, VotingClassifier
 import xgboost as xgb
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from imblearn.over_sampling import SMOTE
 from catboost import CatBoostClassifier
 
-def build_rf():
-    return RandomForestClassifier(
+# Tuned hyperparameters exported by `python search.py export`; keyword
+# arguments to the build_* functions override their defaults
+MODEL_PARAMS_PATH = os.environ.get("MODEL_PARAMS_PATH", "best_params.json")
+
+def load_model_params(path=MODEL_PARAMS_PATH):
+    """{'rf': {...}, 'xgb': {...}, 'cat': {...}} from path, or {} if it does not exist."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+def build_rf(**overrides):
+    params = dict(
             n_estimators=300,
             max_depth=18,
             min_samples_split=4,
@@ -15,9 +29,11 @@ def build_rf():
             random_state=42,
             n_jobs=-1
         )
+    params.update(overrides)
+    return RandomForestClassifier(**params)
 
-def build_xgb():
-    return xgb.XGBClassifier(
+def build_xgb(**overrides):
+    params = dict(
             n_estimators=250,
             max_depth=9,
             learning_rate=0.08,
@@ -28,9 +44,11 @@ def build_xgb():
             random_state=42,
             eval_metric='mlogloss'
         )
+    params.update(overrides)
+    return xgb.XGBClassifier(**params)
 
-def build_catboost():
-    return CatBoostClassifier(
+def build_catboost(**overrides):
+    params = dict(
             iterations=200,
             depth=9,
             learning_rate=0.08,
@@ -40,5 +58,41 @@ def build_catboost():
             random_seed=42,
             verbose=False
         )
-def build_ensemble(rf, xgb_model,cat_model):
-    return VotingClassifier(estimators=[('rf', rf), ('xgb', xgb_model), ('cat', cat_model)], voting='soft')
+    params.update(overrides)
+    return CatBoostClassifier(**params)
+
+def build_ensemble(rf, xgb_model,cat_model, n_jobs=None):
+    return VotingClassifier(estimators=[('rf', rf), ('xgb', xgb_model), ('cat', cat_model)], voting='soft', n_jobs=n_jobs)
+
+def build_screen(**overrides):
+    """
+    First stage of the inference cascade: a shallow boosted model whose
+    probabilities are calibrated (isotonic, out-of-fold) so that a threshold
+    on them means something. ensemble=False keeps a single booster.
+    """
+    params = dict(
+            n_estimators=60,
+            max_depth=3,
+            learning_rate=0.2,
+            subsample=0.9,
+            random_state=42,
+            eval_metric='mlogloss',
+            n_jobs=1
+        )
+    params.update(overrides)
+    return CalibratedClassifierCV(xgb.XGBClassifier(**params), method='isotonic', cv=3, ensemble=False)
+
+# Parameter that sets each ensemble member's size (trees / boosting iterations)
+BUDGET_PARAMS = {'rf': 'n_estimators', 'xgb': 'n_estimators', 'cat': 'iterations'}
+
+# Parameter that sets each ensemble member's thread count
+THREAD_PARAMS = {'rf': 'n_jobs', 'xgb': 'n_jobs', 'cat': 'thread_count'}
+
+def set_threads(name, estimator, threads):
+    """Set a member's thread count; returns the previous value (-1 = all cores)."""
+    param = THREAD_PARAMS[name]
+    previous = estimator.get_params().get(param, -1)
+    # A fitted CatBoost model is frozen; its predict() uses all cores regardless
+    if not (name == 'cat' and estimator.is_fitted()):
+        estimator.set_params(**{param: threads})
+    return previous
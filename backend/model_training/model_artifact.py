@@ -0,0 +1,218 @@
+"""
+Memory-mappable export of the serving model.
+
+export_artifact() writes a directory holding the flattened ensemble
+(tree_engine.CompiledEnsemble) as one uncompressed .npy file per array, plus
+a manifest.json with the format and model version, the hash of the
+ensemble_model.sav it came from, the column order, the scaler's parameters
+and the frozen preprocess stats. load_artifact() maps
+the arrays read-only instead of unpickling anything, so every process
+serving the same export shares one copy of the tree arrays in the page cache
+and loading costs little more than reading the manifest.
+
+    python -m model_training.model_artifact export    # write model_artifact/ from the pickles
+    python -m model_training.model_artifact compare   # load time and memory, pickles vs export
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+
+from .feature_kernel import RAW_COLUMNS
+
+MODEL_ARTIFACT_PATH = os.environ.get("MODEL_ARTIFACT_PATH", "model_artifact")
+FORMAT_VERSION = 1
+
+
+class ManifestScaler:
+    """StandardScaler.transform from the mean and scale stored in the manifest."""
+
+    def __init__(self, columns, mean, scale):
+        self.feature_names_in_ = np.array(columns, dtype=object)
+        self.n_features_in_ = len(columns)
+        self.with_mean = mean is not None
+        self.with_std = scale is not None
+        self.mean_ = np.asarray(mean, dtype=np.float64) if self.with_mean else None
+        self.scale_ = np.asarray(scale, dtype=np.float64) if self.with_std else None
+
+    def transform(self, X):
+        if hasattr(X, 'columns'):
+            X = X[list(self.feature_names_in_)]
+        X = np.array(X, dtype=np.float64)
+        if self.with_mean:
+            X -= self.mean_
+        if self.with_std:
+            X /= self.scale_
+        return X
+
+
+def read_manifest(path=MODEL_ARTIFACT_PATH):
+    with open(os.path.join(path, 'manifest.json')) as file:
+        manifest = json.load(file)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ValueError(f"{path} has artifact format {manifest.get('format')}, expected {FORMAT_VERSION}")
+    return manifest
+
+
+def export_artifact(model, scaler, preprocess_stats, path=MODEL_ARTIFACT_PATH, source=None):
+    """
+    Write the artifact for a fitted build_ensemble() VotingClassifier (or an
+    already compiled ensemble) and its scaler. source is registry.file_digest
+    of the pickle the model came from; the registry only serves an export
+    whose source matches the current one. The directory is replaced as a
+    whole, so a running server never sees half an export.
+    """
+    from .tree_engine import CompiledEnsemble, compile_ensemble
+
+    compiled = model if isinstance(model, CompiledEnsemble) else compile_ensemble(model)
+    arrays = {name: np.asarray(array, order='C') for name, array in compiled.to_arrays().items()}
+    scaler_params = {
+        'mean': scaler.mean_.tolist() if scaler.with_mean else None,
+        'scale': scaler.scale_.tolist() if scaler.with_std else None,
+    }
+    stats = {column: list(values) for column, values in preprocess_stats.items()} if preprocess_stats else None
+
+    digest = hashlib.sha256()
+    for name in sorted(arrays):
+        digest.update(name.encode())
+        digest.update(arrays[name].tobytes())
+    digest.update(json.dumps([scaler_params, stats], sort_keys=True).encode())
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'version': digest.hexdigest()[:16],
+        'source': source,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'raw_columns': RAW_COLUMNS,
+        'columns': [str(column) for column in scaler.feature_names_in_],
+        'classes': [int(c) for c in compiled.classes_],
+        'scaler': scaler_params,
+        'preprocess_stats': stats,
+        'arrays': {name: {'dtype': array.dtype.str, 'shape': list(array.shape)} for name, array in arrays.items()},
+    }
+
+    tmp = path.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, name + '.npy'), array)
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    old = path.rstrip('/') + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+def load_artifact(path=MODEL_ARTIFACT_PATH, mmap_mode='r'):
+    """(model, scaler, preprocess_stats), with the tree arrays memory-mapped."""
+    from .tree_engine import CompiledEnsemble
+
+    manifest = read_manifest(path)
+    if manifest['raw_columns'] != RAW_COLUMNS:
+        raise ValueError(f"{path} was exported for columns {manifest['raw_columns']}, expected {RAW_COLUMNS}")
+    data = {}
+    for name, spec in manifest['arrays'].items():
+        array = np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+        if array.dtype.str != spec['dtype'] or list(array.shape) != spec['shape']:
+            raise ValueError(f"{path}/{name}.npy does not match the manifest")
+        # Plain ndarray view of the mapping; indexing a np.memmap is slower
+        data[name] = np.asarray(array)
+    model = CompiledEnsemble.from_arrays(data)
+    scaler = ManifestScaler(manifest['columns'], manifest['scaler']['mean'], manifest['scaler']['scale'])
+    stats = manifest['preprocess_stats']
+    preprocess_stats = {column: tuple(values) for column, values in stats.items()} if stats is not None else None
+    return model, scaler, preprocess_stats
+
+
+def _memory():
+    """Rss / Pss / Private_* of this process in MB (Linux smaps_rollup)."""
+    values = {}
+    with open('/proc/self/smaps_rollup') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss_mb': values.get('Rss', 0.0),
+        'pss_mb': values.get('Pss', 0.0),
+        'private_mb': values.get('Private_Clean', 0.0) + values.get('Private_Dirty', 0.0),
+    }
+
+
+def _measure(kind, artifact_path, rows, barrier, results):
+    from .registry import model_registry
+
+    started = time.perf_counter()
+    if kind == 'pickle':
+        model, scaler, _ = model_registry.load_pickles()
+    else:
+        model, scaler, _ = load_artifact(artifact_path)
+    load_seconds = time.perf_counter() - started
+    # Score a batch so the pages a prediction needs are actually resident
+    X = np.random.default_rng(0).normal(0, 1.5, (rows, scaler.n_features_in_))
+    model.predict_proba(X)
+    # Measure while every worker is alive, so shared pages are split between them
+    barrier.wait()
+    results.put(dict(_memory(), load_seconds=load_seconds))
+    barrier.wait()
+
+
+def compare(artifact_path=MODEL_ARTIFACT_PATH, workers=4, rows=2000):
+    """
+    Start `workers` processes per format, each loading the model and scoring
+    `rows` rows, and report load time and memory. Pss counts shared pages
+    once across processes, so its total is the physical memory used.
+    """
+    context = multiprocessing.get_context('spawn')
+    report = {}
+    for kind in ('pickle', 'artifact'):
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        processes = [
+            context.Process(target=_measure, args=(kind, artifact_path, rows, barrier, results))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        measured = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        report[kind] = {
+            'workers': workers,
+            'load_seconds': round(float(np.mean([m['load_seconds'] for m in measured])), 4),
+            'rss_mb_per_worker': round(float(np.mean([m['rss_mb'] for m in measured])), 1),
+            'private_mb_per_worker': round(float(np.mean([m['private_mb'] for m in measured])), 1),
+            'total_pss_mb': round(float(sum(m['pss_mb'] for m in measured)), 1),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mappable model artifact")
+    parser.add_argument('command', choices=['export', 'compare'])
+    parser.add_argument('--path', default=MODEL_ARTIFACT_PATH)
+    parser.add_argument('--workers', type=int, default=4, help="processes per format (compare)")
+    parser.add_argument('--rows', type=int, default=2000, help="rows each process scores (compare)")
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        from .registry import model_registry, file_digest
+
+        manifest = export_artifact(*model_registry.load_pickles(), path=args.path,
+                                   source=file_digest(model_registry.model_path))
+        print(f"Wrote {args.path} (version {manifest['version']})")
+    else:
+        print(json.dumps(compare(args.path, args.workers, args.rows), indent=2))
+
+
+if __name__ == "__main__":
+    main()
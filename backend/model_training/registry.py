@@ -0,0 +1,220 @@
+"""
+Registry for the serving model artifacts.
+
+Nothing is loaded at import time: the first call to get() (or an explicit
+warm-up) unpickles the model, which is also when joblib pulls in the
+sklearn/xgboost/catboost stack. Artifact paths default to the working
+directory and can be overridden with MODEL_PATH, SCALER_PATH,
+PREPROCESS_STATS_PATH and COMPILED_MODEL_PATH. The compiled model is only
+used if it was compiled from the current ensemble_model.sav. When a memory-mappable
+export (model_artifact, MODEL_ARTIFACT_PATH) of the current ensemble_model.sav
+exists it is served instead of the pickles, so worker processes share its
+pages. Batches above COMPILED_MAX_ROWS still go to the native libraries,
+which are several times faster on them: the pickled ensemble is loaded on the
+first such batch unless ARTIFACT_NATIVE_BATCHES=0. With CASCADE=1 the screening
+model and its thresholds (SCREEN_MODEL_PATH, CASCADE_THRESHOLDS_PATH) are
+loaded too, and are part of the model version.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+ARTIFACT_NATIVE_BATCHES = os.environ.get("ARTIFACT_NATIVE_BATCHES", "1") == "1"
+
+
+def file_digest(path):
+    """First 16 hex digits of the sha256 of a file's contents, or None if it does not exist."""
+    try:
+        with open(path, 'rb') as file:
+            return hashlib.file_digest(file, 'sha256').hexdigest()[:16]
+    except FileNotFoundError:
+        return None
+
+
+class ModelArtifacts:
+    def __init__(self, model, scaler, preprocess_stats, compiled, load_seconds, features=None, cascade=None,
+                 native_loader=None):
+        self.model = model
+        self.scaler = scaler
+        # Training-time medians and clip bounds (models trained before this file existed have none)
+        self.preprocess_stats = preprocess_stats
+        # Flat-array copy of the ensemble (tree_engine export), if one has been exported
+        self.compiled = compiled
+        self.load_seconds = load_seconds
+        # NumPy feature kernel with the frozen stats and scaler parameters
+        self.features = features
+        # Screening model + thresholds answering confident rows (cascade.Cascade), if enabled
+        self.cascade = cascade
+        # Loads the pickled ensemble for large batches when model is the exported one
+        self._native_loader = native_loader
+        self._native = None
+        self._native_lock = threading.Lock()
+
+    def batch_model(self):
+        """The model for batches too large for compiled: the native ensemble, loaded on first use."""
+        if self._native_loader is None:
+            return self.model
+        with self._native_lock:
+            if self._native is None and self._native_loader is not None:
+                try:
+                    self._native = self._native_loader()
+                except Exception as e:
+                    print(f"registry: serving large batches from the export, native model failed to load: {e}", flush=True)
+                    self._native_loader = None
+                    return self.model
+        return self._native
+
+
+class ModelRegistry:
+    def __init__(self, model_path, scaler_path, preprocess_stats_path, compiled_model_path,
+                 screen_model_path=None, cascade_thresholds_path=None, artifact_path=None):
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self.preprocess_stats_path = preprocess_stats_path
+        self.compiled_model_path = compiled_model_path
+        # Both None unless the cascade is enabled
+        self.screen_model_path = screen_model_path
+        self.cascade_thresholds_path = cascade_thresholds_path
+        self.artifact_path = artifact_path
+        self._artifacts = None
+        self._uses_artifact = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._artifacts is not None
+
+    def get(self):
+        """The loaded artifacts, loading them on first use."""
+        artifacts = self._artifacts
+        if artifacts is None:
+            with self._lock:
+                if self._artifacts is None:
+                    self._artifacts = self._load()
+                artifacts = self._artifacts
+        return artifacts
+
+    @property
+    def uses_artifact(self):
+        """Whether an export of the current ensemble_model.sav is served (decided once)."""
+        if self._uses_artifact is None:
+            self._uses_artifact = self._artifact_matches()
+        return self._uses_artifact
+
+    def _artifact_matches(self):
+        if not (self.artifact_path and os.path.exists(os.path.join(self.artifact_path, 'manifest.json'))):
+            return False
+        from .model_artifact import read_manifest
+        exported_from = read_manifest(self.artifact_path).get('source')
+        source = file_digest(self.model_path)
+        # An export shipped without the pickles has nothing to be compared with
+        if source is not None and exported_from != source:
+            print(f"registry: ignoring {self.artifact_path}, exported from model {exported_from}, "
+                  f"not the current {self.model_path} ({source}); re-run model_artifact export", flush=True)
+            return False
+        return True
+
+    @property
+    def version(self):
+        """
+        Content hash of the model, scaler and preprocess stats files (and the
+        cascade's, when enabled, since it changes the answers). Like the
+        model itself it is read once per process, so a replaced
+        ensemble_model.sav gets a new version when the server restarts. An
+        exported artifact carries its own version in its manifest. Computed
+        by the load, so async code should await ensure_version() (or the
+        load) rather than hash the files on the event loop.
+        """
+        if self._version is None:
+            self._version = self._compute_version()
+        return self._version
+
+    @property
+    def version_known(self):
+        return self._version is not None
+
+    def _compute_version(self):
+        digest = hashlib.sha256()
+        if self.uses_artifact:
+            from .model_artifact import read_manifest
+            digest.update(read_manifest(self.artifact_path)['version'].encode())
+            paths = (self.screen_model_path, self.cascade_thresholds_path)
+        else:
+            paths = (self.model_path, self.scaler_path, self.preprocess_stats_path,
+                     self.screen_model_path, self.cascade_thresholds_path)
+        for path in paths:
+            if path and os.path.exists(path):
+                with open(path, 'rb') as file:
+                    hashlib.file_digest(file, lambda: digest)
+        return digest.hexdigest()[:16]
+
+    async def ensure_version(self):
+        """The version, hashing the model files in a thread if nothing has yet."""
+        if self._version is None:
+            version = await asyncio.to_thread(self._compute_version)
+            if self._version is None:
+                self._version = version
+        return self._version
+
+    def load_pickles(self):
+        """(model, scaler, preprocess_stats) from the joblib files."""
+        import joblib
+
+        model = joblib.load(self.model_path)
+        scaler = joblib.load(self.scaler_path)
+        preprocess_stats = (
+            joblib.load(self.preprocess_stats_path) if os.path.exists(self.preprocess_stats_path) else None
+        )
+        return model, scaler, preprocess_stats
+
+    def _load(self):
+        start = time.perf_counter()
+        if self._version is None:
+            self._version = self._compute_version()
+        compiled = None
+        native_loader = None
+        if self.uses_artifact:
+            # The model is already the flat-array ensemble
+            from .model_artifact import load_artifact
+            model, scaler, preprocess_stats = load_artifact(self.artifact_path)
+            compiled = model
+            if ARTIFACT_NATIVE_BATCHES and os.path.exists(self.model_path):
+                # The flat arrays run at about a fifth of the libraries' speed on 2000 rows
+                def native_loader():
+                    import joblib
+                    return joblib.load(self.model_path)
+        else:
+            model, scaler, preprocess_stats = self.load_pickles()
+        if not self.uses_artifact and os.path.exists(self.compiled_model_path):
+            from .tree_engine import CompiledEnsemble
+            compiled = CompiledEnsemble.load(self.compiled_model_path)
+            source = file_digest(self.model_path)
+            if compiled.source != source:
+                # Stale (or unstamped) export: small batches would use other trees than large ones
+                print(f"registry: ignoring {self.compiled_model_path}, compiled from model {compiled.source}, "
+                      f"not the current {self.model_path} ({source}); re-run tree_engine export", flush=True)
+                compiled = None
+        cascade = None
+        if self.screen_model_path and os.path.exists(self.screen_model_path) and os.path.exists(self.cascade_thresholds_path):
+            from .cascade import Cascade
+            cascade = Cascade.load(self.screen_model_path, self.cascade_thresholds_path)
+        from .feature_kernel import FeatureKernel
+        features = FeatureKernel(preprocess_stats, scaler)
+        return ModelArtifacts(model, scaler, preprocess_stats, compiled, time.perf_counter() - start, features, cascade,
+                              native_loader)
+
+
+CASCADE = os.environ.get("CASCADE", "0") == "1"
+
+model_registry = ModelRegistry(
+    os.environ.get("MODEL_PATH", "ensemble_model.sav"),
+    os.environ.get("SCALER_PATH", "scaler.sav"),
+    os.environ.get("PREPROCESS_STATS_PATH", "preprocess_stats.sav"),
+    os.environ.get("COMPILED_MODEL_PATH", "compiled_model.npz"),
+    os.environ.get("SCREEN_MODEL_PATH", "screen_model.sav") if CASCADE else None,
+    os.environ.get("CASCADE_THRESHOLDS_PATH", "cascade_thresholds.json") if CASCADE else None,
+    os.environ.get("MODEL_ARTIFACT_PATH", "model_artifact"),
+)
@@ -0,0 +1,307 @@
+"""
+Hyperparameter search for the ensemble members (Hyperband / successive halving).
+
+Each bracket samples configurations from SEARCH_SPACES, trains them all with
+a small budget of trees / boosting iterations, keeps the best 1/eta by
+validation log loss and retrains those with eta times the budget, until the
+full budget is reached. XGBoost and CatBoost stop early on their validation
+mlogloss. Trials run in a process pool and are recorded in a SQLite trial
+store, so an interrupted search resumes where it stopped.
+
+The search never sees the pipeline's holdout: it splits the pipeline's
+training rows again into search-train (scaled + SMOTE) and search-val.
+
+    python search.py run --models xgb cat --configs 27   # search
+    python search.py export                              # write best_params.json for train.py
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from imblearn.over_sampling import SMOTE
+from sklearn.metrics import accuracy_score, log_loss
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+from model import BUDGET_PARAMS, MODEL_PARAMS_PATH, build_catboost, build_rf, build_xgb, set_threads
+from train import TRAINING_CORES, load_training_matrix
+
+TRIAL_STORE_PATH = os.environ.get("SEARCH_TRIAL_STORE", "search_trials.sqlite")
+
+BUILDERS = {'rf': build_rf, 'xgb': build_xgb, 'cat': build_catboost}
+
+# Per parameter: a list of choices, or (low, high) / (low, high, 'log') for a
+# uniform / log-uniform float, or (low, high, 'int') for an integer range
+SEARCH_SPACES = {
+    'rf': {
+        'max_depth': [8, 12, 18, 24, None],
+        'min_samples_split': (2, 10, 'int'),
+        'min_samples_leaf': (1, 6, 'int'),
+        'max_features': ['sqrt', 'log2', 0.5],
+    },
+    'xgb': {
+        'max_depth': (3, 10, 'int'),
+        'learning_rate': (0.02, 0.3, 'log'),
+        'subsample': (0.6, 1.0),
+        'colsample_bytree': (0.5, 1.0),
+        'gamma': (0.0, 1.0),
+        'reg_alpha': (1e-3, 1.0, 'log'),
+        'min_child_weight': (1, 8, 'int'),
+    },
+    'cat': {
+        'depth': (4, 10, 'int'),
+        'learning_rate': (0.02, 0.3, 'log'),
+        'l2_leaf_reg': (1.0, 10.0, 'log'),
+        'subsample': (0.6, 1.0),
+    },
+}
+
+# Largest budget (trees / iterations) a trial may use
+MAX_BUDGETS = {'rf': 500, 'xgb': 1000, 'cat': 1000}
+
+# Boosting rounds without improvement in validation mlogloss before stopping
+EARLY_STOPPING_ROUNDS = 30
+
+SCHEMA = """
+create table if not exists trials (
+    data_key text,
+    model text,
+    config_id text,
+    budget integer,
+    params text,
+    log_loss real,
+    accuracy real,
+    trees_used integer,
+    seconds real,
+    primary key (data_key, model, config_id, budget)
+)
+"""
+
+
+def sample_config(space, rng):
+    params = {}
+    for name, spec in space.items():
+        if isinstance(spec, list):
+            params[name] = spec[rng.integers(len(spec))]
+        elif len(spec) == 3 and spec[2] == 'int':
+            params[name] = int(rng.integers(spec[0], spec[1] + 1))
+        elif len(spec) == 3 and spec[2] == 'log':
+            params[name] = float(math.exp(rng.uniform(math.log(spec[0]), math.log(spec[1]))))
+        else:
+            params[name] = float(rng.uniform(spec[0], spec[1]))
+    return params
+
+
+def config_id(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+class TrialStore:
+    def __init__(self, path=TRIAL_STORE_PATH):
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(SCHEMA)
+
+    def get(self, data_key, model, cid, budget):
+        row = self._conn.execute(
+            "select log_loss from trials where data_key = ? and model = ? and config_id = ? and budget = ?",
+            (data_key, model, cid, budget),
+        ).fetchone()
+        return row[0] if row else None
+
+    def add(self, data_key, model, cid, budget, params, result):
+        with self._conn:
+            self._conn.execute(
+                "insert or replace into trials values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (data_key, model, cid, budget, json.dumps(params), result['log_loss'],
+                 result['accuracy'], result['trees_used'], result['seconds']),
+            )
+
+    def best(self, data_key, model):
+        """Best trial at the largest budget that was reached, as (params, trees_used, log_loss)."""
+        row = self._conn.execute(
+            "select params, trees_used, log_loss from trials where data_key = ? and model = ? "
+            "order by budget desc, log_loss asc limit 1",
+            (data_key, model),
+        ).fetchone()
+        return (json.loads(row[0]), row[1], row[2]) if row else None
+
+    def close(self):
+        self._conn.close()
+
+
+# Search data, set once per worker process by the pool initializer
+_data = None
+
+
+def _init_worker(data):
+    global _data
+    _data = data
+
+
+def run_trial(model, params, budget, threads):
+    """Train one configuration with the given budget and score it on search-val."""
+    X_fit, y_fit, X_val, y_val = _data
+    started = time.perf_counter()
+    fit_params = {}
+    overrides = dict(params, **{BUDGET_PARAMS[model]: budget})
+    if model == 'xgb':
+        overrides['early_stopping_rounds'] = EARLY_STOPPING_ROUNDS
+        fit_params = {'eval_set': [(X_val, y_val)], 'verbose': False}
+    elif model == 'cat':
+        overrides['early_stopping_rounds'] = EARLY_STOPPING_ROUNDS
+        fit_params = {'eval_set': (X_val, y_val)}
+    estimator = BUILDERS[model](**overrides)
+    set_threads(model, estimator, threads)
+    estimator.fit(X_fit, y_fit, **fit_params)
+
+    if model == 'xgb':
+        trees_used = estimator.best_iteration + 1
+    elif model == 'cat':
+        trees_used = estimator.get_best_iteration() + 1
+    else:
+        trees_used = budget
+    proba = estimator.predict_proba(X_val)
+    return {
+        'log_loss': float(log_loss(y_val, proba, labels=estimator.classes_)),
+        'accuracy': float(accuracy_score(y_val, estimator.classes_[proba.argmax(axis=1)])),
+        'trees_used': int(trees_used),
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def search_data_key(X):
+    """Trials are only comparable on the same data, so the store keys them by its hash."""
+    return hashlib.sha256(np.ascontiguousarray(X.to_numpy()).tobytes()).hexdigest()[:16]
+
+
+def load_search_data():
+    """(data_key, (X_fit, y_fit, X_val, y_val)) carved from the pipeline's training rows."""
+    X, y, _ = load_training_matrix()
+    X_train, _, y_train, _ = train_test_split(X, y, test_size=0.2, stratify=y, random_state=42)
+    X_fit, X_val, y_fit, y_val = train_test_split(
+        X_train, y_train, test_size=0.2, stratify=y_train, random_state=0
+    )
+    scaler = StandardScaler().fit(X_fit)
+    X_fit, y_fit = SMOTE(random_state=42).fit_resample(scaler.transform(X_fit), y_fit)
+    return search_data_key(X), (X_fit, np.asarray(y_fit), scaler.transform(X_val), np.asarray(y_val))
+
+
+def hyperband_brackets(max_budget, min_budget, eta, configs):
+    """
+    (configs, starting budget) per bracket, from the most aggressive (many
+    configurations, small budget) down to plain full-budget training.
+    """
+    s_max = max(0, int(math.log(max_budget / min_budget, eta)))
+    brackets = []
+    for s in range(s_max, -1, -1):
+        n = max(1, int(math.ceil(configs * (s_max + 1) / (s + 1) * eta ** s / eta ** s_max)))
+        brackets.append((n, max(min_budget, int(max_budget * eta ** -s))))
+    return brackets
+
+
+def search(models, configs=27, eta=3, min_budget=None, brackets=1, workers=None, store_path=TRIAL_STORE_PATH, seed=0):
+    """
+    Run successive halving (brackets=1) or Hyperband (brackets>1: the
+    first `brackets` Hyperband brackets) for each model. Returns the best
+    (params, trees_used, log_loss) per model.
+    """
+    data_key, data = load_search_data()
+    store = TrialStore(store_path)
+    workers = max(1, min(workers or TRAINING_CORES, TRAINING_CORES))
+    threads = max(1, TRAINING_CORES // workers)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,)) as pool:
+            for model in models:
+                max_budget = MAX_BUDGETS[model]
+                # Seeded per model, so a resumed search draws the same configurations
+                rng = np.random.default_rng([seed, list(BUILDERS).index(model)])
+                for n, budget in hyperband_brackets(max_budget, min_budget or max(10, max_budget // 27), eta, configs)[:brackets]:
+                    survivors = [sample_config(SEARCH_SPACES[model], rng) for _ in range(n)]
+                    while survivors:
+                        budget = min(budget, max_budget)
+                        scores = {}
+                        futures = {}
+                        for params in survivors:
+                            cid = config_id(params)
+                            cached = store.get(data_key, model, cid, budget)
+                            if cached is not None:
+                                scores[cid] = cached
+                            else:
+                                futures[pool.submit(run_trial, model, params, budget, threads)] = params
+                        for future in as_completed(futures):
+                            params = futures[future]
+                            result = future.result()
+                            store.add(data_key, model, config_id(params), budget, params, result)
+                            scores[config_id(params)] = result['log_loss']
+                            print(f"{model} budget={budget} log_loss={result['log_loss']:.4f} "
+                                  f"acc={result['accuracy']:.4f} trees={result['trees_used']} {params}", flush=True)
+
+                        if budget >= max_budget:
+                            break
+                        survivors.sort(key=lambda params: scores[config_id(params)])
+                        survivors = survivors[:max(1, len(survivors) // eta)]
+                        budget *= eta
+        return {model: store.best(data_key, model) for model in models}
+    finally:
+        store.close()
+
+
+def export_best(models, store_path=TRIAL_STORE_PATH, out=MODEL_PARAMS_PATH):
+    """
+    Write the best configuration per model to out (best_params.json), which
+    train.py passes to the build_* functions. The budget becomes the number
+    of trees early stopping settled on.
+    """
+    data_key = search_data_key(load_training_matrix()[0])
+    store = TrialStore(store_path)
+    try:
+        exported = {}
+        for model in models:
+            best = store.best(data_key, model)
+            if best is None:
+                continue
+            params, trees_used, _ = best
+            exported[model] = dict(params, **{BUDGET_PARAMS[model]: trees_used})
+    finally:
+        store.close()
+    with open(out, 'w') as file:
+        json.dump(exported, file, indent=2)
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hyperparameter search for the ensemble members")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help="run (or resume) a search")
+    run.add_argument('--models', nargs='+', choices=list(BUILDERS), default=list(BUILDERS))
+    run.add_argument('--configs', type=int, default=27, help="configurations in the largest bracket")
+    run.add_argument('--eta', type=int, default=3, help="keep the best 1/eta at each rung")
+    run.add_argument('--min-budget', type=int, help="trees/iterations at the first rung")
+    run.add_argument('--brackets', type=int, default=1, help="Hyperband brackets (1 = successive halving)")
+    run.add_argument('--workers', type=int, help="trial processes (default: TRAINING_CORES)")
+    run.add_argument('--seed', type=int, default=0)
+    export = subparsers.add_parser('export', help="write the best configurations for train.py")
+    export.add_argument('--models', nargs='+', choices=list(BUILDERS), default=list(BUILDERS))
+    export.add_argument('--out', default=MODEL_PARAMS_PATH)
+    for sub in (run, export):
+        sub.add_argument('--store', default=TRIAL_STORE_PATH, help="trial store path")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        best = search(args.models, args.configs, args.eta, args.min_budget, args.brackets,
+                      args.workers, args.store, args.seed)
+        for model, result in best.items():
+            print(f"best {model}: {result}")
+    else:
+        print(json.dumps(export_best(args.models, args.store, args.out), indent=2))
+
+
+if __name__ == "__main__":
+    main()
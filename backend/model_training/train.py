@@ -1,15 +1,53 @@
+import hashlib
+import inspect
+import json
+import os
+import time
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
-from model import build_catboost, build_rf, build_xgb, build_ensemble
-from data_loader import load_koi_data
-from feature_engineering import add_physics_features, preprocess_features
-from sklearn.model_selection import train_test_split, cross_val_score
+import feature_engineering
+from model import build_catboost, build_rf, build_xgb, build_ensemble, build_screen, set_threads, load_model_params
+from cascade import choose_thresholds, save_thresholds
+from data_loader import load_koi_data, SNAPSHOT_DIR
+from feature_engineering import add_physics_features, preprocess_features, fit_preprocess_stats, apply_preprocess_stats
+from incremental import save_training_state, TRAINING_STATE_PATH
+from sklearn.model_selection import train_test_split, StratifiedKFold
+from joblib import Parallel, delayed
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from imblearn.over_sampling import SMOTE
 import joblib
 from sklearn.metrics import accuracy_score, classification_report, roc_auc_score
 from sklearn.impute import SimpleImputer
 
+MODEL_COLUMNS = ['koi_period', 'koi_time0bk', 'koi_duration', 'koi_depth', 'koi_prad', 'koi_impact',
+    'koi_model_snr', 'koi_score',
+    'koi_pdisposition_bin',
+    # 'koi_fpflag_nt', 'koi_fpflag_ss', 'koi_fpflag_co', 'koi_fpflag_ec',
+    'koi_steff', 'koi_srad', 'koi_slogg'    
+    ]
+
+# Cores shared by everything that trains in parallel; nested n_jobs=-1
+# estimators would otherwise each try to use every core
+TRAINING_CORES = int(os.environ.get("TRAINING_CORES", str(os.cpu_count() or 1)))
+CV_FOLDS = 5
+
+MEMBER_BUILDERS = {'rf': build_rf, 'xgb': build_xgb, 'cat': build_catboost}
+
+def build_member(name):
+        """Build an ensemble member with any tuned parameters from best_params.json."""
+        return MEMBER_BUILDERS[name](**load_model_params().get(name, {}))
+
+# Wall-clock seconds per pipeline stage
+stage_timings = {}
+
+@contextmanager
+def timed_stage(name):
+        started = time.perf_counter()
+        yield
+        stage_timings[name] = time.perf_counter() - started
+        print(f"⏱️  {name}: {stage_timings[name]:.2f}s")
+
 def evaluate_models(model,X_test, y_test):
         """
         Comprehensive evaluation using competition metrics
@@ -48,29 +86,76 @@ def evaluate_models(model,X_test, y_test):
         
         return pd.DataFrame(results)
     
-def cross_validation_analysis(ensemble,X_train, y_train):
+def fit_member(name, X, y, threads):
+        """Fit one ensemble member with a fixed number of threads (a joblib task)."""
+        estimator = build_member(name)
+        previous = set_threads(name, estimator, threads)
+        estimator.fit(X, y)
+        set_threads(name, estimator, previous)
+        return estimator
+
+def balance_fold(X_train, y_train, train_index):
+        """Scale and SMOTE one fold's training rows, leaving its test rows untouched."""
+        scaler = StandardScaler().fit(X_train.iloc[train_index])
+        X_bal, y_bal = SMOTE(random_state=42).fit_resample(
+            scaler.transform(X_train.iloc[train_index]), y_train.iloc[train_index]
+        )
+        return scaler, X_bal, y_bal
+
+def cross_validation_analysis(X_train, y_train, cores=TRAINING_CORES):
         """
-        5-fold cross-validation for robust performance estimation
+        5-fold cross-validation for robust performance estimation.
+
+        Folds are drawn from the real (unbalanced) training rows and SMOTE is
+        applied inside each fold, so no synthetic samples leak into a test
+        fold. Every member of every fold is fit once, all as independent
+        tasks sharing the core budget; a fold's prediction is the soft vote
+        of its three members, as in the VotingClassifier.
         """
         print("\n🔄 Cross-Validation Analysis:")
-        
+
         cv_results = {}
-        
-       
-            
-        scores = cross_val_score(ensemble, X_train, y_train, cv=5, scoring='accuracy')
+        folds = list(StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=42).split(X_train, y_train))
+        balanced = [balance_fold(X_train, y_train, train_index) for train_index, _ in folds]
+
+        tasks = [(fold, name) for fold in range(len(folds)) for name in MEMBER_BUILDERS]
+        workers = max(1, min(len(tasks), cores))
+        fitted = Parallel(n_jobs=workers)(
+            delayed(fit_member)(name, balanced[fold][1], balanced[fold][2], max(1, cores // workers))
+            for fold, name in tasks
+        )
+
+        scores = []
+        for fold, (_, test_index) in enumerate(folds):
+            scaler = balanced[fold][0]
+            X_test = scaler.transform(X_train.iloc[test_index])
+            members = [model for (task_fold, _), model in zip(tasks, fitted) if task_fold == fold]
+            proba = np.mean([model.predict_proba(X_test) for model in members], axis=0)
+            y_pred = members[0].classes_[proba.argmax(axis=1)]
+            scores.append(accuracy_score(y_train.iloc[test_index], y_pred))
+        scores = np.array(scores)
         cv_results['ensemble'] = scores
             
         print(f"{'ensemble'}: {scores.mean():.4f} ± {scores.std():.4f}")
         
         return cv_results
-def run_complete_pipeline():
-        """Runs the complete pipeline from data loading to model training and saving."""
-        print("🚀 Starting the Model Training Pipeline...")
-        df = load_koi_data()
-        df = preprocess_features(df)
-        target = 'koi_disposition_encoded'
-        features = [col for col in df.columns if col != target]
+
+TARGET = 'koi_disposition_encoded'
+
+def build_training_matrix(df, preprocess_stats=None):
+        """
+        Engineer the model features and labels from the raw cumulative table.
+        Returns (X, y, preprocess_stats). Given preprocess_stats, rows are
+        filled and clipped with those frozen statistics instead of ones fit
+        on df, as an already trained model expects (incremental training).
+        """
+        if preprocess_stats is None:
+            # Freeze the fill/clip statistics so inference can replay them row by row
+            preprocess_stats = fit_preprocess_stats(df[[col for col in MODEL_COLUMNS if col in df.columns]])
+            df = preprocess_features(df)
+        else:
+            df = apply_preprocess_stats(df, preprocess_stats)
+        target = TARGET
         encode_map = {
             "FALSE POSITIVE": 0,
             "CANDIDATE": 1,
@@ -83,50 +168,110 @@ def run_complete_pipeline():
         })
 
         df["koi_disposition_encoded"] = df["koi_disposition"].map(encode_map)
-        imp_columns = ['koi_period', 'koi_time0bk', 'koi_duration', 'koi_depth', 'koi_prad', 'koi_impact',
-            'koi_model_snr', 'koi_score',
-            'koi_pdisposition_bin',
-            # 'koi_fpflag_nt', 'koi_fpflag_ss', 'koi_fpflag_co', 'koi_fpflag_ec',
-            'koi_steff', 'koi_srad', 'koi_slogg'    
-            ]
-        X = df[imp_columns]
+        X = df[MODEL_COLUMNS]
 
         X= add_physics_features(X)
         y = df[target]
         score_imputer = SimpleImputer(strategy='median')
         X['koi_score'] = score_imputer.fit_transform(X[['koi_score']])
-       
-        print("🔧 Preprocessing Data...")
-        
+        return X, y, preprocess_stats
 
+def feature_snapshot_key(raw_snapshot):
+        """
+        Content hash of everything the feature matrix depends on: the raw
+        data, the model columns and the feature code.
+        """
+        digest = hashlib.sha256(raw_snapshot.encode())
+        digest.update(json.dumps(MODEL_COLUMNS).encode())
+        digest.update(inspect.getsource(feature_engineering).encode())
+        digest.update(inspect.getsource(build_training_matrix).encode())
+        return digest.hexdigest()[:16]
+
+def load_training_matrix(snapshot_dir=SNAPSHOT_DIR):
+        """
+        build_training_matrix(load_koi_data()), with the result saved as
+        memory-mapped .npy files keyed by feature_snapshot_key, so an
+        unchanged dataset and feature code are not reprocessed.
+        """
+        df = load_koi_data(snapshot_dir=snapshot_dir)
+        path = os.path.join(snapshot_dir, f"features-{feature_snapshot_key(df.attrs['snapshot'])}")
+        if os.path.exists(path):
+            with open(os.path.join(path, 'meta.json')) as file:
+                meta = json.load(file)
+            X = pd.DataFrame(np.load(os.path.join(path, 'X.npy'), mmap_mode='r'), columns=meta['columns'])
+            y = pd.Series(np.load(os.path.join(path, 'y.npy'), mmap_mode='r'), name=TARGET)
+            preprocess_stats = {col: tuple(stat) for col, stat in meta['preprocess_stats'].items()}
+            print(f"📦 Loaded feature snapshot {path}")
+            return X, y, preprocess_stats
 
-        X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, stratify=y, random_state=42)
-        scaler = StandardScaler().fit(X_train)
-        X_train_scaled = scaler.transform(X_train)
-        X_val_scaled = scaler.transform(X_val)
+        X, y, preprocess_stats = build_training_matrix(df)
+        os.makedirs(path + ".tmp", exist_ok=True)
+        np.save(os.path.join(path + ".tmp", 'X.npy'), X.to_numpy(dtype=np.float64))
+        np.save(os.path.join(path + ".tmp", 'y.npy'), y.to_numpy())
+        with open(os.path.join(path + ".tmp", 'meta.json'), 'w') as file:
+            json.dump({'columns': list(X.columns), 'preprocess_stats': preprocess_stats}, file)
+        os.replace(path + ".tmp", path)
+        return X, y, preprocess_stats
 
+def fit_ensemble(X_train_bal, y_train_bal, cores=TRAINING_CORES):
+        """Fit the soft-voting ensemble; the VotingClassifier fits a clone of each member, three at a time."""
+        workers = min(3, cores)
+        threads = max(1, cores // workers)
+        members = {name: build_member(name) for name in MEMBER_BUILDERS}
+        previous = {name: set_threads(name, member, threads) for name, member in members.items()}
+        ensemble = build_ensemble(members['rf'], members['xgb'], members['cat'], n_jobs=workers)
+        ensemble.fit(X_train_bal, y_train_bal)
+        # Serve with the members' own thread settings
+        for name in MEMBER_BUILDERS:
+            set_threads(name, members[name], previous[name])
+            set_threads(name, ensemble.named_estimators_[name], previous[name])
+        ensemble.set_params(n_jobs=None)
+        return ensemble
 
-        sm = SMOTE(random_state=42)
-        X_train_bal, y_train_bal = sm.fit_resample(X_train_scaled, y_train)
+def run_complete_pipeline():
+        """Runs the complete pipeline from data loading to model training and saving."""
+        print("🚀 Starting the Model Training Pipeline...")
+        stage_timings.clear()
+        with timed_stage("load data"):
+            X, y, preprocess_stats = load_training_matrix()
+       
+        print("🔧 Preprocessing Data...")
+        
+        with timed_stage("preprocess"):
+            X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, stratify=y, random_state=42)
+            scaler = StandardScaler().fit(X_train)
+            X_train_scaled = scaler.transform(X_train)
+            X_val_scaled = scaler.transform(X_val)
 
+            sm = SMOTE(random_state=42)
+            X_train_bal, y_train_bal = sm.fit_resample(X_train_scaled, y_train)
 
-        rf = build_rf()
-        xgb_model = build_xgb()
-        cat_model = build_catboost()
-        rf.fit(X_train_bal, y_train_bal)
-        xgb_model.fit(X_train_bal, y_train_bal)
+        with timed_stage("fit ensemble"):
+            ensemble = fit_ensemble(X_train_bal, y_train_bal)
 
-        ensemble = build_ensemble(rf, xgb_model,cat_model)
-        ensemble.fit(X_train_bal, y_train_bal)
+        # First stage of the inference cascade (served with CASCADE=1)
+        with timed_stage("fit screening model"):
+            screen = build_screen()
+            screen.fit(X_train_bal, y_train_bal)
+            cascade = choose_thresholds(screen.predict_proba(X_val_scaled), ensemble.predict_proba(X_val_scaled),
+                                        y_val, ensemble.classes_)
+            print(f"Cascade: thresholds {cascade['thresholds']}, screen answers {cascade['screen_hit_rate']:.1%} "
+                  f"of validation rows, accuracy {cascade['cascade_accuracy']:.4f} vs {cascade['full_accuracy']:.4f}")
 
         print("💾 Saving Models...")
         joblib.dump(ensemble, 'ensemble_model.sav')
         joblib.dump(scaler, 'scaler.sav')
+        joblib.dump(preprocess_stats, 'preprocess_stats.sav')
+        joblib.dump(screen, 'screen_model.sav')
+        save_thresholds(cascade, 'cascade_thresholds.json')
+        # What incremental.py needs to find new and changed rows next time
+        save_training_state(load_koi_data(), X_val.index, TRAINING_STATE_PATH)
 
-        results_df = evaluate_models(ensemble,X_val_scaled, y_val)
+        with timed_stage("evaluate"):
+            results_df = evaluate_models(ensemble,X_val_scaled, y_val)
         
-       
-        cv_results = cross_validation_analysis(ensemble,X_train_bal, y_train_bal)
+        with timed_stage("cross-validate"):
+            cv_results = cross_validation_analysis(X_train, y_train)
         
         print(f"\n🎉 PIPELINE COMPLETED!")
         print("=" * 30)
@@ -139,6 +284,7 @@ def run_complete_pipeline():
             'cv_results': cv_results
         })
 
+        print("Stage timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stage_timings.items()))
         print("Training complete and models saved.")
 
 
@@ -0,0 +1,373 @@
+"""
+Flat, array-based inference engine for the soft-voting ensemble.
+
+compile_ensemble() flattens the RandomForest, XGBoost and CatBoost members of
+the VotingClassifier built by build_ensemble into contiguous NumPy node arrays.
+CompiledEnsemble.predict_proba then walks every tree for a whole batch at once
+and averages the three class-probability matrices the way soft voting does.
+
+    python -m model_training.tree_engine export   # write compiled_model.npz
+    python -m model_training.tree_engine check    # parity + speedup report; exits 1 past PARITY_TOLERANCE
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+COMPILED_MODEL_PATH = os.environ.get("COMPILED_MODEL_PATH", "compiled_model.npz")
+# Largest difference to VotingClassifier.predict_proba that `check` accepts
+PARITY_TOLERANCE = 1e-6
+
+# Rows evaluated together; bounds the (rows x trees x classes) temporaries
+ROW_BLOCK = 1024
+
+
+class TreeArrays:
+    """
+    Binary trees concatenated into one node table. children holds the
+    (left, right) pair of node i at 2*i and 2*i + 1; x goes right when
+    x > threshold, and NaN goes left when default_left is set. Leaves point
+    at themselves, so every row can take the same number of steps.
+
+    Leaves hold either a class-probability vector (value is n_nodes x
+    n_classes) or, when leaf_class is given, one margin for the class
+    that tree belongs to (value is n_nodes x 1).
+    """
+
+    def __init__(self, roots, feature, threshold, children, default_left, value, leaf_class, depth):
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.default_left = default_left
+        self.value = value
+        self.leaf_class = leaf_class
+        self.depth = depth
+        if len(leaf_class):
+            self._projection = np.eye(int(leaf_class.max()) + 1)[leaf_class]
+
+    def leaves(self, X):
+        """Leaf node reached in every tree, shape (rows, trees)."""
+        n, n_features = X.shape
+        flat = X.ravel()
+        offsets = (np.arange(n, dtype=np.int32) * n_features)[:, None]
+        nodes = np.broadcast_to(self.roots, (n, len(self.roots))).copy()
+        has_nan = np.isnan(X).any()
+        for _ in range(self.depth):
+            x = flat[offsets + self.feature[nodes]]
+            threshold = self.threshold[nodes]
+            if has_nan:
+                go_right = np.where(self.default_left[nodes], x > threshold, ~(x <= threshold))
+            else:
+                go_right = x > threshold
+            nodes = self.children[2 * nodes + go_right]
+        return nodes
+
+    def leaf_sum(self, X):
+        nodes = self.leaves(X)
+        if len(self.leaf_class):
+            return self.value[nodes, 0] @ self._projection
+        return self.value[nodes].sum(axis=1)
+
+
+class ObliviousArrays:
+    """
+    CatBoost symmetric trees: one (feature, border) pair per level, so the
+    leaf index is the bit pattern of x > border. Shallower trees are padded
+    with levels that never fire.
+    """
+
+    def __init__(self, feature, border, nan_true, value):
+        self.feature = feature
+        self.border = border
+        self.nan_true = nan_true
+        self.value = value
+        self._weights = 1 << np.arange(feature.shape[1], dtype=np.int64)
+
+    def leaf_sum(self, X):
+        x = X[:, self.feature]
+        bits = np.where(np.isnan(x), self.nan_true, x > self.border)
+        leaves = bits.astype(np.int64) @ self._weights
+        return self.value[np.arange(self.value.shape[0]), leaves].sum(axis=1)
+
+
+def _softmax(margin):
+    margin = margin - margin.max(axis=1, keepdims=True)
+    exp = np.exp(margin)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class CompiledEnsemble:
+    ARRAYS = {
+        'rf': ('roots', 'feature', 'threshold', 'children', 'default_left', 'value', 'leaf_class'),
+        'xgb': ('roots', 'feature', 'threshold', 'children', 'default_left', 'value', 'leaf_class'),
+        'cat': ('feature', 'border', 'nan_true', 'value'),
+    }
+
+    def __init__(self, classes, rf, xgb, cat, xgb_base_margin, cat_scale, cat_bias, source=None):
+        self.classes_ = classes
+        self.rf = rf
+        self.xgb = xgb
+        self.cat = cat
+        self.xgb_base_margin = xgb_base_margin
+        self.cat_scale = cat_scale
+        self.cat_bias = cat_bias
+        # registry.file_digest of the pickled ensemble this was compiled from, if recorded
+        self.source = source
+
+    def predict_proba(self, X):
+        # All three libraries compare float32 feature values
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if not len(X):
+            return np.empty((0, len(self.classes_)))
+        return np.concatenate([self._predict_block(X[i:i + ROW_BLOCK]) for i in range(0, len(X), ROW_BLOCK)])
+
+    def _predict_block(self, X):
+        rf = self.rf.leaf_sum(X)
+        rf /= len(self.rf.roots)
+        xgb = _softmax(self.xgb.leaf_sum(X) + self.xgb_base_margin)
+        cat = _softmax(self.cat_scale * self.cat.leaf_sum(X) + self.cat_bias)
+        return (rf + xgb + cat) / 3
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def to_arrays(self):
+        """Every array the ensemble is made of, by name (the layout save() and model_artifact use)."""
+        arrays = {
+            'classes': self.classes_,
+            'xgb_base_margin': self.xgb_base_margin,
+            'cat_scale': np.float64(self.cat_scale),
+            'cat_bias': self.cat_bias,
+            'depths': np.array([self.rf.depth, self.xgb.depth]),
+        }
+        for name, fields in self.ARRAYS.items():
+            for field in fields:
+                arrays[f'{name}_{field}'] = getattr(getattr(self, name), field)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, data):
+        """Inverse of to_arrays; the node arrays are used as given (e.g. memory-mapped)."""
+        parts = {
+            name: {field: data[f'{name}_{field}'] for field in fields}
+            for name, fields in cls.ARRAYS.items()
+        }
+        rf_depth, xgb_depth = data['depths']
+        return cls(
+            np.asarray(data['classes']),
+            TreeArrays(**parts['rf'], depth=int(rf_depth)),
+            TreeArrays(**parts['xgb'], depth=int(xgb_depth)),
+            ObliviousArrays(**parts['cat']),
+            np.asarray(data['xgb_base_margin']),
+            float(data['cat_scale']),
+            np.asarray(data['cat_bias']),
+        )
+
+    def save(self, path, source=None):
+        """source: file_digest of the pickled ensemble, checked by the registry before serving."""
+        arrays = self.to_arrays()
+        if source is not None:
+            arrays['source'] = np.array(source)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            compiled = cls.from_arrays(data)
+            compiled.source = str(data['source']) if 'source' in data.files else None
+        return compiled
+
+
+def _concat_trees(trees, leaf_class=None):
+    """
+    trees: (feature, threshold, left, right, default_left, value) per tree,
+    with tree-local child ids (-1 for leaves) and float64 thresholds meaning
+    "x <= threshold goes left". Returns a TreeArrays.
+    """
+    roots, parts, offset, depth = [], [], 0, 0
+    for feature, threshold, left, right, default_left, value in trees:
+        n = len(feature)
+        ids = np.arange(n) + offset
+        leaf = left < 0
+        roots.append(offset)
+        parts.append((
+            np.where(leaf, 0, feature),
+            np.where(leaf, 0.0, threshold),
+            np.stack([np.where(leaf, ids, left + offset), np.where(leaf, ids, right + offset)], axis=1).ravel(),
+            np.where(leaf, True, default_left),
+            np.where(leaf[:, None], value, 0.0),
+        ))
+        depth = max(depth, _tree_depth(left, right))
+        offset += n
+
+    feature, threshold, children, default_left, value = (np.concatenate(p) for p in zip(*parts))
+    return TreeArrays(
+        np.array(roots, dtype=np.int32), feature.astype(np.int32), _float32_floor(threshold),
+        children.astype(np.int32), default_left.astype(bool), value.astype(np.float64),
+        np.asarray(leaf_class if leaf_class is not None else [], dtype=np.int64), depth,
+    )
+
+
+def _float32_floor(threshold):
+    """Largest float32 <= threshold, so float32 x <= t is decided exactly in float32."""
+    rounded = threshold.astype(np.float32)
+    return np.where(rounded.astype(np.float64) > threshold, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+
+
+def _tree_depth(left, right):
+    depth, level = 0, [0]
+    while True:
+        level = [child for node in level if left[node] >= 0 for child in (left[node], right[node])]
+        if not level:
+            return depth
+        depth += 1
+
+
+def _compile_rf(rf, n_classes):
+    trees = []
+    for estimator in rf.estimators_:
+        tree = estimator.tree_
+        value = tree.value[:, 0, :]
+        value = value / value.sum(axis=1, keepdims=True)
+        if hasattr(tree, 'missing_go_to_left'):
+            default_left = tree.missing_go_to_left.astype(bool)
+        else:
+            # Older sklearn: NaN follows the child that saw more samples
+            samples = tree.n_node_samples
+            default_left = samples[np.maximum(tree.children_left, 0)] >= samples[np.maximum(tree.children_right, 0)]
+        trees.append((tree.feature, tree.threshold, tree.children_left, tree.children_right, default_left, value))
+    return _concat_trees(trees)
+
+
+def _compile_xgb(xgb_model, n_classes):
+    booster = xgb_model.get_booster()
+    model = json.loads(booster.save_raw(raw_format='json'))['learner']['gradient_booster']['model']
+
+    trees = []
+    for tree, group in zip(model['trees'], model['tree_info']):
+        left = np.array(tree['left_children'], dtype=np.int64)
+        conditions = np.array(tree['split_conditions'], dtype=np.float32)
+        # XGBoost sends x < t left; for float32 x that is x <= the float32 just below t
+        threshold = np.nextafter(conditions, np.float32(-np.inf)).astype(np.float64)
+        trees.append((
+            np.array(tree['split_indices'], dtype=np.int64), threshold, left,
+            np.array(tree['right_children'], dtype=np.int64),
+            np.array(tree['default_left'], dtype=bool), conditions.astype(np.float64)[:, None],
+        ))
+    compiled = _concat_trees(trees, leaf_class=model['tree_info'])
+
+    # Recover the intercept from XGBoost itself rather than parsing base_score
+    import xgboost
+    probe = np.zeros((1, booster.num_features()), dtype=np.float32)
+    margin = booster.predict(xgboost.DMatrix(probe), output_margin=True).reshape(1, -1)
+    base_margin = margin[0].astype(np.float64) - compiled.leaf_sum(probe)[0]
+    return compiled, base_margin
+
+
+def _compile_catboost(cat_model, n_classes):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'catboost.json')
+        cat_model.save_model(path, format='json')
+        with open(path, 'r') as file:
+            model = json.load(file)
+
+    float_features = {f['feature_index']: f for f in model['features_info']['float_features']}
+    trees = model['oblivious_trees']
+    depth = max(len(tree['splits']) for tree in trees)
+
+    feature = np.zeros((len(trees), depth), dtype=np.int64)
+    border = np.full((len(trees), depth), np.inf, dtype=np.float32)
+    nan_true = np.zeros((len(trees), depth), dtype=bool)
+    value = np.zeros((len(trees), 1 << depth, n_classes))
+    for t, tree in enumerate(trees):
+        for level, split in enumerate(tree['splits']):
+            if split['split_type'] != 'FloatFeature':
+                raise ValueError(f"Unsupported CatBoost split type {split['split_type']}")
+            index = split['float_feature_index']
+            feature[t, level] = index
+            border[t, level] = np.float32(split['border'])
+            nan_true[t, level] = float_features[index]['nan_value_treatment'] == 'AsTrue'
+        leaves = np.array(tree['leaf_values'], dtype=np.float64).reshape(-1, n_classes)
+        value[t, :len(leaves)] = leaves
+
+    scale, bias = model['scale_and_bias']
+    bias = np.asarray(bias, dtype=np.float64)
+    return ObliviousArrays(feature, border, nan_true, value), float(scale), np.broadcast_to(bias, (n_classes,)).copy()
+
+
+def compile_ensemble(model):
+    """Flatten a fitted build_ensemble() VotingClassifier into a CompiledEnsemble."""
+    if model.voting != 'soft' or model.weights is not None:
+        raise ValueError("Only unweighted soft voting is supported")
+
+    members = model.named_estimators_
+    n_classes = len(model.classes_)
+    xgb_trees, xgb_base_margin = _compile_xgb(members['xgb'], n_classes)
+    cat_trees, cat_scale, cat_bias = _compile_catboost(members['cat'], n_classes)
+    return CompiledEnsemble(
+        model.classes_, _compile_rf(members['rf'], n_classes), xgb_trees, cat_trees,
+        xgb_base_margin, cat_scale, cat_bias,
+    )
+
+
+def _time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def parity_report(model, compiled, X):
+    """Max abs difference to model.predict_proba and timings for 1 and len(X) rows."""
+    expected = model.predict_proba(X)
+    actual = compiled.predict_proba(X)
+    report = {
+        'rows': len(X),
+        'max_abs_diff': float(np.abs(expected - actual).max()),
+        'label_agreement': float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean()),
+    }
+    for label, rows, repeat in (('single_row', X[:1], 20), (f'{len(X)}_rows', X, 3)):
+        sklearn_s = _time(lambda: model.predict_proba(rows), repeat)
+        compiled_s = _time(lambda: compiled.predict_proba(rows), repeat)
+        report[label] = {
+            'voting_classifier_ms': round(sklearn_s * 1000, 3),
+            'compiled_ms': round(compiled_s * 1000, 3),
+            'speedup': round(sklearn_s / compiled_s, 2),
+        }
+    return report
+
+
+def main():
+    from .registry import model_registry, file_digest
+
+    parser = argparse.ArgumentParser(description="Compile the ensemble into flat tree arrays")
+    parser.add_argument('command', choices=['export', 'check'])
+    parser.add_argument('--path', default=COMPILED_MODEL_PATH)
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    # Always the pickled VotingClassifier, even when a model_artifact export is being served
+    model, scaler, _ = model_registry.load_pickles()
+    if args.command == 'export':
+        compile_ensemble(model).save(args.path, source=file_digest(model_registry.model_path))
+        print(f"Wrote compiled ensemble to {args.path}")
+    else:
+        compiled = compile_ensemble(model)
+        # Scaled-feature space rows around the training distribution, with some NaNs
+        rng = np.random.default_rng(0)
+        X = rng.normal(0, 1.5, (args.rows, scaler.n_features_in_))
+        X[rng.random(X.shape) < 0.01] = np.nan
+        report = parity_report(model, compiled, X)
+        print(json.dumps(report, indent=2))
+        if report['max_abs_diff'] > PARITY_TOLERANCE:
+            raise SystemExit(f"Compiled probabilities differ by {report['max_abs_diff']:.3g} (> {PARITY_TOLERANCE})")
+
+
+if __name__ == "__main__":
+    main()
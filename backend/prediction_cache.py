@@ -0,0 +1,192 @@
+"""
+Content-addressed cache of model predictions.
+
+Entries are keyed by a hash of the canonical model input (the MODEL_COLUMNS
+values as float64, in column order, with every NaN and -0.0 normalized) plus
+the model version, so identical KOIs - including CSV rows that only differ
+in columns the model ignores - are scored once per model. Recently used
+entries are kept in memory (LRU); with a path, entries are also written to a
+SQLite file that survives restarts and is shared by all workers. A new model
+version empties the memory tier, and disk entries of other versions are
+never read. SQLite errors (e.g. a file locked by another worker for longer
+than the busy timeout) are counted and treated as misses / skipped writes,
+never as prediction failures.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+SCHEMA = "create table if not exists predictions (key text primary key, version text, result text)"
+
+# SQLite limits the number of parameters per statement
+_SQL_CHUNK = 500
+
+
+class PredictionCache:
+    def __init__(self, columns, version, max_entries=100000, path=None):
+        """
+        columns: model input columns, in model order.
+        version: callable returning the current model version.
+        """
+        self.columns = list(columns)
+        self._version = version
+        self.max_entries = max_entries
+        self.path = path
+        self._memory = OrderedDict()
+        self._memory_version = None
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(SCHEMA)
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_errors = 0
+
+    def _keys(self, values, version):
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(self.columns))
+        # One bit pattern for every NaN, and -0.0 -> 0.0
+        values = np.where(np.isnan(values), np.nan, values + 0.0)
+        prefix = version.encode()
+        return [hashlib.blake2b(prefix + row.tobytes(), digest_size=16).hexdigest() for row in values]
+
+    def _get_many(self, keys, version):
+        """Cached results (copies) for keys, None for misses."""
+        results = [None] * len(keys)
+        with self._lock:
+            if self._memory_version != version:
+                self._memory.clear()
+                self._memory_version = version
+            for i, key in enumerate(keys):
+                result = self._memory.get(key)
+                if result is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = result
+
+            disk = {}
+            missing = [key for key, result in zip(keys, results) if result is None]
+            if self._conn is not None and missing:
+                try:
+                    for start in range(0, len(missing), _SQL_CHUNK):
+                        chunk = missing[start:start + _SQL_CHUNK]
+                        rows = self._conn.execute(
+                            f"select key, result from predictions where version = ? and key in ({', '.join('?' * len(chunk))})",
+                            [version, *chunk],
+                        ).fetchall()
+                        disk.update((key, json.loads(result)) for key, result in rows)
+                except sqlite3.Error:
+                    self.disk_errors += 1
+                for key, result in disk.items():
+                    self._remember(key, result)
+
+            for i, key in enumerate(keys):
+                if results[i] is None and key in disk:
+                    results[i] = disk[key]
+                    self.disk_hits += 1
+            found = sum(result is not None for result in results)
+            self.hits += found
+            self.misses += len(keys) - found
+        return [dict(result, proba=list(result['proba'])) if result is not None else None for result in results]
+
+    def _put_many(self, keys, results, version):
+        entries = {key: result for key, result in zip(keys, results) if 'error' not in result}
+        if not entries:
+            return
+        with self._lock:
+            if self._memory_version != version:
+                return
+            for key, result in entries.items():
+                self._remember(key, {'prediction': result['prediction'], 'proba': list(result['proba'])})
+            if self._conn is not None:
+                try:
+                    with self._conn:
+                        self._conn.executemany(
+                            "insert or replace into predictions (key, version, result) values (?, ?, ?)",
+                            [(key, version, json.dumps({'prediction': r['prediction'], 'proba': r['proba']}))
+                             for key, r in entries.items()],
+                        )
+                except sqlite3.Error:
+                    # The memory tier still has them; another worker may be holding the file
+                    self.disk_errors += 1
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, json_input):
+        """Cached result for one input dict, or None."""
+        version = self._version()
+        try:
+            key = self._keys([float(json_input[column]) for column in self.columns], version)[0]
+        except (KeyError, TypeError, ValueError):
+            return None
+        return self._get_many([key], version)[0]
+
+    def put(self, json_input, result):
+        version = self._version()
+        try:
+            key = self._keys([float(json_input[column]) for column in self.columns], version)[0]
+        except (KeyError, TypeError, ValueError):
+            return
+        self._put_many([key], [result], version)
+
+    def lookup_frame(self, df):
+        """
+        Look up every row of a frame with the model columns. Returns
+        (results, misses): results holds a result or None per row, misses
+        maps each distinct uncached input to the row positions sharing it,
+        so duplicate rows are only scored once. Score the rows at
+        first_positions(misses), then hand the results to fill().
+        """
+        version = self._version()
+        try:
+            values = df[self.columns].to_numpy(dtype=np.float64)
+        except (TypeError, ValueError):
+            # Non-numeric input: score every row as-is, so bad rows still get their own error
+            return [None] * len(df), {position: [position] for position in range(len(df))}
+
+        keys = self._keys(values, version)
+        results = self._get_many(keys, version)
+        misses = {}
+        for position, (key, result) in enumerate(zip(keys, results)):
+            if result is None:
+                misses.setdefault(key, []).append(position)
+        return results, misses
+
+    @staticmethod
+    def first_positions(misses):
+        return [positions[0] for positions in misses.values()]
+
+    def fill(self, results, misses, scored):
+        """Store freshly scored results and copy them into every row that shares them."""
+        cacheable = [(key, result) for key, result in zip(misses, scored) if isinstance(key, str)]
+        if cacheable:
+            keys, cacheable_results = zip(*cacheable)
+            self._put_many(keys, cacheable_results, self._version())
+
+        for positions, result in zip(misses.values(), scored):
+            for position in positions:
+                results[position] = dict(result, proba=list(result['proba'])) if 'proba' in result else dict(result)
+        return results
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "model_version": self._memory_version,
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "disk_path": self.path,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "disk_errors": self.disk_errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
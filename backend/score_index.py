@@ -0,0 +1,432 @@
+"""
+Precomputed model scores for the whole cumulative KOI catalog.
+
+`python score_index.py build` scores every KOI of the archive's cumulative
+table once with the served model and writes a columnar version directory
+(one .npy per column, strings interned as int32 codes, like catalog.py)
+holding the catalog fields next to the class probabilities. Every
+filterable or sortable column also gets a sorted index: the row ids ordered
+by that column's value, with its values in that order, rows without a value
+left out. A version is named by the model version and the catalog's content
+hash, so a new model or catalog gets its own directory, and CURRENT points
+at the one served.
+
+A query (range filters plus top-k by any indexed column) never scans the
+whole catalog. It either binary-searches the most selective filter's index
+and checks the other filters on just those rows, or walks the sort column's
+index from the top and stops once k rows pass the filters, whichever is
+expected to touch fewer rows.
+
+    python score_index.py build [--file cumulative.csv]   # score the catalog with the served model
+    python score_index.py check                           # compare random queries with a brute-force scan; exits 1 on a mismatch
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+SCORE_INDEX_PATH = os.environ.get("SCORE_INDEX_PATH", "score_index")
+
+CLASSES = ("FALSE POSITIVE", "CANDIDATE", "CONFIRMED")
+# Name of the stored probability column of each class
+PROBA_FIELDS = {label: "proba_" + label.lower().replace(" ", "_") for label in CLASSES}
+
+# Catalog columns stored (those the table has); all numeric ones are indexed
+STRING_FIELDS = ('kepoi_name', 'kepler_name', 'koi_disposition', 'koi_pdisposition')
+NUMERIC_FIELDS = (
+    'koi_period', 'koi_time0bk', 'koi_duration', 'koi_depth', 'koi_prad', 'koi_impact',
+    'koi_model_snr', 'koi_score', 'koi_steff', 'koi_srad', 'koi_slogg',
+    'koi_teq', 'koi_insol', 'koi_kepmag', 'ra', 'dec',
+)
+# String fields that can be filtered on (exact value)
+CATEGORY_FIELDS = ('koi_disposition', 'koi_pdisposition')
+
+# Rows scored per model call while building
+_BUILD_CHUNK = 5000
+
+
+class ScoreIndex:
+    """Read-only, memory-mapped view of one built version."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as file:
+            meta = json.load(file)
+        with open(os.path.join(path, 'strings.json')) as file:
+            self.strings = json.load(file)
+        self._codes = {value: code for code, value in enumerate(self.strings)}
+
+        self.version = meta['version']
+        self.model_version = meta['model_version']
+        self.catalog_version = meta['catalog_version']
+        self.built = meta['built']
+        self.rows = meta['rows']
+        self.fields = meta['fields']
+        self.string_fields = set(meta['string_fields'])
+        self.indexed_fields = meta['indexed_fields']
+        self.columns = {
+            field: np.load(os.path.join(path, f'{field}.npy'), mmap_mode='r') for field in self.fields
+        }
+        # field -> (row ids ordered by the field, the field's values in that order)
+        self.orders = {
+            field: (np.load(os.path.join(path, f'order_{field}.npy'), mmap_mode='r'),
+                    np.load(os.path.join(path, f'sorted_{field}.npy'), mmap_mode='r'))
+            for field in self.indexed_fields
+        }
+
+    def __len__(self):
+        return self.rows
+
+    def record(self, row):
+        """One row: catalog fields plus {class: probability}."""
+        record = {}
+        for field in self.fields:
+            value = self.columns[field][row]
+            if field in self.string_fields:
+                value = None if value < 0 else self.strings[value]
+            else:
+                value = None if np.isnan(value) else float(value)
+            record[field] = value
+        record['probabilities'] = {label: record.pop(PROBA_FIELDS[label]) for label in CLASSES}
+        return record
+
+    def _bounds(self, field, low, high):
+        """(field, low, high) in stored units; categories become their code."""
+        if field in self.string_fields:
+            code = self._codes.get(low, -2)
+            return field, code, code
+        return field, -np.inf if low is None else float(low), np.inf if high is None else float(high)
+
+    def _window(self, field, low, high):
+        """Positions [start, stop) of field's index holding values in [low, high]."""
+        values = self.orders[field][1]
+        return int(np.searchsorted(values, low, side='left')), int(np.searchsorted(values, high, side='right'))
+
+    def _passes(self, rows, filters):
+        keep = np.ones(len(rows), dtype=bool)
+        for field, low, high in filters:
+            values = self.columns[field][rows]
+            # NaN (and a missing string's -1) fails every range
+            keep &= (values >= low) & (values <= high)
+        return keep
+
+    def query(self, ranges=None, equals=None, sort_by='CONFIRMED', limit=100, ascending=False):
+        """
+        Rows with every ranges {field: (min, max)} bound (inclusive, None =
+        open) and every equals {category field: value} match, the top
+        `limit` of them by sort_by (a class name or an indexed field; rows
+        without a value for it are left out). Returns (rows, stats).
+        """
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        sort_field = PROBA_FIELDS.get(sort_by, sort_by)
+        if sort_field not in self.orders or sort_field in CATEGORY_FIELDS:
+            raise ValueError(f"Cannot sort by {sort_by}")
+        filters = []
+        for field, (low, high) in (ranges or {}).items():
+            field = PROBA_FIELDS.get(field, field)
+            if field not in self.orders or field in self.string_fields:
+                raise ValueError(f"No range index on {field}")
+            if low is not None and high is not None and low > high:
+                raise ValueError(f"Range on {field} has min {low} above max {high}")
+            filters.append(self._bounds(field, low, high))
+        for field, value in (equals or {}).items():
+            if field not in CATEGORY_FIELDS or field not in self.orders:
+                raise ValueError(f"Cannot filter on {field} by value")
+            filters.append(self._bounds(field, value, value))
+
+        order = self.orders[sort_field][0]
+        if not filters:
+            top = order[-limit:][::-1] if not ascending else order[:limit]
+            return [int(row) for row in top], {'strategy': 'sorted', 'rows_examined': len(top)}
+
+        windows = [self._window(field, low, high) for field, low, high in filters]
+        sizes = [max(0, stop - start) for start, stop in windows]
+        narrowest = int(np.argmin(sizes))
+        if sizes[narrowest] <= 0:
+            return [], {'strategy': 'filter', 'rows_examined': 0}
+        # Rows a walk down the sort index is expected to visit, if the filters are independent
+        selectivity = np.prod([size / len(self.orders[field][0]) for size, (field, _, _) in zip(sizes, filters)])
+        expected_walk = limit / selectivity
+
+        if sizes[narrowest] <= expected_walk:
+            start, stop = windows[narrowest]
+            rows = np.asarray(self.orders[filters[narrowest][0]][0][start:stop])
+            rows = rows[self._passes(rows, filters[:narrowest] + filters[narrowest + 1:] + [(sort_field, -np.inf, np.inf)])]
+            keys = np.asarray(self.columns[sort_field][rows])
+            keys = keys if ascending else -keys
+            if len(rows) > limit:
+                part = np.argpartition(keys, limit - 1)[:limit]
+                rows, keys = rows[part], keys[part]
+            # Ties in the order a walk down the index would meet them
+            top = rows[np.lexsort((rows if ascending else -rows, keys))]
+            return [int(row) for row in top], {'strategy': 'filter', 'rows_examined': sizes[narrowest]}
+
+        # Walk the sort index in growing blocks until enough rows pass
+        found = []
+        position = 0
+        block = max(4 * limit, 1024)
+        while position < len(order) and len(found) < limit:
+            if ascending:
+                rows = np.asarray(order[position:position + block])
+            else:
+                end = len(order) - position
+                rows = np.asarray(order[max(0, end - block):end])[::-1]
+            found.extend(rows[self._passes(rows, filters)][:limit - len(found)].tolist())
+            position += block
+            block *= 2
+        return found, {'strategy': 'walk', 'rows_examined': min(position, len(order))}
+
+
+def build_index(df, score, model_version, root=SCORE_INDEX_PATH):
+    """
+    Score a cumulative-table DataFrame and write its version under root,
+    pointing CURRENT at it. score(values) returns (n, 3) probabilities in
+    CLASSES order for raw (n, 12) model input values. Rebuilding the same
+    model and catalog is a no-op. Returns the version directory.
+    """
+    catalog_version = df.attrs.get('snapshot')
+    if catalog_version is None:
+        import pandas as pd
+
+        rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        catalog_version = hashlib.sha256(rows.tobytes()).hexdigest()[:16]
+    version = f"{model_version}-{catalog_version}"
+    target = os.path.join(root, version)
+    if not os.path.isdir(target):
+        os.makedirs(root, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=root)
+        try:
+            _write_index(df, score, version, model_version, catalog_version, tmp)
+            os.rename(tmp, target)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(target):
+                raise
+    _set_current(root, version)
+    return target
+
+
+def model_inputs(df):
+    """Raw (n, 12) model input values of cumulative-table rows."""
+    from model_training.feature_kernel import RAW_COLUMNS
+
+    values = np.full((len(df), len(RAW_COLUMNS)), np.nan)
+    for i, column in enumerate(RAW_COLUMNS):
+        if column == 'koi_pdisposition_bin' and column not in df.columns and 'koi_pdisposition' in df.columns:
+            # As train.py derives it
+            values[:, i] = df['koi_pdisposition'].map({'CANDIDATE': 1, 'FALSE POSITIVE': 0}).to_numpy(dtype=np.float64)
+        elif column in df.columns:
+            values[:, i] = df[column].to_numpy(dtype=np.float64)
+    return values
+
+
+def _write_index(df, score, version, model_version, catalog_version, path):
+    values = model_inputs(df)
+    proba = np.concatenate([
+        np.array(score(values[start:start + _BUILD_CHUNK]), dtype=np.float64)
+        for start in range(0, len(df), _BUILD_CHUNK)
+    ]) if len(df) else np.empty((0, len(CLASSES)))
+
+    columns = {}
+    strings = []
+    interned = {}
+    string_fields = [field for field in STRING_FIELDS if field in df.columns]
+    for field in string_fields:
+        codes = np.full(len(df), -1, dtype=np.int32)
+        for row, value in enumerate(df[field].tolist()):
+            if isinstance(value, str):
+                if value not in interned:
+                    interned[value] = len(strings)
+                    strings.append(value)
+                codes[row] = interned[value]
+        columns[field] = codes
+    for field in NUMERIC_FIELDS:
+        if field in df.columns:
+            columns[field] = df[field].to_numpy(dtype=np.float64)
+    for k, label in enumerate(CLASSES):
+        columns[PROBA_FIELDS[label]] = proba[:, k]
+
+    indexed = []
+    for field, column in columns.items():
+        if field in string_fields and field not in CATEGORY_FIELDS:
+            continue
+        present = np.flatnonzero(column >= 0) if field in string_fields else np.flatnonzero(~np.isnan(column))
+        order = present[np.argsort(column[present], kind='stable')].astype(np.int64)
+        np.save(os.path.join(path, f'order_{field}.npy'), order)
+        np.save(os.path.join(path, f'sorted_{field}.npy'), column[order])
+        indexed.append(field)
+    for field, column in columns.items():
+        np.save(os.path.join(path, f'{field}.npy'), column)
+
+    with open(os.path.join(path, 'strings.json'), 'w') as file:
+        json.dump(strings, file)
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump({
+            'version': version,
+            'model_version': model_version,
+            'catalog_version': catalog_version,
+            'built': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'rows': len(df),
+            'fields': list(columns),
+            'string_fields': string_fields,
+            'indexed_fields': indexed,
+        }, file)
+
+
+def _set_current(root, version):
+    fd, tmp = tempfile.mkstemp(prefix='.CURRENT-', dir=root)
+    with os.fdopen(fd, 'w') as file:
+        file.write(version)
+    os.replace(tmp, os.path.join(root, 'CURRENT'))
+
+
+def open_current(root=SCORE_INDEX_PATH):
+    """Open the version CURRENT points at, or None if there is none."""
+    try:
+        with open(os.path.join(root, 'CURRENT')) as file:
+            version = file.read().strip()
+        return ScoreIndex(os.path.join(root, version))
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class ScoreIndexHandle:
+    """
+    The ScoreIndex CURRENT points at, reopened when a build moves CURRENT;
+    CURRENT is checked at most every check_interval seconds.
+    """
+
+    def __init__(self, root=SCORE_INDEX_PATH, check_interval=5.0):
+        self.root = root
+        self.check_interval = check_interval
+        self._index = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            with self._lock:
+                self._checked_at = time.monotonic()
+                try:
+                    with open(os.path.join(self.root, 'CURRENT')) as file:
+                        version = file.read().strip()
+                except FileNotFoundError:
+                    version = None
+                if version is None:
+                    self._index = None
+                elif self._index is None or self._index.version != version:
+                    self._index = open_current(self.root)
+        return self._index
+
+
+def _served_model_score():
+    """(score function, model version) for the model the server would load."""
+    from model_training.inference import predict_proba_values, encode_map
+    from model_training.registry import model_registry
+
+    artifacts = model_registry.get()
+    columns = [list(artifacts.model.classes_).index(encode_map[label]) for label in CLASSES]
+
+    def score(values):
+        return predict_proba_values(values, artifacts)[:, columns]
+    return score, model_registry.version
+
+
+def check(root=SCORE_INDEX_PATH, queries=300, seed=0):
+    """Random queries against a brute-force scan of the same columns; returns a report."""
+    index = open_current(root)
+    if index is None:
+        raise RuntimeError(f"No score index under {root}; run `python score_index.py build` first")
+    rng = np.random.default_rng(seed)
+    numeric = [field for field in index.indexed_fields if field not in index.string_fields]
+    categories = [field for field in index.indexed_fields if field in index.string_fields]
+    mismatches = 0
+    strategies = {}
+    examined = 0
+    started = time.perf_counter()
+    for _ in range(queries):
+        ranges = {}
+        for field in rng.choice(numeric, size=rng.integers(1, 3), replace=False):
+            values = np.asarray(index.orders[field][1])
+            low, high = np.sort(rng.choice(values, 2)) if len(values) else (0.0, 0.0)
+            ranges[str(field)] = (None if rng.random() < 0.3 else float(low), None if rng.random() < 0.3 else float(high))
+        equals = {}
+        if categories and rng.random() < 0.5:
+            field = str(rng.choice(categories))
+            codes = np.asarray(index.orders[field][1])
+            equals[field] = index.strings[int(rng.choice(codes))] if len(codes) else None
+        sort_by = str(rng.choice(list(CLASSES) + numeric))
+        limit = int(rng.choice([1, 10, 100, 1000]))
+        ascending = bool(rng.random() < 0.2)
+        rows, stats = index.query(ranges, equals, sort_by, limit, ascending)
+        strategies[stats['strategy']] = strategies.get(stats['strategy'], 0) + 1
+        examined += stats['rows_examined']
+
+        # Brute force over every row
+        keep = np.ones(len(index), dtype=bool)
+        for field, (low, high) in ranges.items():
+            column = np.asarray(index.columns[PROBA_FIELDS.get(field, field)])
+            keep &= (column >= (-np.inf if low is None else low)) & (column <= (np.inf if high is None else high))
+        for field, value in equals.items():
+            keep &= np.asarray(index.columns[field]) == index.strings.index(value)
+        sort_column = np.asarray(index.columns[PROBA_FIELDS.get(sort_by, sort_by)])
+        keep &= ~np.isnan(sort_column)
+        candidates = np.flatnonzero(keep)
+        key = sort_column[candidates] if ascending else -sort_column[candidates]
+        expected = sort_column[candidates[np.lexsort((candidates, key))][:limit]]
+        if not np.array_equal(sort_column[np.asarray(rows, dtype=np.int64)], expected):
+            mismatches += 1
+    seconds = time.perf_counter() - started
+    return {
+        'version': index.version,
+        'rows': len(index),
+        'queries': queries,
+        'mismatches': mismatches,
+        'strategies': strategies,
+        'mean_rows_examined': round(examined / queries, 1),
+        'mean_query_ms_including_brute_force': round(1000 * seconds / queries, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precomputed model scores for the KOI catalog")
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--root', default=SCORE_INDEX_PATH, help="index directory")
+    parser.add_argument('--file', help="cumulative table CSV to score instead of the newest training snapshot")
+    parser.add_argument('--snapshot-dir', default=os.environ.get("TRAINING_SNAPSHOT_DIR", os.path.join("model_training", "snapshots")))
+    parser.add_argument('--queries', type=int, default=300, help="random queries (check)")
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        report = check(args.root, args.queries)
+        print(json.dumps(report, indent=2))
+        if report['mismatches']:
+            sys.exit(f"{report['mismatches']} of {report['queries']} queries disagree with a brute-force scan")
+        return
+
+    if args.file:
+        import pandas as pd
+
+        df = pd.read_csv(args.file, comment='#')
+        with open(args.file, 'rb') as file:
+            df.attrs['snapshot'] = hashlib.sha256(file.read()).hexdigest()[:16]
+    else:
+        from model_training.data_loader import load_koi_data
+
+        df = load_koi_data(snapshot_dir=args.snapshot_dir)
+    score, model_version = _served_model_score()
+    started = time.perf_counter()
+    path = build_index(df, score, model_version, args.root)
+    print(f"Indexed {len(df)} KOIs in {path} ({time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Background scoring jobs for CSV files too large for one HTTP request.
+
+A submitted upload is saved under the jobs directory and scored by worker
+threads `chunk_rows` rows at a time. After every chunk its results are
+written to their own JSON-lines file and the job's state.json is replaced
+atomically, so a job interrupted by a crash or restart resumes at the first
+unfinished chunk the next time the server starts. While a worker runs a job
+it holds a lock on the job directory, so with several server processes
+sharing the directory each job is scored by exactly one of them. cancel()
+drops a `cancelled` marker that the worker checks before every chunk and
+every state write; whoever holds the directory lock last deletes the job.
+
+    <directory>/<job_id>/input.csv
+    <directory>/<job_id>/state.json
+    <directory>/<job_id>/cancelled
+    <directory>/<job_id>/results-000000.jsonl, results-000001.jsonl, ...
+"""
+import contextlib
+import fcntl
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+# Upload bytes copied to disk at a time
+_COPY_BYTES = 1 << 20
+
+ACTIVE = ('queued', 'running')
+
+# How long cancel() retries for the lock of a job a worker is just letting go of
+_CANCEL_WAIT_SECONDS = 0.2
+
+
+class JobNotFound(KeyError):
+    pass
+
+
+def summarize(state):
+    """The summary fields of /api/exoplanet-detection-csv, for the rows scored so far."""
+    return {
+        "total_rows_processed": state['rows_done'],
+        "exoplanets_found": state['exoplanets_found'],
+        "non_exoplanets": state['rows_done'] - state['exoplanets_found'] - state['errors'],
+        "errors": state['errors'],
+    }
+
+
+class ScoringJobs:
+    def __init__(self, directory, score, chunk_rows=5000, workers=1):
+        """
+        score: callable taking a pandas chunk of the upload (indexed by row
+        position in the file) and returning one result dict per row.
+        """
+        self.directory = directory
+        self._score = score
+        self.chunk_rows = chunk_rows
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._threads = []
+        self._stop = threading.Event()
+
+    def _path(self, job_id, name=''):
+        # Job IDs are generated hex strings; anything else cannot be a job
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            raise JobNotFound(job_id)
+        return os.path.join(self.directory, job_id, name)
+
+    def _write_state(self, state):
+        path = self._path(state['id'], 'state.json')
+        with open(path + '.tmp', 'w') as file:
+            json.dump(state, file)
+        os.replace(path + '.tmp', path)
+
+    @contextlib.contextmanager
+    def _state_lock(self, job_id):
+        """Serializes read-modify-write of state.json between workers and cancel()."""
+        try:
+            lock = open(self._path(job_id, 'state.lock'), 'a')
+        except FileNotFoundError:
+            raise JobNotFound(job_id)
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _cancelled(self, job_id):
+        return os.path.exists(self._path(job_id, 'cancelled'))
+
+    def _checkpoint(self, state):
+        """Write a worker's state, unless the job was cancelled meanwhile; False if it was."""
+        with self._state_lock(state['id']):
+            if self._cancelled(state['id']) or self.state(state['id'])['status'] == 'cancelled':
+                state['status'] = 'cancelled'
+                return False
+            self._write_state(state)
+            return True
+
+    def state(self, job_id):
+        try:
+            with open(self._path(job_id, 'state.json')) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            raise JobNotFound(job_id)
+
+    def submit(self, upload, filename):
+        """Save a binary file object and queue it; returns the new job's state."""
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._path(job_id))
+        lines = 0
+        size = 0
+        last = b'\n'
+        with open(self._path(job_id, 'input.csv'), 'wb') as file:
+            while True:
+                data = upload.read(_COPY_BYTES)
+                if not data:
+                    break
+                file.write(data)
+                lines += data.count(b'\n')
+                size += len(data)
+                last = data[-1:]
+        if last != b'\n':
+            lines += 1
+        state = {
+            'id': job_id,
+            'filename': filename,
+            'status': 'queued',
+            'created': time.time(),
+            'updated': time.time(),
+            'bytes': size,
+            # Line count minus the header; quoted newlines make it an estimate
+            'estimated_rows': max(lines - 1, 0),
+            'chunk_rows': self.chunk_rows,
+            'chunks_done': 0,
+            'rows_done': 0,
+            'exoplanets_found': 0,
+            'errors': 0,
+            'error': None,
+        }
+        self._write_state(state)
+        self._queue.put(job_id)
+        return state
+
+    def start(self):
+        """Start the workers and queue every job left unfinished by a previous run."""
+        self._stop.clear()
+        os.makedirs(self.directory, exist_ok=True)
+        for job_id in sorted(os.listdir(self.directory), key=lambda name: self._created(name)):
+            try:
+                status = self.state(job_id)['status']
+            except (JobNotFound, ValueError):
+                continue
+            if status in ACTIVE:
+                self._queue.put(job_id)
+            elif status == 'cancelled':
+                # Cancelled while its worker was stopping
+                self._delete_if_idle(job_id)
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._run, daemon=True, name="scoring-job")
+            thread.start()
+            self._threads.append(thread)
+
+    def _created(self, job_id):
+        try:
+            return self.state(job_id)['created']
+        except (JobNotFound, ValueError):
+            return 0
+
+    def shutdown(self):
+        """Stop after the chunk in progress; running jobs resume on the next start()."""
+        self._stop.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def cancel(self, job_id):
+        """
+        Cancel a job and delete its files. Does not wait for a worker scoring
+        it: that worker stops after the current chunk and deletes them itself.
+        """
+        self.state(job_id)
+        try:
+            open(self._path(job_id, 'cancelled'), 'w').close()
+            with self._state_lock(job_id):
+                state = self.state(job_id)
+                state['status'] = 'cancelled'
+                state['updated'] = time.time()
+                self._write_state(state)
+        except (FileNotFoundError, JobNotFound):
+            # Deleted meanwhile
+            return
+        # A worker that checked for the marker just before it was written is about to let go
+        deadline = time.monotonic() + _CANCEL_WAIT_SECONDS
+        while not self._delete_if_idle(job_id) and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+    def _delete_if_idle(self, job_id):
+        """Delete a job's directory unless a worker holds its lock; True if it is gone."""
+        try:
+            lock = open(self._path(job_id, 'lock'), 'a')
+        except FileNotFoundError:
+            return True
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            shutil.rmtree(self._path(job_id), ignore_errors=True)
+        return True
+
+    def _run(self):
+        # Runs until it takes one of shutdown()'s sentinels; jobs taken after
+        # the stop return at once and are picked up again by the next start()
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            try:
+                self._process(job_id)
+            except JobNotFound:
+                continue
+
+    def _process(self, job_id):
+        try:
+            lock = open(self._path(job_id, 'lock'), 'a')
+        except FileNotFoundError:
+            # Cancelled while queued
+            return
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is scoring it
+                return
+            state = self.state(job_id)
+            if state['status'] in ACTIVE:
+                state['status'] = 'running'
+                if self._checkpoint(state):
+                    try:
+                        finished = self._score_chunks(state)
+                    except Exception as e:
+                        state['status'] = 'failed'
+                        state['error'] = f"Error processing CSV file: {str(e)}"
+                        finished = True
+                    if finished and state['status'] != 'cancelled':
+                        if state['status'] == 'running':
+                            state['status'] = 'completed'
+                        state['updated'] = time.time()
+                        self._checkpoint(state)
+            # Still holding the lock, so cancel() cannot be deleting it concurrently
+            if self._cancelled(job_id):
+                shutil.rmtree(self._path(job_id), ignore_errors=True)
+
+    def _score_chunks(self, state):
+        """Score the chunks not yet checkpointed; False if stopped or cancelled first."""
+        import pandas as pd
+
+        try:
+            # Checkpointed chunks are parsed again and dropped: skipping lines
+            # instead would resume mid-record after quoted multi-line fields
+            reader = pd.read_csv(
+                self._path(state['id'], 'input.csv'), chunksize=state['chunk_rows'], encoding='utf-8',
+            )
+        except pd.errors.EmptyDataError:
+            raise ValueError("CSV file is empty")
+        with reader:
+            for number, chunk in enumerate(reader):
+                if number < state['chunks_done']:
+                    continue
+                if self._stop.is_set() or self._cancelled(state['id']):
+                    return False
+                chunk.index = pd.RangeIndex(state['rows_done'], state['rows_done'] + len(chunk))
+                results = self._score(chunk)
+
+                path = self._path(state['id'], f"results-{state['chunks_done']:06d}.jsonl")
+                with open(path + '.tmp', 'w') as file:
+                    for result in results:
+                        file.write(json.dumps(result) + "\n")
+                os.replace(path + '.tmp', path)
+
+                state['chunks_done'] += 1
+                state['rows_done'] += len(results)
+                state['exoplanets_found'] += sum(1 for r in results if r.get('prediction') == 'CONFIRMED')
+                state['errors'] += sum(1 for r in results if 'error' in r)
+                state['updated'] = time.time()
+                if not self._checkpoint(state):
+                    return False
+        return True
+
+    def results(self, job_id, offset=0, limit=1000):
+        """Results of rows [offset, offset + limit) that have been scored so far."""
+        state = self.state(job_id)
+        chunk_rows = state['chunk_rows']
+        end = min(offset + limit, state['rows_done'])
+        results = []
+        position = offset
+        while position < end:
+            chunk, skip = divmod(position, chunk_rows)
+            with open(self._path(job_id, f"results-{chunk:06d}.jsonl")) as file:
+                lines = file.readlines()[skip:skip + end - position]
+            if not lines:
+                break
+            results.extend(json.loads(line) for line in lines)
+            position += len(lines)
+        return state, results
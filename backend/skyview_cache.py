@@ -0,0 +1,250 @@
+"""
+Caching proxy for SkyView sky survey cutouts.
+
+Every cutout is fetched from SkyView once per (ra, dec, survey, size,
+pixels) and stored as a file named by a hash of that key. The directory is
+an LRU bounded to max_bytes: a hit refreshes the file's mtime, and once the
+stored bytes pass the bound the least recently used files are deleted. The
+mtimes live on disk, so the order survives restarts and is shared by all
+workers using the directory. A cutout never changes for its key, so the key
+hash doubles as its ETag and responses can be cached by browsers for good.
+
+Concurrent requests for the same cutout share one upstream fetch, and
+prefetch() starts fetches in the background (e.g. for stars just looked up)
+so the image is usually on disk by the time the browser asks for it. File
+reads, writes and eviction sweeps run in worker threads, off the event loop.
+"""
+import asyncio
+import hashlib
+import os
+
+import httpx
+
+SKYVIEW_URL = os.environ.get("SKYVIEW_URL", "https://skyview.gsfc.nasa.gov/current/cgi/runquery.pl")
+SKYVIEW_CACHE_DIR = os.environ.get("SKYVIEW_CACHE_DIR", "skyview_cache")
+SKYVIEW_CACHE_MB = float(os.environ.get("SKYVIEW_CACHE_MB", "512"))
+# Browser cache lifetime of a served cutout
+SKYVIEW_MAX_AGE = int(os.environ.get("SKYVIEW_MAX_AGE", str(30 * 24 * 3600)))
+
+DEFAULT_SURVEY = "DSS2 Red"
+DEFAULT_SIZE = 0.25
+DEFAULT_PIXELS = 300
+
+# What the proxy fetches on request; anything else would make it an open relay
+SURVEYS = ("DSS", "DSS1 Red", "DSS1 Blue", "DSS2 Red", "DSS2 Blue", "DSS2 IR", "2MASS-J", "2MASS-H", "2MASS-K")
+MAX_SIZE = 2.0
+MIN_PIXELS = 16
+MAX_PIXELS = 1200
+# Larger upstream responses are refused
+MAX_IMAGE_BYTES = 8 << 20
+
+# Evictions trim the directory to this fraction of max_bytes, so they run in batches
+_LOW_WATER = 0.9
+
+
+class CutoutUnavailable(Exception):
+    pass
+
+
+def cutout_key(ra, dec, survey=DEFAULT_SURVEY, size=DEFAULT_SIZE, pixels=DEFAULT_PIXELS):
+    """
+    Normalized (ra, dec, survey, size, pixels) for a cutout request, with
+    coordinates rounded to 1e-6 deg. Raises ValueError for values outside
+    what the proxy serves.
+    """
+    ra = float(ra)
+    dec = float(dec)
+    size = float(size)
+    pixels = int(pixels)
+    if not (0 <= ra <= 360 and -90 <= dec <= 90):
+        raise ValueError(f"Position {ra},{dec} is outside ra 0..360, dec -90..90")
+    if survey not in SURVEYS:
+        raise ValueError(f"Survey must be one of {', '.join(SURVEYS)}")
+    if not 0 < size <= MAX_SIZE:
+        raise ValueError(f"Size must be between 0 and {MAX_SIZE} degrees")
+    if not MIN_PIXELS <= pixels <= MAX_PIXELS:
+        raise ValueError(f"Pixels must be between {MIN_PIXELS} and {MAX_PIXELS}")
+    return (f"{ra:.6f}", f"{dec:.6f}", survey, f"{size:g}", pixels)
+
+
+def skyview_params(key):
+    """runquery.pl parameters for a cutout_key()."""
+    ra, dec, survey, size, pixels = key
+    return {
+        "Survey": survey,
+        "Position": f"{ra},{dec}",
+        "Size": size,
+        "Pixels": str(pixels),
+        "Return": "JPEG",
+    }
+
+
+def query_params(key):
+    """Query parameters of the proxy endpoint for a cutout_key()."""
+    ra, dec, survey, size, pixels = key
+    return {"ra": ra, "dec": dec, "survey": survey, "size": size, "pixels": pixels}
+
+
+def etag(key):
+    return '"' + hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest() + '"'
+
+
+class CutoutCache:
+    def __init__(self, directory=SKYVIEW_CACHE_DIR, max_bytes=int(SKYVIEW_CACHE_MB * 2**20),
+                 url=SKYVIEW_URL, max_concurrency=4, timeout=60.0, max_prefetch=100):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.url = url
+        self.timeout = timeout
+        self.max_prefetch = max_prefetch
+        self.max_concurrency = max_concurrency
+        self._client = None
+        # Created in the running loop by the first fetch
+        self._semaphore = None
+        self._inflight = {}
+        self._prefetching = set()
+        self._stored_bytes = None
+
+        self.hits = 0
+        self.misses = 0
+        self.fetch_errors = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, etag(key).strip('"') + ".jpg")
+
+    def _read(self, key):
+        """Cached bytes for key (marking them recently used), or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Never fetched, or evicted (possibly by another worker)
+            return None
+        return data
+
+    async def get(self, key):
+        """
+        JPEG bytes of the cutout for key, fetched from SkyView on a miss.
+        Callers asking for the same cutout while it is being fetched share
+        that fetch. Raises CutoutUnavailable if SkyView has no image for it.
+        """
+        data = await asyncio.to_thread(self._read, key)
+        if data is not None:
+            self.hits += 1
+            return data
+        self.misses += 1
+        return await asyncio.shield(self._fetch_task(key))
+
+    def _fetch_task(self, key):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _fetch(self, key):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)))
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            # A worker sharing the directory may have stored it meanwhile
+            data = await asyncio.to_thread(self._read, key)
+            if data is not None:
+                return data
+            try:
+                response = await self._client.get(self.url, params=skyview_params(key))
+            except httpx.HTTPError as e:
+                self.fetch_errors += 1
+                raise CutoutUnavailable(f"SkyView request failed: {e}")
+        # SkyView answers errors (e.g. no coverage) with an HTML page
+        content_type = response.headers.get("content-type", "")
+        if not response.is_success or not content_type.startswith("image/"):
+            self.fetch_errors += 1
+            raise CutoutUnavailable(f"SkyView returned {response.status_code} ({content_type or 'no content type'})")
+        data = response.content
+        if not data or len(data) > MAX_IMAGE_BYTES:
+            self.fetch_errors += 1
+            raise CutoutUnavailable(f"SkyView returned an image of {len(data)} bytes")
+        await asyncio.to_thread(self._store, key, data)
+        return data
+
+    def _store(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, path)
+        if self._stored_bytes is None:
+            self._evict()
+        else:
+            self._stored_bytes += len(data)
+            if self._stored_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete least recently used files until the directory is under the low-water mark."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".jpg"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            files.sort()
+            for _, size, path in files:
+                if total <= self.max_bytes * _LOW_WATER:
+                    break
+                try:
+                    os.unlink(path)
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self._stored_bytes = total
+
+    def prefetch(self, keys):
+        """
+        Fetch cutouts for keys in the background. In-flight ones are skipped,
+        cached ones are found on disk by the fetch without a request, and at
+        most max_prefetch run or wait at a time.
+        """
+        for key in keys:
+            if len(self._prefetching) >= self.max_prefetch:
+                break
+            if key in self._inflight:
+                continue
+            task = self._fetch_task(key)
+            self._prefetching.add(task)
+            task.add_done_callback(self._prefetch_done)
+
+    def _prefetch_done(self, task):
+        self._prefetching.discard(task)
+        # Failures are counted in fetch_errors; retrieving the exception keeps asyncio quiet
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "fetch_errors": self.fetch_errors,
+            "evictions": self.evictions,
+            "prefetching": len(self._prefetching),
+        }
+
+    async def aclose(self):
+        for task in list(self._prefetching):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
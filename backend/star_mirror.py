@@ -0,0 +1,159 @@
+"""
+Local SQLite mirror of the pscomppars host columns used by /api/star-info.
+
+Sync it from the archive (incrementally, using pscomppars.rowupdate) or from
+a local CSV export:
+
+    python star_mirror.py sync                  # incremental refresh from the archive
+    python star_mirror.py sync --full           # rebuild from the archive
+    python star_mirror.py sync --file hosts.csv # load a local TAP CSV export, no network
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+
+import httpx
+
+from tap_client import NASA_TAP_URL, STAR_INFO_COLUMNS, adql_string
+
+STAR_MIRROR_PATH = os.environ.get("STAR_MIRROR_PATH", "star_mirror.sqlite")
+
+COLUMNS = [column.strip() for column in STAR_INFO_COLUMNS.split(',')]
+
+# SQLite limits the number of parameters per statement
+_SQL_CHUNK = 500
+
+SCHEMA = f"""
+create table if not exists hosts (
+    hostname text primary key,
+    {', '.join(f'{column} text' for column in COLUMNS[1:])},
+    rowupdate text
+);
+create table if not exists meta (key text primary key, value text);
+"""
+
+
+class StarMirror:
+    """
+    Values are stored as the text the TAP CSV returns, so rows served from
+    the mirror are indistinguishable from rows fetched from the archive.
+    """
+
+    def __init__(self, path=STAR_MIRROR_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def lookup(self, hostname):
+        """The mirrored row for hostname as a dict, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                f"select {', '.join(COLUMNS)} from hosts where hostname = ?", (hostname,)
+            ).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def lookup_many(self, hostnames):
+        """{hostname: mirrored row} for the hostnames that are mirrored."""
+        hostnames = list(dict.fromkeys(hostnames))
+        found = {}
+        with self._lock:
+            for start in range(0, len(hostnames), _SQL_CHUNK):
+                chunk = hostnames[start:start + _SQL_CHUNK]
+                rows = self._conn.execute(
+                    f"select {', '.join(COLUMNS)} from hosts where hostname in ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for row in rows:
+                    found[row[0]] = dict(zip(COLUMNS, row))
+        return found
+
+    def last_rowupdate(self):
+        with self._lock:
+            row = self._conn.execute("select value from meta where key = 'last_rowupdate'").fetchone()
+        return row[0] if row else None
+
+    def upsert(self, rows, replace=False):
+        """
+        Insert or update host rows (dicts keyed by the pscomppars column
+        names). pscomppars has one row per planet, so the first row seen
+        for a host wins. With replace=True, hosts not in rows are dropped.
+        Returns the number of hosts written.
+        """
+        hosts = {}
+        newest = self.last_rowupdate() if not replace else None
+        for row in rows:
+            hostname = row.get('hostname')
+            if not hostname or hostname in hosts:
+                continue
+            hosts[hostname] = tuple(row.get(column) for column in COLUMNS) + (row.get('rowupdate') or None,)
+            if row.get('rowupdate') and (newest is None or row['rowupdate'] > newest):
+                newest = row['rowupdate']
+
+        with self._lock, self._conn:
+            if replace:
+                self._conn.execute("delete from hosts")
+            self._conn.executemany(
+                f"insert or replace into hosts ({', '.join(COLUMNS)}, rowupdate) "
+                f"values ({', '.join('?' * (len(COLUMNS) + 1))})",
+                hosts.values(),
+            )
+            if newest:
+                self._conn.execute(
+                    "insert or replace into meta (key, value) values ('last_rowupdate', ?)", (newest,)
+                )
+        return len(hosts)
+
+    def sync_from_file(self, path, replace=False):
+        with open(path, 'r', newline='') as file:
+            return self.upsert(csv.DictReader(file), replace=replace)
+
+    def sync_from_archive(self, url=NASA_TAP_URL, full=False, timeout=120.0):
+        """
+        Pull host rows from the archive. Unless full is set, only rows
+        updated since the last sync are fetched.
+        """
+        since = None if full else self.last_rowupdate()
+        query = f"select {STAR_INFO_COLUMNS}, rowupdate from pscomppars"
+        if since:
+            # rowupdate is a date, so re-fetch the last synced day as well
+            query += f" where rowupdate >= {adql_string(since)}"
+
+        response = httpx.get(url, params={'query': query, 'format': 'csv'}, timeout=timeout)
+        response.raise_for_status()
+        return self.upsert(csv.DictReader(response.text.splitlines()), replace=full)
+
+    def close(self):
+        self._conn.close()
+
+
+def open_mirror(path=STAR_MIRROR_PATH):
+    """Open the mirror if it has been synced, otherwise None."""
+    return StarMirror(path) if os.path.exists(path) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the local pscomppars host mirror")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sync = subparsers.add_parser('sync', help="refresh the mirror")
+    sync.add_argument('--db', default=STAR_MIRROR_PATH, help="mirror database path")
+    sync.add_argument('--file', help="load a local pscomppars CSV instead of querying the archive")
+    sync.add_argument('--full', action='store_true', help="replace the mirror instead of refreshing it")
+    sync.add_argument('--url', default=NASA_TAP_URL, help="TAP sync endpoint")
+    args = parser.parse_args()
+
+    mirror = StarMirror(args.db)
+    try:
+        if args.file:
+            count = mirror.sync_from_file(args.file, replace=args.full)
+        else:
+            count = mirror.sync_from_archive(args.url, full=args.full)
+    finally:
+        mirror.close()
+    print(f"Synced {count} hosts into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
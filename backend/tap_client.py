@@ -0,0 +1,130 @@
+"""
+Async client for the NASA Exoplanet Archive TAP service.
+
+One pooled httpx.AsyncClient is shared by all requests (keep-alive
+connections, timeouts), a semaphore bounds how many upstream queries run at
+once, and concurrent lookups for the same hostname are coalesced into a
+single upstream query. Bulk lookups pack many hostnames into a few
+`hostname in (...)` queries; every value is embedded as an escaped ADQL
+string literal (adql_string), never interpolated raw.
+"""
+import asyncio
+import csv
+import os
+import time
+from io import StringIO
+
+import httpx
+
+from model_training.metrics import TAP_SECONDS
+
+NASA_TAP_URL = os.environ.get("NASA_TAP_URL", "https://exoplanetarchive.ipac.caltech.edu/TAP/sync")
+
+STAR_INFO_COLUMNS = "hostname, ra, dec, st_spectype, sy_snum, sy_pnum, sy_dist"
+
+# Hostnames per `hostname in (...)` query; keeps the GET URL a few kB long
+HOST_BATCH_SIZE = int(os.environ.get("NASA_TAP_BATCH_SIZE", "100"))
+
+
+def adql_string(value):
+    """
+    value as an ADQL string literal: single quotes doubled, as the SQL
+    grammar ADQL follows requires. Control characters (which no hostname
+    contains) are rejected rather than passed upstream.
+    """
+    value = str(value)
+    if any(ord(c) < 32 for c in value):
+        raise ValueError("Control characters are not allowed in query values")
+    return "'" + value.replace("'", "''") + "'"
+
+
+class TapClient:
+    def __init__(self, url=NASA_TAP_URL, max_connections=20, max_concurrency=8, timeout=10.0):
+        self.url = url
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight = {}
+
+    async def query_csv(self, query):
+        """Run an ADQL query and return the CSV rows as dicts."""
+        async with self._semaphore:
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                response = await self._client.get(self.url, params={'query': query, 'format': 'csv'})
+                outcome = "ok" if response.is_success else "error"
+            finally:
+                TAP_SECONDS.observe(outcome, time.perf_counter() - started)
+        response.raise_for_status()
+        return list(csv.DictReader(StringIO(response.text)))
+
+    async def fetch_host(self, hostname):
+        """
+        First pscomppars row for hostname, or None. Callers asking for the
+        same hostname while a query is in flight share its result.
+        """
+        task = self._inflight.get(hostname)
+        if task is None:
+            task = asyncio.ensure_future(self._query_host(hostname))
+            self._inflight[hostname] = task
+            task.add_done_callback(lambda _: self._inflight.pop(hostname, None))
+        # Shield so one caller being cancelled doesn't cancel the shared query
+        return await asyncio.shield(task)
+
+    async def _query_host(self, hostname):
+        query_string = f"""
+        select {STAR_INFO_COLUMNS}
+        from pscomppars
+        where hostname={adql_string(hostname)}
+    """
+        rows = await self.query_csv(query_string)
+        return rows[0] if rows else None
+
+    async def fetch_hosts(self, hostnames, batch_size=HOST_BATCH_SIZE):
+        """
+        {hostname: first pscomppars row or None} for many hostnames, with
+        duplicates removed and at most batch_size hostnames per query. Names
+        already being queried share that query, and single lookups arriving
+        meanwhile share the bulk one. A name whose query failed maps to the
+        exception.
+        """
+        hostnames = list(dict.fromkeys(hostnames))
+        invalid = {}
+        for name in hostnames:
+            try:
+                adql_string(name)
+            except ValueError as e:
+                invalid[name] = e
+        pending = [name for name in hostnames if name not in self._inflight and name not in invalid]
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            query = asyncio.ensure_future(self._query_hosts(batch))
+            for name in batch:
+                task = asyncio.ensure_future(self._pick(query, name))
+                self._inflight[name] = task
+                task.add_done_callback(lambda _, name=name: self._inflight.pop(name, None))
+        valid = [name for name in hostnames if name not in invalid]
+        rows = await asyncio.gather(*(asyncio.shield(self._inflight[name]) for name in valid), return_exceptions=True)
+        return dict(zip(valid, rows), **invalid)
+
+    async def _query_hosts(self, hostnames):
+        query_string = f"""
+        select {STAR_INFO_COLUMNS}
+        from pscomppars
+        where hostname in ({", ".join(adql_string(name) for name in hostnames)})
+    """
+        found = {}
+        # pscomppars has a row per planet; like the single lookup, the first one wins
+        for row in await self.query_csv(query_string):
+            found.setdefault(row.get('hostname'), row)
+        return found
+
+    @staticmethod
+    async def _pick(query, hostname):
+        return (await query).get(hostname)
+
+    async def aclose(self):
+        await self._client.aclose()
@@ -0,0 +1,77 @@
+"""Hot reload of the columnar NASA catalog, including malformed replacement files."""
+import json
+import os
+
+import pytest
+
+from catalog import CatalogHandle, convert_catalog
+
+RECORDS = [
+    {"kepler_name": "Kepler-1892 b", "koi_period": 6.33125228, "koi_impact": 0.094, "koi_depth": 306.6},
+    {"kepler_name": "Kepler-1983 b", "koi_period": 7.32851947, "koi_impact": 0.983, "koi_depth": 277.8},
+    {"kepler_name": None, "koi_period": None, "koi_impact": 0.5, "koi_depth": 100.0},
+]
+
+
+def write(path, content):
+    path.write_text(content if isinstance(content, str) else json.dumps(content))
+    # A distinct mtime even on filesystems with coarse timestamps
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "NASA.json"
+    write(path, RECORDS)
+    return path
+
+
+def test_matches_after_conversion(source, tmp_path):
+    handle = CatalogHandle(str(source), str(tmp_path / "store"))
+    store = handle.current()
+    assert len(store) == 3
+    [row] = store.index.match(6.33, 0.094, 306.6)
+    assert store.record(row)["kepler_name"] == "Kepler-1892 b"
+
+
+@pytest.mark.parametrize("content", [
+    {"koi_period": 1.0},
+    ["not a record"],
+    [{"kepler_name": "Kepler-1 b", "koi_impact": 0.1, "koi_depth": 10.0}],
+    [{"koi_period": "6.3", "koi_impact": 0.1, "koi_depth": 10.0}],
+    "[{\"koi_period\": ",
+])
+def test_invalid_replacement_keeps_previous_catalog(source, tmp_path, content):
+    handle = CatalogHandle(str(source), str(tmp_path / "store"))
+    previous = handle.current()
+    write(source, content)
+    assert handle.reload() is previous
+    assert handle.current() is previous
+
+    # A valid file afterwards is picked up
+    write(source, RECORDS[:2])
+    assert len(handle.reload()) == 2
+
+
+def test_invalid_source_at_startup_serves_last_converted_store(source, tmp_path):
+    store_root = str(tmp_path / "store")
+    convert_catalog(str(source), store_root)
+    write(source, {"records": RECORDS})
+    handle = CatalogHandle(str(source), store_root)
+    assert len(handle.current()) == 3
+
+
+def test_invalid_source_without_store_serves_nothing(source, tmp_path):
+    write(source, [1, 2, 3])
+    assert CatalogHandle(str(source), str(tmp_path / "store")).current() is None
+
+
+def test_rejected_source_is_not_reconverted_until_it_changes(source, tmp_path, monkeypatch):
+    handle = CatalogHandle(str(source), str(tmp_path / "store"))
+    write(source, {"koi_period": 1.0})
+    handle.reload()
+    calls = []
+    monkeypatch.setattr("catalog.convert_catalog", lambda *args: calls.append(args))
+    handle.reload()
+    assert calls == []
@@ -0,0 +1,50 @@
+"""Checks the precomputed constellation grid against astropy and its memory-mapped loading."""
+import os
+
+import numpy as np
+import pytest
+
+import constellations
+from constellations import ConstellationGrid, check_grid
+
+
+def test_grid_agrees_with_astropy_away_from_boundaries():
+    pytest.importorskip("astropy")
+    report = check_grid(ConstellationGrid.load(mmap=False), samples=5000)
+    assert report['mismatches_away_from_boundaries'] == 0, report
+
+
+def test_lookup_handles_scalars_arrays_and_missing_coordinates():
+    grid = ConstellationGrid.load(mmap=False)
+    assert grid.lookup(289.2, 47.9) == 'Cygnus'
+    assert list(grid.lookup([10.68, np.nan], [41.27, 0.0])) == ['Andromeda', None]
+
+
+def test_load_maps_one_unpacked_copy(tmp_path):
+    path = tmp_path / "grid.npz"
+    path.write_bytes(open(constellations.CONSTELLATION_GRID_PATH, 'rb').read())
+    packed = ConstellationGrid.load(str(path), mmap=False)
+
+    mapped = ConstellationGrid.load(str(path))
+    assert isinstance(mapped.grid, np.memmap)
+    assert not mapped.grid.flags.writeable
+    assert np.array_equal(mapped.grid, packed.grid)
+    unpacked = [name for name in os.listdir(tmp_path) if name.endswith('.npy')]
+    assert len(unpacked) == 1 and unpacked[0].startswith("grid-")
+
+    again = ConstellationGrid.load(str(path))
+    assert again.lookup(289.2, 47.9) == 'Cygnus'
+    assert os.listdir(tmp_path).count(unpacked[0]) == 1
+
+
+def test_load_falls_back_to_memory_when_the_copy_cannot_be_written(tmp_path, monkeypatch):
+    path = tmp_path / "grid.npz"
+    path.write_bytes(open(constellations.CONSTELLATION_GRID_PATH, 'rb').read())
+
+    def read_only(*args, **kwargs):
+        raise PermissionError("read-only file system")
+    monkeypatch.setattr(constellations.np, "save", read_only)
+
+    grid = ConstellationGrid.load(str(path))
+    assert not isinstance(grid.grid, np.memmap)
+    assert grid.lookup(289.2, 47.9) == 'Cygnus'
@@ -0,0 +1,59 @@
+"""Training-data snapshots: saved once, reloaded offline, never unpickled."""
+import os
+import pickle
+
+import pandas as pd
+import pytest
+
+from model_training import data_loader
+
+CSV = "kepoi_name,koi_disposition,koi_period,koi_prad\nK00001.01,CONFIRMED,2.47,13.0\nK00002.01,CANDIDATE,,1.1\n"
+
+
+class Response:
+    text = CSV
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    calls = []
+    monkeypatch.setattr(data_loader.requests, "get", lambda url, timeout: calls.append(url) or Response())
+    return calls
+
+
+@pytest.fixture(params=[False, True], ids=["csv", "parquet"])
+def parquet(request, monkeypatch):
+    if request.param:
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(data_loader, "PARQUET", request.param)
+    return request.param
+
+
+def test_snapshot_is_reused_offline(tmp_path, downloads, parquet):
+    fresh = data_loader.load_koi_data(snapshot_dir=str(tmp_path))
+    cached = data_loader.load_koi_data(snapshot_dir=str(tmp_path), offline=True)
+    assert len(downloads) == 1
+    pd.testing.assert_frame_equal(cached, fresh)
+    assert cached.attrs["snapshot"] == fresh.attrs["snapshot"]
+    suffixes = {os.path.splitext(name)[1] for name in os.listdir(tmp_path)}
+    assert suffixes == ({".csv", ".latest", ".parquet"} if parquet else {".csv", ".latest"})
+
+
+def test_pickled_frames_are_never_loaded(tmp_path, downloads, parquet):
+    snapshot = data_loader.load_koi_data(snapshot_dir=str(tmp_path)).attrs["snapshot"]
+    base = os.path.join(tmp_path, f"cumulative-{snapshot}")
+    with open(base + ".pkl", "wb") as file:
+        pickle.dump(pd.DataFrame({"planted": [1]}), file)
+    if parquet:
+        os.remove(base + ".parquet")
+    df = data_loader.load_koi_data(snapshot_dir=str(tmp_path), offline=True)
+    assert list(df.columns) == ["kepoi_name", "koi_disposition", "koi_period", "koi_prad"]
+
+
+def test_offline_without_snapshot_raises(tmp_path, downloads):
+    with pytest.raises(RuntimeError, match="No snapshot"):
+        data_loader.load_koi_data(snapshot_dir=str(tmp_path), offline=True)
+    assert downloads == []
@@ -0,0 +1,37 @@
+"""The timed soft-voting path must give what VotingClassifier.predict_proba gives."""
+import numpy as np
+import pytest
+
+pytest.importorskip("sklearn")
+from sklearn.ensemble import VotingClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import GaussianNB
+from sklearn.tree import DecisionTreeClassifier
+
+from model_training.inference import voting_predict_proba
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(300, 6))
+    y = (X[:, 0] + X[:, 1] > 0).astype(int) + (X[:, 2] > 1)
+    return X, y
+
+
+@pytest.mark.parametrize("weights, dropped", [
+    (None, None),
+    ([1.0, 2.0, 0.5], None),
+    ([1.0, 2.0, 0.5], "nb"),
+    (None, "tree"),
+])
+def test_matches_sklearn(data, weights, dropped):
+    X, y = data
+    members = [
+        ("lr", LogisticRegression(max_iter=500)),
+        ("tree", DecisionTreeClassifier(max_depth=4, random_state=0)),
+        ("nb", GaussianNB()),
+    ]
+    members = [(name, "drop" if name == dropped else estimator) for name, estimator in members]
+    model = VotingClassifier(members, voting="soft", weights=weights).fit(X, y)
+    np.testing.assert_allclose(voting_predict_proba(model, X), model.predict_proba(X), atol=1e-12)
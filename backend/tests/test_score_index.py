@@ -0,0 +1,59 @@
+"""Queries on a small synthetic score index checked against a brute-force scan."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from score_index import CLASSES, build_index, check, open_current
+
+
+def fake_score(values):
+    # Deterministic probabilities from the raw inputs; NaN inputs count as 0
+    base = np.nan_to_num(values[:, :3], nan=0.0) + 1.0
+    return base / base.sum(axis=1, keepdims=True)
+
+
+@pytest.fixture
+def index(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 3000
+    df = pd.DataFrame({
+        'kepoi_name': [f"K{i:05d}.01" for i in range(n)],
+        'koi_disposition': rng.choice(['CONFIRMED', 'CANDIDATE', 'FALSE POSITIVE'], n),
+        'koi_pdisposition': rng.choice(['CANDIDATE', 'FALSE POSITIVE'], n),
+        'koi_period': rng.lognormal(2, 1, n),
+        'koi_prad': np.where(rng.random(n) < 0.05, np.nan, rng.lognormal(0.5, 0.8, n)),
+        'koi_teq': rng.normal(900, 300, n).round(),
+        'koi_depth': rng.lognormal(5, 1.5, n),
+    })
+    build_index(df, fake_score, "test-model", str(tmp_path))
+    return open_current(str(tmp_path))
+
+
+def test_random_queries_match_brute_force(index):
+    report = check(os.path.dirname(index.path), queries=200)
+    assert report['mismatches'] == 0, report
+    assert set(report['strategies']) >= {'filter', 'walk'}
+
+
+def test_reversed_range_is_rejected(index):
+    with pytest.raises(ValueError, match="min 2 above max 1"):
+        index.query({'koi_prad': (2, 1)})
+
+
+def test_empty_window_examines_no_rows(index):
+    rows, stats = index.query({'koi_prad': (1e9, None)})
+    assert rows == [] and stats['rows_examined'] == 0
+    rows, stats = index.query({}, {'koi_disposition': 'NOT A DISPOSITION'})
+    assert rows == [] and stats['rows_examined'] == 0
+
+
+def test_results_carry_probabilities_in_class_order(index):
+    rows, _ = index.query({'koi_prad': (None, 2)}, {'koi_disposition': 'CANDIDATE'}, 'CONFIRMED', 5)
+    records = [index.record(row) for row in rows]
+    assert len(records) == 5
+    assert all(record['koi_disposition'] == 'CANDIDATE' and record['koi_prad'] <= 2 for record in records)
+    confirmed = [record['probabilities']['CONFIRMED'] for record in records]
+    assert confirmed == sorted(confirmed, reverse=True)
+    assert list(records[0]['probabilities']) == list(CLASSES)
@@ -0,0 +1,139 @@
+"""CutoutCache against a local HTTP server standing in for SkyView."""
+import asyncio
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from skyview_cache import CutoutCache, CutoutUnavailable, cutout_key, skyview_params
+
+# Room for 3 of the ~10 kB fake images
+MAX_BYTES = 35 * 1024
+
+
+@pytest.fixture
+def skyview():
+    """
+    A stand-in for runquery.pl: answers with a fake JPEG unique to the query,
+    or an HTML error page for Survey=DSS2 Blue. Yields (url, queries seen).
+    """
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            seen.append(query)
+            # As slow as a real render, so concurrent requests overlap
+            time.sleep(0.2)
+            if query.get("Survey") == ["DSS2 Blue"]:
+                body, content_type = b"<html>No coverage</html>", "text/html"
+            else:
+                body = b"\xff\xd8\xff\xe0" + repr(sorted(query.items())).encode().ljust(10000, b".") + b"\xff\xd9"
+                content_type = "image/jpeg"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/runquery.pl", seen
+    server.shutdown()
+
+
+def run(cache, scenario):
+    async def main():
+        try:
+            return await scenario()
+        finally:
+            await cache.aclose()
+    return asyncio.run(main())
+
+
+def test_concurrent_gets_share_one_fetch(skyview, tmp_path):
+    url, seen = skyview
+    cache = CutoutCache(str(tmp_path), max_bytes=MAX_BYTES, url=url)
+    key = cutout_key(286.8, 49.3)
+
+    async def scenario():
+        first = await asyncio.gather(*(cache.get(key) for _ in range(5)))
+        return first, await cache.get(key)
+
+    first, again = run(cache, scenario)
+    assert len(seen) == 1
+    assert seen[0] == {name: [value] for name, value in skyview_params(key).items()}
+    assert all(data == again for data in first)
+    assert again.startswith(b"\xff\xd8")
+    assert cache.hits == 1
+
+
+def test_prefetched_cutouts_are_fetched_once(skyview, tmp_path):
+    url, seen = skyview
+    cache = CutoutCache(str(tmp_path), max_bytes=MAX_BYTES, url=url)
+    keys = [cutout_key(10.0 + i, 20.0) for i in range(2)]
+
+    async def scenario():
+        cache.prefetch(keys)
+        cache.prefetch(keys)
+        while cache._prefetching:
+            await asyncio.sleep(0.01)
+        fetched = len(seen)
+        for key in keys:
+            await cache.get(key)
+        return fetched
+
+    assert run(cache, scenario) == 2
+    assert len(seen) == 2
+    assert cache.hits == 2
+
+
+def test_html_error_page_is_rejected(skyview, tmp_path):
+    url, _ = skyview
+    cache = CutoutCache(str(tmp_path), max_bytes=MAX_BYTES, url=url)
+    key = cutout_key(1.0, 2.0, survey="DSS2 Blue")
+
+    async def scenario():
+        with pytest.raises(CutoutUnavailable):
+            await cache.get(key)
+
+    run(cache, scenario)
+    assert not os.path.exists(cache._path(key))
+    assert cache.fetch_errors == 1
+
+
+def test_least_recently_used_cutout_is_evicted(skyview, tmp_path):
+    url, _ = skyview
+    cache = CutoutCache(str(tmp_path), max_bytes=MAX_BYTES, url=url)
+    oldest = cutout_key(286.8, 49.3)
+    recent = [cutout_key(10.0 + i, 20.0) for i in range(2)]
+
+    async def scenario():
+        for key in [oldest, *recent]:
+            await cache.get(key)
+        os.utime(cache._path(oldest), (0, 0))
+        await cache.get(cutout_key(50.0, 60.0))
+
+    run(cache, scenario)
+    assert not os.path.exists(cache._path(oldest))
+    assert all(os.path.exists(cache._path(key)) for key in recent)
+    assert cache.evictions == 1
+    assert cache._stored_bytes <= MAX_BYTES
+
+
+def test_upstream_failure_is_unavailable(tmp_path):
+    # Nothing listens on port 9 of localhost
+    cache = CutoutCache(str(tmp_path), url="http://127.0.0.1:9/runquery.pl", timeout=2.0)
+
+    async def scenario():
+        with pytest.raises(CutoutUnavailable):
+            await cache.get(cutout_key(1.0, 2.0))
+
+    run(cache, scenario)
+    assert cache.fetch_errors == 1
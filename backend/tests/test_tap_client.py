@@ -0,0 +1,190 @@
+"""TapClient and /api/star-info against a local HTTP server standing in for the TAP service."""
+import asyncio
+import csv
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import pytest
+
+from tap_client import STAR_INFO_COLUMNS, TapClient
+
+COLUMNS = [column.strip() for column in STAR_INFO_COLUMNS.split(',')]
+
+
+class StubTap:
+    """
+    Answers sync TAP queries on pscomppars with one CSV row per hostname in
+    the query (none for names starting with "Unknown"), after `delay`
+    seconds, and records the queries and the most requests handled at once.
+    """
+
+    def __init__(self):
+        self.delay = 0.2
+        self.queries = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)['query'][0]
+                with stub._lock:
+                    stub.queries.append(query)
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                try:
+                    time.sleep(stub.delay)
+                    body = stub.answer(query).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/csv")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (timeout tests)
+                    pass
+                finally:
+                    with stub._lock:
+                        stub.active -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/TAP/sync"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def answer(query):
+        out = StringIO()
+        writer = csv.writer(out)
+        writer.writerow(COLUMNS)
+        for name in re.findall(r"'((?:[^']|'')*)'", query):
+            name = name.replace("''", "'")
+            if not name.startswith("Unknown"):
+                writer.writerow([name, "285.679", "50.241", "G2 V", "1", "2", "120.5"])
+        return out.getvalue()
+
+    def close(self):
+        self.server.shutdown()
+
+
+@pytest.fixture
+def tap():
+    stub = StubTap()
+    yield stub
+    stub.close()
+
+
+def run(client, scenario):
+    async def main():
+        try:
+            return await scenario()
+        finally:
+            await client.aclose()
+    return asyncio.run(main())
+
+
+def test_concurrent_lookups_for_one_host_share_a_query(tap):
+    client = TapClient(tap.url)
+
+    async def scenario():
+        return await asyncio.gather(*(client.fetch_host("Kepler-22") for _ in range(10)))
+
+    rows = run(client, scenario)
+    assert len(tap.queries) == 1
+    assert all(row == rows[0] for row in rows)
+    assert rows[0]["hostname"] == "Kepler-22"
+    assert client._inflight == {}
+
+
+def test_unknown_host_is_none(tap):
+    client = TapClient(tap.url)
+    assert run(client, lambda: client.fetch_host("Unknown-1")) is None
+
+
+def test_quotes_in_hostnames_are_escaped(tap):
+    client = TapClient(tap.url)
+    row = run(client, lambda: client.fetch_host("O'Brien's star"))
+    assert "'O''Brien''s star'" in tap.queries[0]
+    assert row["hostname"] == "O'Brien's star"
+
+
+def test_timeout_raises_and_later_lookups_retry(tap):
+    tap.delay = 1.0
+    client = TapClient(tap.url, timeout=0.2)
+
+    async def scenario():
+        results = await asyncio.gather(*(client.fetch_host("Kepler-22") for _ in range(3)), return_exceptions=True)
+        # A failed query is not cached: the next lookup goes upstream again
+        tap.delay = 0.0
+        return results, await client.fetch_host("Kepler-22")
+
+    results, retried = run(client, scenario)
+    assert all(isinstance(result, httpx.TimeoutException) for result in results)
+    assert retried["hostname"] == "Kepler-22"
+    assert len(tap.queries) == 2
+
+
+def test_upstream_queries_are_bounded(tap):
+    client = TapClient(tap.url, max_concurrency=3)
+
+    async def scenario():
+        return await asyncio.gather(*(client.fetch_host(f"Kepler-{i}") for i in range(12)))
+
+    rows = run(client, scenario)
+    assert [row["hostname"] for row in rows] == [f"Kepler-{i}" for i in range(12)]
+    assert len(tap.queries) == 12
+    assert tap.max_active == 3
+
+
+def test_bulk_lookup_batches_hosts_and_joins_single_lookups(tap):
+    client = TapClient(tap.url)
+
+    async def scenario():
+        bulk = asyncio.ensure_future(client.fetch_hosts(
+            [f"Kepler-{i}" for i in range(5)] + ["Kepler-0", "Unknown-9", "bad\nname"], batch_size=2))
+        await asyncio.sleep(0)
+        single = await client.fetch_host("Kepler-3")
+        return await bulk, single
+
+    found, single = run(client, scenario)
+    # 6 distinct valid names, 2 per query
+    assert len(tap.queries) == 3
+    assert single["hostname"] == "Kepler-3"
+    assert found["Kepler-4"]["hostname"] == "Kepler-4"
+    assert found["Unknown-9"] is None
+    assert isinstance(found["bad\nname"], ValueError)
+
+
+def test_star_info_endpoint_coalesces_and_reports_timeouts(tap, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "get_star_mirror", lambda: None)
+    monkeypatch.setattr(main, "SKYVIEW_PROXY", False)
+
+    async def scenario():
+        main.tap_client = TapClient(tap.url, timeout=0.5)
+        transport = httpx.ASGITransport(app=main.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                answers = await asyncio.gather(*(
+                    http.post("/api/star-info", json={"star_name": "Kepler-22"}) for _ in range(8)))
+                tap.delay = 2.0
+                timed_out = await http.post("/api/star-info", json={"star_name": "Kepler-90"})
+        finally:
+            await main.tap_client.aclose()
+            main.tap_client = None
+        return answers, timed_out
+
+    answers, timed_out = asyncio.run(scenario())
+    assert all(answer.status_code == 200 for answer in answers)
+    assert all(answer.json()["name"] == "Kepler-22" for answer in answers)
+    assert len(tap.queries) == 2
+    assert "error" in timed_out.json()
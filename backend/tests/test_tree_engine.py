@@ -0,0 +1,65 @@
+"""Parity of the compiled flat-array ensemble with the VotingClassifier it came from."""
+import numpy as np
+import pytest
+
+pytest.importorskip("sklearn")
+pytest.importorskip("xgboost")
+pytest.importorskip("catboost")
+pytest.importorskip("imblearn")
+
+from model_training.model import build_catboost, build_ensemble, build_rf, build_xgb  # noqa: E402
+from model_training.tree_engine import CompiledEnsemble, compile_ensemble  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def ensemble():
+    """A small fitted build_ensemble() VotingClassifier on 3-class, 18-feature data."""
+    rng = np.random.default_rng(0)
+    X = rng.normal(0, 1.5, (600, 18))
+    y = (X[:, 0] + X[:, 1] * X[:, 2] > 0).astype(int) + (X[:, 3] > 1).astype(int)
+    model = build_ensemble(
+        build_rf(n_estimators=15, n_jobs=1),
+        build_xgb(n_estimators=15, n_jobs=1),
+        build_catboost(iterations=15, depth=4, thread_count=1, allow_writing_files=False),
+    )
+    return model.fit(X, y)
+
+
+@pytest.fixture(scope="module")
+def rows():
+    # Around the training distribution, with some NaNs, like the check command
+    rng = np.random.default_rng(1)
+    X = rng.normal(0, 1.5, (2000, 18))
+    X[rng.random(X.shape) < 0.01] = np.nan
+    return X
+
+
+def test_compiled_matches_voting_classifier(ensemble, rows):
+    expected = ensemble.predict_proba(rows)
+    actual = compile_ensemble(ensemble).predict_proba(rows)
+    assert np.allclose(actual, expected, atol=1e-6)
+    assert np.array_equal(actual.argmax(axis=1), expected.argmax(axis=1))
+
+
+def test_single_rows_match(ensemble, rows):
+    compiled = compile_ensemble(ensemble)
+    for row in rows[:20]:
+        assert np.allclose(compiled.predict_proba(row[None]), ensemble.predict_proba(row[None]), atol=1e-6)
+
+
+def test_saved_model_round_trips_with_its_source(ensemble, rows, tmp_path):
+    path = str(tmp_path / "compiled_model.npz")
+    compile_ensemble(ensemble).save(path, source="0123456789abcdef")
+    loaded = CompiledEnsemble.load(path)
+    assert loaded.source == "0123456789abcdef"
+    assert np.array_equal(loaded.classes_, ensemble.classes_)
+    assert np.allclose(loaded.predict_proba(rows), ensemble.predict_proba(rows), atol=1e-6)
+
+
+def test_weighted_voting_is_refused(ensemble):
+    ensemble.weights = [1, 2, 1]
+    try:
+        with pytest.raises(ValueError):
+            compile_ensemble(ensemble)
+    finally:
+        ensemble.weights = None